@@ -1,9 +1,50 @@
-import sys, os, re, time, datetime
+import sys, os, re, csv, mmap, time, datetime, argparse, json, hashlib
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime as DT
+from functools import partial
+from contextlib import contextmanager, nullcontext
 from bs4 import BeautifulSoup
+import lxml.html
 import urllib.request
+from tm_html_store import ARCHIVE_EXTENSION, HTMLArchive, is_archive, read_archived_page, get_archived_page_info, \
+    get_archived_page_bytes
+from tm_parse_cache import DEFAULT_CACHE_PATH, get_parse_cache, cached_extract
+from tm_metrics import StageClock, ExtractionMetrics
+from tm_district_roster import DistrictRoster, parse_district_list, is_closed_program_year
+from tm_club_record import RECORD_COLUMNS, ClubRecord, ClubRecordBatch, normalize_row
+from tm_derived_columns import DERIVED_COLUMNS, derive_columns
 
-def extract_Club_data(html):
+# the months of a Toastmasters program year, in program year order (July through June)
+TM_MONTHS = ('7','8','9','10','11','12','1','2','3','4','5','6')
+
+# the columns of the output CSV files - District, the 27 normalized DCP data columns (see tm_club_record.py),
+# Program Year and Month
+DCP_COLUMNS = ("District",) + RECORD_COLUMNS + ("Program Year","Month")
+# the columns that are counts (Mem. Base to Off. List On Time), plus Club Number and Month
+INTEGER_COLUMNS = set(DCP_COLUMNS[6:27]) | {"Club Number", "Month"}
+
+def get_club_status(suspended_date, membership_to_date):
+    ''' Returns the Club status string - 'Suspended <mm/dd/yyyy>', 'Ineligible', 'Low', or 'Active' '''
+    if suspended_date:
+        return f"Suspended {suspended_date}"
+    elif membership_to_date == 0:
+        return "Ineligible"
+    elif membership_to_date < 8:
+        return "Low"
+    else:
+        return "Active"
+
+
+def get_recog_status(recog_status_src):
+    ''' Converts the `src` of a club's recog_status image to the Club Distinguished Status ("", "D", "S", or "P") '''
+    match recog_status_src.lower():
+        case 'images/d.png' : return 'D'
+        case 'images/s.png' : return 'S'
+        case 'images/p.png' : return 'P'
+        case _: return ''
+
+
+def extract_Club_data(html, encoding=None):
     """
     This function parses an input string of web page HTML showing Distinguished Club Program (DCP) data
     (retrieved from dashboards.toastmasters.org/{program year}/Club.aspx?month={month #}&id={district ID}')
@@ -26,9 +67,11 @@ def extract_Club_data(html):
       Club Distinguished Status (str, values "", "D", "S", or "P")
     ]
     total 21 elements (traditional or Pathways periods) or 27 elements (Transitional DCP period)
+
+    `html` can also be the raw bytes of the page, in which case `encoding` is the encoding they are in.
     """
     
-    soup = BeautifulSoup(html, 'lxml')
+    soup = BeautifulSoup(html, 'lxml', from_encoding=encoding)
 
     # create the empty return list:
     dcp_data = []
@@ -91,15 +134,7 @@ def extract_Club_data(html):
                     span_match = re.search('Susp (\d+/\d+/\d+)', span.text)
                     if span_match: 
                         suspended_date = span_match.group(1)
-                if suspended_date:
-                    club_status = f"Suspended {suspended_date}"
-                elif membership_to_date == 0:
-                    club_status = "Ineligible"
-                elif membership_to_date < 8:
-                    club_status = "Low"
-                else:
-                    club_status = "Active"
-                row.append(club_status)
+                row.append(get_club_status(suspended_date, membership_to_date))
                 
                 membership_base = int(club_row.find('th', class_ ='Grid_Table_yellow').text)
                 row.append(membership_base)
@@ -114,12 +149,7 @@ def extract_Club_data(html):
                     row.append(int(each_cell.text))
                 
                 recog_status = club_row.find('img', class_ ='recog_status')['src']
-                match recog_status.lower():
-                    case 'images/d.png' : recog_status = 'D'
-                    case 'images/s.png' : recog_status = 'S'
-                    case 'images/p.png' : recog_status = 'P'
-                    case _: recog_status = ''
-                row.append(recog_status)
+                row.append(get_recog_status(recog_status))
 
                 # the row is complete, so add it to the dcp_data list:
                 dcp_data.append(row)
@@ -128,10 +158,172 @@ def extract_Club_data(html):
     return dcp_data
 
 
+def has_class(element, class_name):
+    ''' lxml helper - True if class_name is one of the element's classes (like BeautifulSoup's class_= matching) '''
+    return class_name in element.get('class', '').split()
+
+
+# lxml HTML parsers for raw bytes in a given encoding, created as they are needed
+_lxml_parsers = {}
+
+
+def extract_Club_data_lxml(html, encoding=None):
+    '''
+    This function returns exactly the same DCP data list as extract_Club_data(), but it uses
+    lxml directly instead of building a BeautifulSoup tree, and makes a single pass over each club row.
+    It mirrors the BeautifulSoup version step by step, so any change to one should be made to the other.
+    `html` can also be the raw bytes of the page, which lxml decodes itself using `encoding`.
+    '''
+    if isinstance(html, bytes) and encoding:
+        if encoding not in _lxml_parsers:
+            _lxml_parsers[encoding] = lxml.html.HTMLParser(encoding=encoding)
+        root = lxml.html.document_fromstring(html, parser=_lxml_parsers[encoding])
+    else:
+        root = lxml.html.document_fromstring(html)
+
+    # create the empty return list:
+    dcp_data = []
+
+    # the divisionArea_grid table encloses all the important content
+    divisionArea_grid = [table for table in root.iter('table') if has_class(table, 'divisionArea_grid')][0]
+
+    division = ""; area = ""
+
+    for each_element in divisionArea_grid:
+        # skip comments and processing instructions - BeautifulSoup doesn't include them in .text
+        if not isinstance(each_element.tag, str):
+            continue
+        element_text = each_element.text_content()
+
+        # see if the current element is a Division subheader (see extract_Club_data() for details)
+        div_match = re.search('Division (.)', element_text)
+        if div_match:
+            area = ""
+            if re.search('Division for Clubs Pending Alignment', element_text):
+                division = '0D'
+            else:
+                division = div_match.group(1)   
+            continue
+        
+        # see if the current element is an Area subheader
+        area_match = re.search('Area (.+?) ', element_text)
+        if area_match:
+            if re.search('Area for Clubs Pending Alignment', element_text):
+                area = '0A'
+            else:
+                area = area_match.group(1)
+            continue
+
+        # see if the current element contains one or more rows with club data
+        for club_row in each_element.iterdescendants('tr'):
+            if not has_class(club_row, 'club_gray'):
+                continue
+
+            club_number = club_name = membership_to_date = membership_base = goals_met = recog_status = None
+            suspended_date = ''
+            goals = []
+            # walk the row once, picking out the first cell of each kind (like BeautifulSoup's .find())
+            for cell in club_row.iterdescendants('span', 'td', 'th', 'img'):
+                classes = cell.get('class', '')
+                class_list = classes.split()
+                if cell.tag == 'span':
+                    if club_number is None and 'redFont' in class_list:
+                        club_number = int(cell.text_content())
+                    elif goals_met is None and 'goalsMetBorder' in class_list:
+                        goals_met = int(cell.text_content())
+                    span_match = re.search('Susp (\d+/\d+/\d+)', cell.text_content())
+                    if span_match:
+                        suspended_date = span_match.group(1)
+                elif cell.tag == 'td':
+                    if club_name is None and 'Grid_Title_top5' in class_list:
+                        club_name = cell.get('title')
+                    elif membership_to_date is None and ' '.join(class_list) == 'Grid_Table title_gray':
+                        membership_to_date = int(cell.text_content())
+                elif cell.tag == 'th':
+                    if membership_base is None and 'Grid_Table_yellow' in class_list:
+                        membership_base = int(cell.text_content())
+                    if 'Grid_Title_goal' in classes:
+                        goals.append(int(cell.text_content()))
+                elif recog_status is None and 'recog_status' in class_list:
+                    recog_status = cell.get('src')
+
+            if None in (club_number, club_name, membership_to_date, membership_base, goals_met, recog_status):
+                # BeautifulSoup would have raised an exception on the missing cell, so do the same
+                raise ValueError(f"incomplete club row in Division {division} Area {area}")
+
+            row = [division, area, club_number, club_name,
+                   get_club_status(suspended_date, membership_to_date),
+                   membership_base, membership_to_date, goals_met]
+            row.extend(goals)
+            row.append(get_recog_status(recog_status))
+
+            # the row is complete, so add it to the dcp_data list:
+            dcp_data.append(row)
+
+    return dcp_data
+
+
+# the available HTML parser engines - extract_Club_data() is the reference implementation
+PARSER_ENGINES = {
+    'bs4': extract_Club_data,
+    'lxml': extract_Club_data_lxml,
+}
+
+DIVISIONAREA_GRID_START = re.compile(r"""<table\b[^>]*\bclass\s*=\s*["']?[^"'>]*\bdivisionArea_grid\b""", re.IGNORECASE)
+TABLE_TAG = re.compile(r'<(/?)table\b', re.IGNORECASE)
+# the same patterns, for raw bytes (see read_and_extract()'s raw_bytes option)
+DIVISIONAREA_GRID_START_BYTES = re.compile(DIVISIONAREA_GRID_START.pattern.encode('ascii'), re.IGNORECASE)
+TABLE_TAG_BYTES = re.compile(TABLE_TAG.pattern.encode('ascii'), re.IGNORECASE)
+
+
+def isolate_divisionArea_grid(html):
+    ''' Returns just the divisionArea_grid table from a page's HTML, so the parser engines don't build a tree for
+        the ViewState, scripts and navigation around it (how much that saves depends on the page layout -
+        in the ./TEST pages, the table is most of the page).
+        The table is found by scanning the raw text for its <table> tag and the matching </table> (counting
+        the tables nested in it). If it can't be found, the whole page is returned, so the engines behave
+        exactly as they do for the full page.
+        `html` can also be bytes, or a memory-mapped page (see read_html_bytes()) - then the table is returned as bytes '''
+    if isinstance(html, str):
+        grid_start, table_tag, tag_end = DIVISIONAREA_GRID_START, TABLE_TAG, '>'
+    else:
+        grid_start, table_tag, tag_end = DIVISIONAREA_GRID_START_BYTES, TABLE_TAG_BYTES, b'>'
+    start = grid_start.search(html)
+    if not start:
+        return html
+    depth = 0
+    for tag in table_tag.finditer(html, start.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            end = html.find(tag_end, tag.end())
+            if end == -1:
+                break
+            return html[start.start():end + 1]
+    return html
+
+
+def extract_from_grid_table(extract, html):
+    ''' Runs a parser engine on the divisionArea_grid table only (see isolate_divisionArea_grid()) '''
+    return extract(isolate_divisionArea_grid(html))
+
+
+def extract_from_bytes(extract, encoding, table_only, page):
+    ''' Runs a parser engine on the raw bytes of a page (or a memory-mapped page), in the given encoding.
+        With `table_only`, only the bytes of the divisionArea_grid table are copied out and parsed '''
+    data = isolate_divisionArea_grid(page) if table_only else page
+    if not isinstance(data, bytes):
+        data = data[:]
+    return extract(data, encoding=encoding)
+
+
 def path_split_full(path):
     path_parts = []
     while path != '':
         parts = os.path.split(path)
+        if parts[0] == path:
+            # an absolute path - os.path.split('/') returns ('/', ''), so stop at the root
+            path_parts.append(parts[0])
+            break
         path_parts.append(parts[1])
         path = parts[0]
     path_parts.reverse()
@@ -166,25 +358,23 @@ def is_valid_TM_program_year(prog_year):
         return True
 
 
-def create_output_CSV(prog_year, month='', district=''):
-    ''' This function creates the output CSV file, writes the header line, and returns the filename 
-        All files are created as ./CSVs/prog_year[_month[_district]].csv (no subdirectories)'''
-
+def get_output_CSV_filename(prog_year, month='', district=''):
+    ''' All output files are named ./CSVs/prog_year[_month[_district]].csv (no subdirectories)'''
     filename = f"./CSVs/{prog_year}"
     if month: filename += f"_{month}"
     if district: filename += f"_{district}"
     filename += ".csv"
+    return filename
+
+
+def create_output_CSV(prog_year, month='', district='', columns=DCP_COLUMNS):
+    ''' This function creates the output CSV file, writes the header line, and returns the filename 
+        (see get_output_CSV_filename()). `columns` is DCP_COLUMNS, plus DERIVED_COLUMNS with --derived-columns '''
+
+    filename = get_output_CSV_filename(prog_year, month, district)
         
     with open(filename, 'w') as fh:
-        fh.write(
-        '"District","Division","Area","Club Number","Club Name",' +
-        '"Club Status","Mem. Base","Active Members","Goals Met",' +
-        '"CCs","Add. CCs","ACs","Add. ACs","CL/AL/DTMs","Add. CL/AL/DTMs",' +
-        '"Level 1s","Level 2s","Add. Level 2s","Level 3s","Level 4s","Level 5s",' +
-        '"New Members","Add. New Members",' +
-        '"Off. Trained Round 1","Off. Trained Round 2",' +
-        '"Mem. dues on time Oct & Apr","Off. List On Time",' +
-        '"Club Distinguished Status","Program Year","Month"\n')
+        fh.write(','.join(f'"{column}"' for column in columns) + '\n')
     return filename
  
 
@@ -192,47 +382,132 @@ def pad_dcp_data_with_zeros(dcp_data, prog_year):
     '''Each dcp_data row can have either 21 columns (traditional or Pathways educational goal only)
        or 27 columns (in the transitional period which included 2018-2019 and 2019-2020).
        In order to be able to compare early and later years to the transitional middle years,
-       we need to add 6 columns of 0s for the traditional (pre-2018) or Pathways (post-2020) periods'''
-    if len(dcp_data) == 21:
-        if prog_year < '2018-2019':
-            dcp_data[14:14] = [0,0,0,0,0,0]
-        elif prog_year > '2019-2020':
-            dcp_data[8:8] = [0,0,0,0,0,0]
+       we need to add 6 columns of 0s for the Pathways goals (pre-2018) or the traditional goals (post-2020).
+       The row is padded in place (and returned) - where the columns go comes from tm_club_record.normalize_row()'''
+    dcp_data[:] = normalize_row(dcp_data, prog_year, 0)
     return dcp_data
        
 
-def format_mixed_list_as_csv_string(mixed_list):
-    csv_string = ''
-    for element in mixed_list:
-        if type(element) == str: 
-            csv_string += f'"{element}",'
-        else:
-            csv_string = csv_string + str(element) + ','
-    if len(csv_string) > 1 and csv_string[-1] == ',':
-        csv_string = csv_string[:-1]
-    return csv_string
+def normalize_dcp_row(row, prog_year, pad_value=None):
+    '''Returns a copy of a dcp_data row with the 27 columns of the transitional period (see pad_dcp_data_with_zeros()).
+       The 6 missing educational goal columns of a 21 column row are filled with `pad_value` - None (empty) by default,
+       which is how DCPCSVWriter writes them to the CSV files (see tm_club_record.normalize_row())'''
+    return normalize_row(row, prog_year, pad_value)
 
 
-def append_dcp_data(dcp_data, district, prog_year, month, output_filename):
-    '''
-        '''
-    output_fh = open(output_filename, 'a')
-    for row in dcp_data:
-        output_fh.write(f'"{district}",')
-        if len(row) == 21:
-            # if the row only has 21 elements, we need to pad it with nulls:
-            if prog_year > '2019-2020':
-                output_fh.write(format_mixed_list_as_csv_string(row[:8]))
-                output_fh.write(',,,,,,,')
-                output_fh.write(format_mixed_list_as_csv_string(row[8:]))
-            else:
-                output_fh.write(format_mixed_list_as_csv_string(row[:14]))
-                output_fh.write(',,,,,,,')
-                output_fh.write(format_mixed_list_as_csv_string(row[14:]))
+def club_row(row, district, prog_year, month, pad_value=None):
+    ''' Returns a dcp_data row as an output row, in DCP_COLUMNS order (see normalize_dcp_row()) '''
+    return [district] + normalize_dcp_row(row, prog_year, pad_value) + [prog_year, month]
+
+
+def format_csv_field(value):
+    ''' Strings are quoted (with any " inside them doubled), numbers are not, and None is written as an empty cell,
+        like the CSV files have always been written - csv.reader reads it back as it was (commas, quotes and line
+        breaks in club names included).
+        The csv module can only do this with QUOTE_STRINGS, which is new in Python 3.12 - QUOTE_NONNUMERIC writes
+        None as "" (so an empty goal cell would read back as an empty string), and QUOTE_MINIMAL leaves the strings
+        unquoted, which would change every line of the files '''
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+def format_csv_row(row):
+    return ','.join(map(format_csv_field, row))
+
+
+class DCPCSVWriter:
+    ''' Appends DCP data rows to an output CSV file (created by create_output_CSV()).
+        The file is kept open until close() is called, and rows are written (see format_csv_row())
+        in batches of BATCH_ROWS, rather than opening the file again for every district.
+        It has the same write_district() / end_month() / close() methods as the other output writers
+        (see process_page_list()).
+        With `derived_columns`, the tm_derived_columns.DERIVED_COLUMNS (Date, Net Growth) are added to each row '''
+
+    BATCH_ROWS = 10000
+
+    def __init__(self, output_filename, derived_columns=False):
+        self.output_filename = output_filename
+        self.derived_columns = derived_columns
+        self.output_fh = open(output_filename, 'a', buffering=1024 * 1024)
+        self.rows = []
+
+    def write_district(self, dcp_data, district, prog_year, month):
+        if self.derived_columns:
+            for row, derived in zip(dcp_data, derive_columns(dcp_data, prog_year, month)):
+                self.rows.append(club_row(row, district, prog_year, month) + derived)
         else:
-            output_fh.write(format_mixed_list_as_csv_string(row))    
-        output_fh.write(f',"{prog_year}","{month}"\n')
-    output_fh.close()
+            # rows with only 21 elements are padded with empty cells (see normalize_dcp_row())
+            self.rows.extend(club_row(row, district, prog_year, month) for row in dcp_data)
+        if len(self.rows) >= self.BATCH_ROWS:
+            self.flush_rows()
+
+    def flush_rows(self):
+        self.output_fh.write(''.join(format_csv_row(row) + '\n' for row in self.rows))
+        self.rows = []
+
+    def end_month(self, prog_year, month):
+        self.flush_rows()
+        self.output_fh.flush()
+
+    def close(self):
+        self.flush_rows()
+        self.output_fh.close()
+
+
+class MonthWriter:
+    ''' Base class for the extractor's output `writers` (see process_page_list()) that write a whole month at once.
+        write_district() keeps each district's rows (club_row()s, with Month as an int) until end_month(), which
+        passes them all to write_month() - the method a subclass implements. A district that is written again
+        replaces its rows '''
+
+    def __init__(self):
+        self.pending = {}
+
+    def write_district(self, dcp_data, district, prog_year, month):
+        self.pending[district] = [club_row(row, district, prog_year, int(month)) for row in dcp_data]
+
+    def end_month(self, prog_year, month):
+        if not self.pending:
+            return
+        districts = list(self.pending)
+        rows = [row for district_rows in self.pending.values() for row in district_rows]
+        self.pending = {}
+        self.write_month(rows, prog_year, month, districts)
+
+    def write_month(self, rows, prog_year, month, districts):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def replacing_file(filename):
+    ''' Gives the name of a temporary file to write `filename`'s new contents to:
+          with replacing_file(filename) as temp_filename:
+              ...
+        It is renamed over `filename` when the with block ends, so readers never see a partly written file
+        (and removed if the block raises) '''
+    temp_filename = filename + '.tmp'
+    try:
+        yield temp_filename
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+    os.replace(temp_filename, filename)
+
+
+def write_csv_file(filename, header, rows):
+    ''' Writes a small CSV file (a header line and `rows`) in place of `filename` - see replacing_file() '''
+    with replacing_file(filename) as temp_filename, open(temp_filename, 'w', newline='') as fh:
+        writer = csv.writer(fh, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows(rows)
+    return filename
 
 
 def log_problem_html(prog_year, month, district):
@@ -242,30 +517,390 @@ def log_problem_html(prog_year, month, district):
         prob_fh.write(f"{prog_year} {month} {district}\n")
 
 
-def process_file_list(files, root, prog_year, month, output_filename):
-    print(f"Program year {prog_year} Month # {month} - Districts processed:")
-    for each_file in files:
-        district, _ext = os.path.splitext(each_file)
-        fullpath = os.path.join(root, each_file)
-        with open(fullpath) as fh:
-            html = fh.read()
-        if 'An error has occured' in html:
-            print(f"\n{fullpath} contains 'An error has occured'", end='')
-            log_problem_html(prog_year, month, district)
-            continue
+def district_sort_key(district):
+    ''' Sort key that puts numbered districts in numeric order (01, 02, ... 125, 126)
+        followed by the lettered ones (F, U) '''
+    if district.isdigit():
+        return (0, int(district), district)
+    return (1, 0, district)
+
+
+def read_html(location):
+    ''' Returns the HTML of one district page. `location` is either the path of an HTML file,
+        or an (archive path, month, district) tuple for a page in a tm_html_store.HTMLArchive '''
+    if isinstance(location, tuple):
+        return read_archived_page(*location)
+    with open(location, encoding=get_saved_page_encoding(location)) as fh:
+        return fh.read()
+
+
+def get_saved_page_encoding(location):
+    ''' The encoding the downloader recorded for a page file in its {district}.meta.json (the charset the server sent),
+        or None for pages saved by older versions, which are in the platform's default encoding '''
+    try:
+        with open(os.path.splitext(location)[0] + '.meta.json') as fh:
+            return json.load(fh).get('encoding')
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def read_html_bytes(location):
+    ''' Gives the raw bytes of one district page, without decoding them:
+          with read_html_bytes(location) as page:
+              ...
+        A file is memory-mapped, so searching it (page.find(), regular expressions) doesn't copy it - slice it
+        (page[:] or page[start:end]) to get bytes. An archived page is decompressed to bytes (always UTF-8) '''
+    if isinstance(location, tuple):
+        yield get_archived_page_bytes(*location)
+        return
+    with open(location, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            # an empty file can't be memory-mapped
+            yield b''
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as page:
+            yield page
+
+
+DECLARED_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([-\w]+)""", re.IGNORECASE)
+
+
+def get_page_encoding(location, page, default_encoding='utf-8'):
+    ''' The encoding of a page's raw bytes: UTF-8 for an archived page, otherwise the encoding recorded
+        by the downloader in the page's {district}.meta.json (the charset the server sent), or a <meta charset>
+        in the first few KB of the page, or `default_encoding` '''
+    if isinstance(location, tuple):
+        return 'utf-8'
+    encoding = get_saved_page_encoding(location)
+    if encoding:
+        return encoding
+    declared = DECLARED_CHARSET.search(page[:4096])
+    if declared:
+        return declared.group(1).decode('ascii')
+    return default_encoding
+
+
+def describe_location(location):
+    if isinstance(location, tuple):
+        archive_path, month, district = location
+        return f"{archive_path}:{month}/{district}"
+    return location
+
+
+def get_page_fingerprint(location):
+    ''' A cheap check for whether a page may have changed, without reading it:
+        [size, modification time] for a file, or [offset, length] in the archive for an archived page '''
+    if isinstance(location, tuple):
+        entry = get_archived_page_info(*location)
+        return [entry['offset'], entry['length']]
+    stat = os.stat(location)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get_page_digest(location):
+    ''' The SHA-1 of the page's raw bytes (so it doesn't depend on the encoding the page is read with) '''
+    with read_html_bytes(location) as page:
+        return hashlib.sha1(page).hexdigest()
+
+
+def get_manifest_filename(output_filename):
+    return os.path.splitext(output_filename)[0] + '.manifest.json'
+
+
+class ExtractionManifest:
+    ''' The manifest used by --incremental extraction. For each page that was extracted into an output file,
+        it records the page's fingerprint (see get_page_fingerprint()), the SHA-1 of its HTML,
+        and the DCP data rows it produced, so unchanged pages don't have to be parsed again.
+        It is kept next to the output file, e.g. ./CSVs/2022-2023.manifest.json for ./CSVs/2022-2023.csv '''
+
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.pages = {}
+        # only the pages seen during this run are saved, so pages that have gone away drop out of the manifest
+        self.seen = {}
         try:
-            dcp_data = extract_Club_data(html)
-        except Exception as e:
-            print(f"\n{fullpath} raised '{e=}' in extract_Club_data()", end='')
-            log_problem_html(prog_year, month, district)
-            continue
-        if dcp_data is None or len(dcp_data) == 0:
-            print(f"\n{fullpath} contains no Club DCP data", end='')
+            with open(path) as fh:
+                manifest = json.load(fh)
+            if manifest.get('version') == self.VERSION:
+                self.pages = manifest['pages']
+        except (OSError, ValueError):
+            pass
+
+    def lookup(self, month, district, location):
+        ''' Returns a (dcp_data, digest) tuple - dcp_data is the saved rows if the page hasn't changed
+            since it was last extracted, otherwise None (and the page needs to be parsed) '''
+        key = f"{month}/{district}"
+        entry = self.pages.get(key)
+        fingerprint = get_page_fingerprint(location)
+        if entry and entry['fingerprint'] == fingerprint:
+            self.seen[key] = entry
+            return entry['rows'], entry['sha1']
+        # the page may have been touched or re-downloaded without changing - if so, there's no need to re-parse it
+        digest = get_page_digest(location)
+        if entry and entry['sha1'] == digest:
+            entry['fingerprint'] = fingerprint
+            self.seen[key] = entry
+            return entry['rows'], digest
+        return None, digest
+
+    def record(self, month, district, location, dcp_data, digest):
+        self.seen[f"{month}/{district}"] = {'fingerprint': get_page_fingerprint(location), 'sha1': digest,
+                                            'rows': dcp_data}
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fh:
+            json.dump({'version': self.VERSION, 'pages': self.seen}, fh)
+        os.replace(temp_path, self.path)
+
+
+def get_page_size(location):
+    ''' The number of bytes read for a page - the file size, or the compressed size of an archived page '''
+    if isinstance(location, tuple):
+        return get_archived_page_info(*location)['length']
+    return os.path.getsize(location)
+
+
+# the dashboards site's error page - e.g. for a district that didn't exist yet
+ERROR_PAGE_SENTINEL = 'An error has occured'
+
+
+def read_and_extract(location, engine='bs4', cache_path=None, cache_max_mb=256, table_only=False, raw_bytes=False,
+                     source_encoding='utf-8'):
+    ''' Reads one district page (see read_html()) and returns a (dcp_data, problem, stats) tuple.
+        `problem` is an empty string if the page was parsed successfully, otherwise it describes
+        what was wrong with the page (and dcp_data is None).
+        `stats` is a dict with the wall clock and CPU seconds spent reading and parsing the page
+        (read_wall, read_cpu, parse_wall, parse_cpu), the `bytes` read, and `error` - the kind of problem
+        ('error_page', 'no_data', or the name of the exception the parser raised), or None.
+        `engine` is one of the PARSER_ENGINES keys.
+        If `cache_path` is supplied, results are looked up in / saved to that tm_parse_cache.ParseCache
+        (capped at `cache_max_mb` MB), so a page that has been parsed before isn't parsed again -
+        stats['parse_cache'] is 'hit' or 'miss' (and None without a cache, or for an error page).
+        With `table_only`, only the divisionArea_grid table is parsed (see isolate_divisionArea_grid()) -
+        the DCP data is the same.
+        With `raw_bytes`, the page is never decoded to a str: it is memory-mapped (see read_html_bytes()),
+        the error page check (and the table_only slicing) run on the bytes, and the parser engine decodes
+        the bytes itself, in the page's encoding (see get_page_encoding() - `source_encoding` is used for pages
+        that don't say what encoding they are in). This doesn't depend on the platform's default encoding.
+        This is a module-level function so that it can be run in a worker process '''
+    clock = StageClock()
+    with read_html_bytes(location) if raw_bytes else nullcontext(read_html(location)) as html:
+        stats = {'bytes': get_page_size(location), 'error': None, 'parse_cache': None}
+        stats['read_wall'], stats['read_cpu'] = clock.lap()
+        dcp_data = None
+        extract = PARSER_ENGINES[engine]
+        if raw_bytes:
+            extract = partial(extract_from_bytes, extract, get_page_encoding(location, html, source_encoding), table_only)
+            is_error_page = html.find(ERROR_PAGE_SENTINEL.encode('ascii')) != -1
+        else:
+            if table_only:
+                extract = partial(extract_from_grid_table, extract)
+            is_error_page = ERROR_PAGE_SENTINEL in html
+        if is_error_page:
+            stats['error'] = 'error_page'
+            problem = f"contains '{ERROR_PAGE_SENTINEL}'"
+        else:
+            try:
+                if cache_path:
+                    dcp_data = cached_extract(html, get_parse_cache(cache_path, cache_max_mb * 1024 * 1024), extract,
+                                              stats)
+                else:
+                    dcp_data = extract(html)
+                problem = ''
+            except Exception as e:
+                stats['error'] = type(e).__name__
+                problem = f"raised '{e=}' in {PARSER_ENGINES[engine].__name__}()"
+            if not problem and (dcp_data is None or len(dcp_data) == 0):
+                dcp_data = None
+                stats['error'] = 'no_data'
+                problem = "contains no Club DCP data"
+    stats['parse_wall'], stats['parse_cpu'] = clock.lap()
+    return dcp_data, problem, stats
+
+
+def process_page_list(pages, prog_year, month, executor=None, reader=read_and_extract, manifest=None, writers=(),
+                      metrics=None):
+    ''' Extracts the DCP data from each of the (district, location) `pages` (see read_html()) and passes it to
+        the write_district() method of each of the `writers` - the extractor's CSV file is written by a DCPCSVWriter,
+        which keeps the file open for the whole run. Districts are always written in district_sort_key() order.
+        If `executor` (a concurrent.futures Executor) is supplied, the pages are parsed in its worker processes,
+        but the results are still written (and any problem pages logged) here, in order.
+        `reader` is read_and_extract(), or a functools.partial of it with the parser engine and cache options.
+        With a `manifest` (ExtractionManifest), only pages that have changed since the last run are parsed -
+        the saved rows are written for the others.
+        The other `writers` are the additional outputs (e.g. tm_sqlite_loader.SQLiteLoader).
+        Each writer's end_month() method is called once the month is done.
+        If `metrics` (a tm_metrics.ExtractionMetrics) is supplied, the read / parse / write times, bytes read,
+        rows and problems of each page are recorded in it '''
+    print(f"Program year {prog_year} Month # {month} - Districts processed:")
+    pages = sorted(pages, key=lambda page: district_sort_key(page[0]))
+    cached = {}
+    if manifest:
+        for district, location in pages:
+            cached[district] = manifest.lookup(month, district, location)
+    locations = [location for district, location in pages if cached.get(district, (None,))[0] is None]
+    if executor:
+        results = executor.map(reader, locations, chunksize=4)
+    else:
+        results = map(reader, locations)
+    for district, location in pages:
+        dcp_data, digest = cached.get(district, (None, None))
+        if dcp_data is None:
+            dcp_data, problem, stats = next(results)
+            if not problem and manifest:
+                manifest.record(month, district, location, dcp_data, digest)
+        else:
+            # rows reused from the manifest - nothing was read or parsed
+            problem, stats = '', None
+        if problem:
+            print(f"\n{describe_location(location)} {problem}", end='')
             log_problem_html(prog_year, month, district)
+            if metrics:
+                metrics.record_page(prog_year, month, district, describe_location(location), 0, stats)
             continue
-        append_dcp_data(dcp_data, district, prog_year, month, output_filename)
+        clock = StageClock()
+        for writer in writers:
+            writer.write_district(dcp_data, district, prog_year, month)
+        if metrics:
+            metrics.record_page(prog_year, month, district, describe_location(location), len(dcp_data), stats, clock.lap())
         sys.stdout.write(district + ' ')
         sys.stdout.flush()
+    clock = StageClock()
+    for writer in writers:
+        writer.end_month(prog_year, month)
+    if metrics:
+        metrics.add_write_times(clock.lap())
+
+
+def check_month_districts(prog_year, month, pages, roster):
+    ''' Compares the districts of a month's (district, location) `pages` with the month's district list in the
+        `roster` cache (a tm_district_roster.DistrictRoster), and prints any district that has no page.
+        If the list hasn't been cached, it is read from the drop-down of the month's Founder's District page
+        (no requests are made). Returns the missing districts, or None if there was no district list to check against '''
+    districts = roster.get(prog_year, month, allow_stale=True)
+    if districts is None:
+        founders_page = dict(pages).get('F')
+        if founders_page is None:
+            return None
+        with read_html_bytes(founders_page) as html:
+            # the drop-down is plain ASCII, whatever encoding the page was saved in
+            districts = parse_district_list(bytes(html).decode('utf-8', errors='replace'))
+        if districts is None:
+            return None
+        if is_closed_program_year(prog_year):
+            roster.put(prog_year, month, districts, describe_location(founders_page))
+    saved = {district for district, _location in pages}
+    missing = [district for district in districts if district not in saved]
+    if missing:
+        print(f"\nProgram year {prog_year} Month # {month} - no pages for {len(missing)} of the {len(districts)} districts: "
+              f"{' '.join(missing)}", end='')
+    return missing
+
+
+def identify_html_source(html_src):
+    ''' Works out what an HTML source path is, from its name and the directories it is in. Returns a tuple
+        (kind, prog_year, month, district), where kind is one of
+          'archive' - a program year archive like ./HTML/2021-2022.htmlarc  (month and district are '')
+          'year'    - a program year directory like ./HTML/2021-2022        (month and district are '')
+          'month'   - a month directory like ./HTML/2020-2021/6             (district is '')
+          'file'    - a single district page like ./HTML/2019-2020/7/01.html
+        Raises ValueError if the path isn't any of these '''
+    html_src = os.path.normpath(html_src)
+    path_parts = path_split_full(html_src)
+    if is_archive(html_src):
+        prog_year = os.path.basename(html_src)[:-len(ARCHIVE_EXTENSION)]
+        if is_valid_TM_program_year(prog_year):
+            return 'archive', prog_year, '', ''
+    elif os.path.isfile(html_src):
+        if len(path_parts) >= 3 and is_valid_TM_program_year(path_parts[-3]) and path_parts[-2] in TM_MONTHS:
+            district, _ext = os.path.splitext(path_parts[-1])
+            return 'file', path_parts[-3], path_parts[-2], district
+    elif os.path.isdir(html_src):
+        if len(path_parts) >= 2 and is_valid_TM_program_year(path_parts[-2]) and path_parts[-1] in TM_MONTHS:
+            return 'month', path_parts[-2], path_parts[-1], ''
+        if len(path_parts) >= 1 and is_valid_TM_program_year(path_parts[-1]):
+            return 'year', path_parts[-1], '', ''
+    raise ValueError(f"{html_src} is not a program year archive, program year directory, month directory or HTML file")
+
+
+def list_month_pages(month_dir):
+    ''' Returns the (district, file path) of each HTML page in a month directory, in district_sort_key() order '''
+    pages = [(os.path.splitext(each_file)[0], os.path.join(month_dir, each_file))
+             for each_file in os.listdir(month_dir) if each_file.endswith('.html')]
+    return sorted(pages, key=lambda page: district_sort_key(page[0]))
+
+
+def iter_source_pages(html_src):
+    ''' Yields a (prog_year, month, district, location) tuple for each district page in an HTML source
+        (see identify_html_source()), in program year month order and then district order.
+        `location` can be passed to read_html() or read_and_extract() '''
+    kind, prog_year, month, district = identify_html_source(html_src)
+    html_src = os.path.normpath(html_src)
+    if kind == 'file':
+        yield prog_year, month, district, html_src
+    elif kind == 'month':
+        for district, location in list_month_pages(html_src):
+            yield prog_year, month, district, location
+    elif kind == 'year':
+        for month in TM_MONTHS:
+            month_dir = os.path.join(html_src, month)
+            if os.path.isdir(month_dir):
+                for district, location in list_month_pages(month_dir):
+                    yield prog_year, month, district, location
+    else:
+        with HTMLArchive(html_src) as archive:
+            archived_pages = archive.pages()
+        for month, district in archived_pages:
+            yield prog_year, month, district, (html_src, month, district)
+
+
+def iter_club_rows(html_src, engine='bs4', pad_value=0, table_only=False):
+    ''' Streams the DCP data from an HTML source - a single district page, a month directory, a program year
+        directory, or a program year archive (see identify_html_source()).
+        Yields one row per club, in the same 30 column order as the output CSV files (DCP_COLUMNS):
+          [District, Division, Area, Club Number, ... Club Distinguished Status, Program Year, Month (int)]
+        The 6 educational goal columns that a program year doesn't have are filled with `pad_value`
+        (0 by default, like pad_dcp_data_with_zeros() - use None for empty cells, like the CSV files).
+        Only one page is parsed at a time, so memory use doesn't grow with the size of the source.
+        Pages that can't be parsed are skipped (the extractor logs them instead - see read_and_extract()).
+        `table_only` parses only the part of each page with the DCP data (see isolate_divisionArea_grid()).
+        e.g.
+          for row in iter_club_rows('./HTML/2021-2022'):
+              record = dict(zip(DCP_COLUMNS, row))
+        '''
+    for prog_year, month, district, location in iter_source_pages(html_src):
+        dcp_data, problem, _stats = read_and_extract(location, engine, table_only=table_only)
+        if problem:
+            continue
+        for row in dcp_data:
+            yield club_row(row, district, prog_year, int(month), pad_value)
+
+
+
+def iter_club_records(html_src, engine='bs4', table_only=False):
+    ''' Like iter_club_rows(), but yields a (prog_year, month, district, record) tuple for each club, where record is
+        a tm_club_record.ClubRecord - a compact form of the row, for holding a lot of them in memory, e.g.
+          records = [record for _py, _m, _d, record in iter_club_records('./HTML/2021-2022.htmlarc')]
+        '''
+    for prog_year, month, district, location in iter_source_pages(html_src):
+        dcp_data, problem, _stats = read_and_extract(location, engine, table_only=table_only)
+        if problem:
+            continue
+        for row in dcp_data:
+            yield prog_year, month, district, ClubRecord.from_dcp_row(row, prog_year)
+
+
+def iter_club_batches(html_src, engine='bs4', table_only=False):
+    ''' Yields a tm_club_record.ClubRecordBatch for each district page of an HTML source (see iter_club_rows()) -
+        the most compact way to hold a lot of club data in memory, e.g. several program years for cross-year analysis '''
+    for prog_year, month, district, location in iter_source_pages(html_src):
+        dcp_data, problem, _stats = read_and_extract(location, engine, table_only=table_only)
+        if not problem:
+            yield ClubRecordBatch(prog_year, month, district, dcp_data)
 
 
 if __name__ == '__main__':
@@ -276,57 +911,152 @@ if __name__ == '__main__':
     if not os.path.exists(f"./LOGS/PROBLEM_HTMLs/"):
         os.makedirs(f"./LOGS/PROBLEM_HTMLs/")
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('html_src', nargs='?', default='',
+                        help="HTML file or directory, e.g. ./HTML/2021-2022, ./HTML/2020-2021/6, or ./HTML/2019-2020/7/01.html, "
+                             "or a program year archive like ./HTML/2021-2022.htmlarc")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes used to parse the HTML files (default 1 - no worker processes)")
+    parser.add_argument('--engine', choices=PARSER_ENGINES.keys(), default='bs4',
+                        help="HTML parser engine - 'bs4' (BeautifulSoup, the default) or 'lxml' (faster, same output)")
+    parser.add_argument('--table-only', action='store_true',
+                        help="only parse the divisionArea_grid table of each page, instead of the whole page "
+                             "(same output, smaller parse trees)")
+    parser.add_argument('--raw-bytes', action='store_true',
+                        help="read the pages as raw bytes (memory-mapped) and let the parser decode them, instead of "
+                             "reading them as text in the platform's default encoding")
+    parser.add_argument('--source-encoding', default='utf-8',
+                        help="--raw-bytes: encoding of pages that don't say what encoding they're in (default utf-8, "
+                             "what the downloader saves; pages saved by older versions on Windows are cp1252)")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH, default=None, metavar='CACHE_PATH',
+                        help=f"keep parsed pages in a cache keyed by the page's SHA-1, so identical pages are never parsed "
+                             f"twice (default {DEFAULT_CACHE_PATH})")
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MB',
+                        help="size cap for --cache, least recently used pages are evicted beyond it (default 256 MB)")
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv',
+                        help="output format - 'csv' (./CSVs/, the default) or 'parquet' (./PARQUET/, partitioned by "
+                             "program year and month - needs pyarrow)")
+    parser.add_argument('--derived-columns', action='store_true',
+                        help=f"add the derived columns ({', '.join(DERIVED_COLUMNS)}) to the CSV file - "
+                             f"see tm_derived_columns.py")
+    parser.add_argument('--sqlite', nargs='?', const='./DB/club_performance.sqlite', default=None, metavar='DB_PATH',
+                        help="also load the extracted data into a SQLite database for all program years "
+                             "(default ./DB/club_performance.sqlite)")
+    parser.add_argument('--deltas', action='store_true',
+                        help="also write each month's changes from the month before to ./DELTAS/{program year}_{month}.csv "
+                             "(see tm_month_deltas.py)")
+    parser.add_argument('--rollups', action='store_true',
+                        help="also write each month's district, division and area totals to ./ROLLUPS/{program year}_{month}.csv "
+                             "(see tm_rollups.py)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only parse the pages that have changed since the last run, reusing the saved rows "
+                             "for the others (kept in ./CSVs/{output name}.manifest.json)")
+    parser.add_argument('--metrics', default=None, metavar='PATH',
+                        help="record read/parse/write times, bytes, rows and problems for every page - appended to PATH "
+                             "as JSON lines, or written as a Prometheus textfile if PATH ends in .prom")
+    parser.add_argument('--profile', choices=('cprofile', 'pyinstrument'), default=None,
+                        help="profile the run, saving the profile in ./LOGS/ (only the main process is profiled, "
+                             "so use --workers 1 to profile the parsing)")
+    parser.add_argument('--check-districts', action='store_true',
+                        help="report districts that are in a month's district list but have no saved page "
+                             "(uses the district roster cache, see tm_district_roster.py - no requests are made)")
+    args = parser.parse_args()
+
     # get the HTML file or directory containing HTML files: 
-    html_src = ''
+    html_src = args.html_src
     while not os.path.exists(html_src):
-        try:
-            html_src = sys.argv[1]
-            assert os.path.exists(html_src)
-        except:
-            print()
-            print("Usage: enter a file or subdirectory of the HTML/ directory")
-            print("e.g. ./HTML/2021-2022, or ./HTML/2020-2021/6, or ./HTML/2019-2020/7/01.html")
-            html_src = input("Enter file or directory: ")
+        print()
+        print("Usage: enter a file or subdirectory of the HTML/ directory")
+        print("e.g. ./HTML/2021-2022, or ./HTML/2020-2021/6, or ./HTML/2019-2020/7/01.html")
+        html_src = input("Enter file or directory: ")
         
     # we now have a valid HTML file or directory, so process it
     html_src = os.path.normpath(html_src)
-    path_parts = path_split_full(html_src)
-    if os.path.isfile(html_src):
-        if len(path_parts) >= 4 and \
-            is_valid_TM_program_year(path_parts[-3]) and \
-            path_parts[-2] in ('7','8','9','10','11','12','1','2','3','4','5','6'):
-            prog_year = path_parts[-3]
-            month = path_parts[-2]
-            district, _ext = os.path.splitext(path_parts[-1])
-            output_filename = create_output_CSV(prog_year, month, district)
-            with open(html_src) as fh:
-                html = fh.read()
-            dcp_data = extract_Club_data(html)
-            append_dcp_data(dcp_data, district, prog_year, month, output_filename)
-
-    elif os.path.isdir(html_src):
-        if len(path_parts) >= 2 and \
-            is_valid_TM_program_year(path_parts[-2]) and \
-            path_parts[-1] in ('7','8','9','10','11','12','1','2','3','4','5','6'):
-            prog_year = path_parts[-2]
-            month = path_parts[-1]
-            # use the prog_year and month to create a CSV file like './CSVs/2022-2023_7.csv' :
-            output_filename = create_output_CSV(prog_year, month)
-            files = os.listdir(html_src)
-            root = html_src
-            process_file_list(files, root, prog_year, month, output_filename)
-
-        elif len(path_parts) >= 1 and is_valid_TM_program_year(path_parts[-1]):
-            prog_year = path_parts[-1]
-            output_filename = create_output_CSV(prog_year)
-            for each_dir in os.walk(html_src):
-                root, _subdirs, files = each_dir
-                if len(files) > 1:
-                    month = os.path.split(root)[-1]
-                    print()
-                    process_file_list(files, root, prog_year, month, output_filename)
-
-    else:
+    try:
+        kind, prog_year, month, district = identify_html_source(html_src)
+    except ValueError:
         print(f"Invalid HTML source directory or file:\n  {html_src}")
         print("Please try again with a valid HTML source directory or file")
         exit()
+    reader = partial(read_and_extract, engine=args.engine, cache_path=args.cache, cache_max_mb=args.cache_size,
+                     table_only=args.table_only, raw_bytes=args.raw_bytes, source_encoding=args.source_encoding)
+    # any additional outputs, as well as the CSV file
+    writers = []
+    if args.format == 'parquet':
+        from tm_parquet_writer import ParquetWriter
+        writers.append(ParquetWriter())
+    if args.sqlite:
+        from tm_sqlite_loader import SQLiteLoader
+        writers.append(SQLiteLoader(args.sqlite))
+    if args.deltas:
+        from tm_month_deltas import MonthDeltaWriter
+        writers.append(MonthDeltaWriter())
+    if args.rollups:
+        from tm_rollups import RollupWriter
+        writers.append(RollupWriter())
+    # the CSV file is only written in the csv format (the name is still used for the --incremental manifest).
+    # It is written through a DCPCSVWriter, which keeps the file open for the whole run.
+    # The CSV file is named after the source, e.g. './CSVs/2022-2023.csv' for a program year or './CSVs/2022-2023_7.csv' for a month
+    if args.format == 'csv':
+        columns = DCP_COLUMNS + DERIVED_COLUMNS if args.derived_columns else DCP_COLUMNS
+        writers.insert(0, DCPCSVWriter(create_output_CSV(prog_year, month, district, columns), args.derived_columns))
+    metrics = ExtractionMetrics(args.metrics) if args.metrics else None
+
+    profile_filename = f"./LOGS/profile_{DT.now().strftime('%Y%m%d_%H%M%S')}"
+    if args.profile == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif args.profile == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+
+    # the --incremental manifest is kept next to the CSV file, e.g. ./CSVs/2022-2023_7_01.manifest.json for a single page
+    manifest = None
+    if args.incremental:
+        manifest = ExtractionManifest(get_manifest_filename(get_output_CSV_filename(prog_year, month, district)))
+
+    if kind == 'file':
+        process_page_list([(district, html_src)], prog_year, month, None, reader, manifest, writers, metrics)
+
+    else:
+        # group the pages by month - iter_source_pages() returns them in program year order (7, 8, ... 5, 6)
+        roster = DistrictRoster() if args.check_districts else None
+        month_pages = {}
+        for _prog_year, page_month, page_district, location in iter_source_pages(html_src):
+            month_pages.setdefault(page_month, []).append((page_district, location))
+        # only start up worker processes if there's more than one file to parse.
+        # The with block shuts them down, even if a page raises
+        with ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else nullcontext() as executor:
+            for page_month, pages in month_pages.items():
+                if kind != 'month':
+                    print()
+                process_page_list(pages, prog_year, page_month, executor, reader, manifest, writers, metrics)
+                if args.check_districts:
+                    check_month_districts(prog_year, page_month, pages, roster)
+    if manifest:
+        manifest.save()
+
+    for writer in writers:
+        writer.close()
+    print()
+
+    if args.profile == 'cprofile':
+        import pstats
+        profiler.disable()
+        profiler.dump_stats(profile_filename + '.prof')
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+        print(f"Profile saved to {profile_filename}.prof")
+    elif args.profile == 'pyinstrument':
+        profiler.stop()
+        with open(profile_filename + '.html', 'w') as fh:
+            fh.write(profiler.output_html())
+        print(profiler.output_text())
+        print(f"Profile saved to {profile_filename}.html")
+
+    if metrics:
+        summary = metrics.close()
+        print(f"{summary['pages']} pages, {summary['rows']} rows in {summary['run_wall']:.1f}s "
+              f"(read {summary['seconds']['read_wall']:.1f}s, parse {summary['seconds']['parse_wall']:.1f}s, "
+              f"write {summary['seconds']['write_wall']:.1f}s) - metrics saved to {args.metrics}")
@@ -1,6 +1,11 @@
-import sys, os, re, time, random
-import urllib.request
-from bs4 import BeautifulSoup
+import sys, os, re, time, random, argparse, asyncio, datetime
+import urllib.parse
+from tm_http_client import (fetch_text, fetch_conditional, call_with_retry, get_circuit_breaker, RetryableError,
+                            DEFAULT_RETRIES)
+from tm_html_store import HTMLDirectoryStore, HTMLArchive, ARCHIVE_EXTENSION, TM_MONTHS
+from tm_crawl_journal import CrawlJournal, DEFAULT_JOURNAL_NAME, DEFAULT_MAX_INVALID_ATTEMPTS
+from tm_district_roster import DistrictRoster, DEFAULT_ROSTER_DIR, parse_district_list, is_closed_program_year
+from Extract_Club_data_from_HTML import ERROR_PAGE_SENTINEL, DIVISIONAREA_GRID_START_BYTES
 
 # today is 2023-05-04 (May the 4th be with you!) -- current TM year 2022-2023 will not be complete until after 2023-06-30
 available_program_years = ('2022-2023',
@@ -8,89 +13,416 @@ available_program_years = ('2022-2023',
        '2015-2016', '2014-2015', '2013-2014', '2012-2013', '2011-2012', '2010-2011',
        '2009-2010', '2008-2009')
 
-program_year = ""
-while program_year not in available_program_years:
-    if len(sys.argv) == 0:
-        print('Enter a valid Toastmasters program year like yyyy-yyyy, or "Q" to quit')
-        print('(Valid full years are currently 2008-2009 through 2021-2022)')
-        program_year = input('Toastmasters program year and (optional) months: ').split(' ')
-        if program_year.lower()[0] == "q":
-            print("Exiting program")
-            exit()
-        elif len(program_year) > 1:
-            months = tuple(program_year[1:])
-            program_year = program_year[0]
-    else:
-        program_year = sys.argv[1]
-
-if program_year == available_program_years[0]:
-    print("You have requested data for the current program year")
-    print("The Toastmasters year runs from July (7) to June (6)")
-    print("Enter the month or months that you want data for, e.g. '7 8 9' or '8 10 12 2 3' ")
-    months = tuple(input("Months:").split())
-else:
-    months = ('7','8','9','10','11','12','1','2','3','4','5','6')
-
-if len(sys.argv) > 2:
-    months = tuple(sys.argv[2:])
-
-for m in months:
-    if m not in ('7','8','9','10','11','12','1','2','3','4','5','6'):
-        print("Invalid month value supplied: ", m)
-        print("Valid month values are 7-12 and 1-6 - exiting program")
-        exit()
+DASHBOARDS_URL = 'http://dashboards.toastmasters.org'
 
-print()
-print(f"Program Year == {program_year}, retrieving months {months}")
-print()
 
-# create the HTML subdirectory if it doesn't already exist)
-if not os.path.exists('./HTML'):
-    print("Creating ./HTML directory")
-    os.makedirs('HTML')
-
-# we'll cycle through the months list and get the available districts each month
-# I don't *think* Toastmasters adds or subtracts/merges districts in the middle of the TM year,
-# but better to be safe than sorry
-for month in months:
-    url = 'http://dashboards.toastmasters.org/{}/Club.aspx?month={}&id={}'
+def get_club_perf_url(program_year, month, base_url=DASHBOARDS_URL):
+    ''' Returns the Club Performance URL template for the program year and month.
+        The template still needs .format(program_year, month, district) '''
+    url = base_url + '/{}/Club.aspx?month={}&id={}'
     # for some reason, July 2022 shows no data "As of 10-Aug-2022", but the previous "As of" day (8/9/2022) is ok
     if program_year == available_program_years[0] and month == '7':
         url += '&day=8/9/2022'
+    return url
+
+
+def fetch_html(url):
+    ''' Returns the decoded HTML of the web page at `url`, using the shared keep-alive connection pool '''
+    return fetch_text(url)
+
+
+# how many times an invalid page is retried within a run - the site sends its error page for a while when it's
+# struggling, but some pages get it every time (the crawl journal gives up on those after a few runs)
+INVALID_PAGE_RETRIES = 2
+
+
+class InvalidPageError(RetryableError):
+    ''' The site sent back a page without the data we asked for - usually its error page.
+        It is retried with backoff like a failed request, but only INVALID_PAGE_RETRIES times '''
+    max_retries = INVALID_PAGE_RETRIES
+
+
+def check_page(html):
+    ''' Raises InvalidPageError if `html` (the bytes of a Club Performance page) is the dashboards error page,
+        or doesn't have the divisionArea_grid table with the club data '''
+    if ERROR_PAGE_SENTINEL.encode('ascii') in html:
+        raise InvalidPageError(f"contains '{ERROR_PAGE_SENTINEL}'")
+    if not DIVISIONAREA_GRID_START_BYTES.search(html):
+        raise InvalidPageError("has no divisionArea_grid table")
+
+
+def fetch_district_list(url, program_year, month, retries=DEFAULT_RETRIES):
+    ''' Returns the list of districts from the drop-down control on the Club Performance page, in drop-down order '''
+    district = "F"   # I assume there will always be a Founder's District
+    page_url = url.format(program_year, month, district)
+
+    def request():
+        districts = parse_district_list(fetch_html(page_url))
+        if districts is None:
+            raise InvalidPageError(f"{page_url} has no district drop-down")
+        return districts
 
-    # create an output directory if it doesn't already exist:
-    if not os.path.exists(f"./HTML/{program_year}/{month}/"):
-        os.makedirs(f"./HTML/{program_year}/{month}/")
+    return call_with_retry(request, retries, get_circuit_breaker(page_url))
+
+
+def get_district_list(url, program_year, month):
+    ''' Returns the list of districts from the drop-down control on the Club Performance page,
+        in reverse order, so we can tell how many we have to go while retrieving '''
+    return fetch_district_list(url, program_year, month)[::-1]
+
+
+def is_page_saved(store, month, district, journal=None):
+    ''' True if the page doesn't need downloading again: it has been saved in `store` and, if there is a crawl journal,
+        the journal says it was saved completely (see tm_crawl_journal.py) '''
+    if journal is None:
+        return store.has_page(month, district)
+    return journal.is_complete(store, month, district)
+
+
+def download_page(url, store, month, district, refresh=False, journal=None, retries=DEFAULT_RETRIES):
+    ''' Saves the page at `url` in `store` (an HTMLDirectoryStore or HTMLArchive from tm_html_store.py),
+        along with its ETag / Last-Modified cache metadata and its encoding.
+        The page is saved exactly as the server sent it (not decoded and re-encoded in the platform's default encoding).
+        If the page has already been saved it is skipped, unless `refresh` is True - then the page is re-requested with
+        If-None-Match / If-Modified-Since, and only re-downloaded if the server says it has changed.
+        With a `journal` (a tm_crawl_journal.CrawlJournal), each attempt and its outcome is recorded in it, and a saved
+        page that the journal doesn't have as complete is downloaded again.
+        Failed requests are retried (up to `retries` more times, with backoff - see tm_http_client.call_with_retry()).
+        Each page is checked with check_page() as it is downloaded - an invalid page is retried (INVALID_PAGE_RETRIES
+        times, counting towards the host's CircuitBreaker), and if it is still invalid it isn't saved (a copy saved
+        earlier is kept), and the journal has it as 'invalid', so the next run tries again. Once the journal has
+        given up on it (see CrawlJournal.has_given_up()), it is only tried again with `refresh`.
+        Returns 'skipped' (no request made), 'given_up' (no request made), 'unchanged' (304 Not Modified),
+        'saved' or 'invalid' '''
+    meta = {}
+    if is_page_saved(store, month, district, journal):
+        if not refresh:
+            return 'skipped'
+        meta = store.get_meta(month, district)
+    elif journal and not refresh and journal.has_given_up(store.program_year, month, district):
+        return 'given_up'
+    if journal:
+        journal.start_task(store.program_year, month, district)
+
+    def request():
+        html, validators = fetch_conditional(url, meta.get('etag'), meta.get('last_modified'))
+        if html is not None:
+            check_page(html)
+        return html, validators
+
+    try:
+        html, validators = call_with_retry(request, retries, get_circuit_breaker(url))
+        if html is not None:
+            # the dashboards pages are UTF-8, and say so in their Content-Type
+            meta = dict(meta, **validators, url=url, checked=datetime.datetime.now().isoformat(timespec='seconds'))
+            meta['encoding'] = validators['encoding'] or 'utf-8'
+            store.write_page(month, district, html, meta)
+            result = 'saved'
+        else:
+            if validators['etag'] or validators['last_modified']:
+                meta = dict(meta, **validators, url=url, checked=datetime.datetime.now().isoformat(timespec='seconds'))
+                store.write_meta(month, district, meta)
+            result = 'unchanged'
+    except InvalidPageError as e:
+        if journal:
+            journal.finish_task(store.program_year, month, district, 'invalid', error=str(e))
+        return 'invalid'
+    except Exception as e:
+        if journal:
+            journal.finish_task(store.program_year, month, district, 'failed', error=repr(e))
+        raise
+    if journal:
+        # record the size and checksum of the page as it was stored (the archive may have re-encoded it)
+        data = store.read_page_bytes(month, district) if result == 'saved' else None
+        journal.finish_task(store.program_year, month, district, result, data)
+    return result
+
+
+def get_month_district_list(url, program_year, month, roster=None, refresh=False, store=None, retries=DEFAULT_RETRIES):
+    ''' Returns get_district_list() for the month - from the `roster` cache (a tm_district_roster.DistrictRoster)
+        if it has been fetched before (unless `refresh`), so it isn't fetched again for every run.
+        For a program year that has ended, the drop-down of the Founder's District page already saved in `store`
+        is used instead of fetching the page again '''
+    if roster is None:
+        return fetch_district_list(url, program_year, month, retries)[::-1]
+
+    def fetch():
+        if store is not None and is_closed_program_year(program_year) and store.has_page(month, 'F'):
+            # the drop-down is plain ASCII, whatever encoding the page was saved in
+            districts = parse_district_list(store.read_page_bytes(month, 'F').decode('utf-8', errors='replace'))
+            if districts:
+                return districts
+        return fetch_district_list(url, program_year, month, retries)
+
+    return roster.get_or_fetch(program_year, month, fetch, refresh, url.format(program_year, month, 'F'))[::-1]
+
+
+def format_result(district, result):
+    ''' How a downloaded district is shown: unchanged pages in parentheses, invalid pages in square brackets
+        (and pages that were given up on, without a request, not at all) '''
+    if result == 'given_up':
+        return ''
+    if result == 'unchanged':
+        return f"({district}) "
+    if result == 'invalid':
+        return f"[{district}] "
+    return district + ' '
+
+
+def download_month(program_year, month, store, districts=None, base_url=DASHBOARDS_URL, refresh=False, journal=None,
+                   roster=None, retries=DEFAULT_RETRIES):
+    ''' Retrieves the Club Performance page of each district for one month, one page at a time,
+        skipping any district that has already been saved in `store`
+        (or, with `refresh`, only re-downloading the saved pages that have changed - see download_page()).
+        If `districts` is supplied, only those districts are retrieved.
+        Returns the districts whose pages were invalid (see download_page()) '''
+    url = get_club_perf_url(program_year, month, base_url)
 
     print(f"Retrieving Club Performance web pages for Program Year {program_year} month {month}: ")
-    print(f"Districts retrieved and saved in ./HTML/{program_year}/{month}/ :")
-    
+    print(f"Districts retrieved and saved in {store.path} :")
+
     # get the list of districts from the drop-down control on the Club Performance page:
-    district = "F"   # I assume there will always be a Founder's District 
-    html = urllib.request.urlopen(url.format(program_year, month, district)).read()
-    soup = BeautifulSoup(html, 'lxml')
-    dist_list = soup.find_all(id='cpContent_TopControls1_ddlDistricts')[0].contents
-    districts = []
-    for dist in dist_list:
-        try:
-            districts.append(dist.attrs['value'])
-        except:
-            pass
-    # reverse the district list, so we can tell how many we have to go while retrieving
-    districts.reverse()
+    district_list = get_month_district_list(url, program_year, month, roster, refresh, store, retries)
+    if districts:
+        district_list = [d for d in district_list if d in districts]
 
     # let's count 'em down:
-    for district in districts:
-        if not os.path.exists(f"./HTML/{program_year}/{month}/{district}.html"):
-            # first, get the page's HTML:
-            html = urllib.request.urlopen(url.format(program_year, month, district)).read().decode()
-            # then write it to the file:
-            with open(f"./HTML/{program_year}/{month}/{district}.html", 'w') as fh:
-                fh.write(html)
-            sys.stdout.write(district + ' ')
+    invalid = []
+    given_up = []
+    for district in district_list:
+        result = download_page(url.format(program_year, month, district), store, month, district, refresh, journal, retries)
+        if result not in ('skipped', 'given_up'):
+            sys.stdout.write(format_result(district, result))
             sys.stdout.flush()
             time.sleep(3 * random.random())
+        if result == 'invalid':
+            invalid.append(district)
+        elif result == 'given_up':
+            given_up.append(district)
 
     print()
     print(f"Finished with Program Year {program_year}, month {month}")
+    if invalid:
+        print(f"Invalid pages (not saved - they will be tried again next time): {' '.join(invalid)}")
+    if given_up:
+        print(f"Not tried (invalid on the last {journal.max_invalid_attempts} runs - --refresh tries them again): "
+              f"{' '.join(given_up)}")
     print()
+
+
+class TokenBucket:
+    ''' A token bucket rate limiter for asyncio tasks:
+        `rate` tokens are added per second, up to `capacity` tokens (the largest allowed burst) '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # the lock makes waiting tasks take their turn in order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    ''' Keeps a separate TokenBucket for each host, so one slow host doesn't hold up the others '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+
+    async def acquire(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.capacity)
+        await self.buckets[host].acquire()
+
+
+async def download_district_async(url, store, month, district, semaphore, rate_limiter, refresh=False, journal=None,
+                                  retries=DEFAULT_RETRIES):
+    ''' Downloads one district page into `store` with download_page() in a worker thread, once there is
+        a free connection slot and a rate limiter token.
+        Returns download_page()'s result, or 'failed' if the request failed '''
+    async with semaphore:
+        await rate_limiter.acquire(url)
+        try:
+            result = await asyncio.to_thread(download_page, url, store, month, district, refresh, journal, retries)
+        except Exception as e:
+            print(f"\n{url} raised '{e=}'")
+            return 'failed'
+    sys.stdout.write(format_result(district, result))
+    sys.stdout.flush()
+    return result
+
+
+async def download_months_async(program_year, months, store, districts=None, base_url=DASHBOARDS_URL,
+                                concurrency=4, rate=1.0, refresh=False, journal=None, roster=None, retries=DEFAULT_RETRIES):
+    ''' Retrieves the Club Performance pages for all the `months` of the program year concurrently.
+        At most `concurrency` requests are in flight at once, and each host gets at most `rate` requests
+        per second (with bursts of up to `concurrency` requests).
+        Districts that have already been saved are skipped (or revalidated with `refresh`), just like download_month() '''
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = HostRateLimiter(rate, concurrency)
+
+    # first get the district list for each month (these requests are rate limited too):
+    urls = {month: get_club_perf_url(program_year, month, base_url) for month in months}
+
+    async def get_month_districts(month):
+        if roster and not refresh:
+            district_list = roster.get(program_year, month)
+            if district_list is not None:
+                return district_list[::-1]
+        async with semaphore:
+            await rate_limiter.acquire(urls[month])
+            return await asyncio.to_thread(get_month_district_list, urls[month], program_year, month, roster, refresh, store,
+                                           retries)
+
+    district_lists = await asyncio.gather(*(get_month_districts(month) for month in months))
+
+    # then queue up every district page that hasn't already been saved, for all the months at once:
+    tasks = []
+    for month, district_list in zip(months, district_lists):
+        if districts:
+            district_list = [d for d in district_list if d in districts]
+        for district in district_list:
+            if refresh or not is_page_saved(store, month, district, journal):
+                url = urls[month].format(program_year, month, district)
+                tasks.append(download_district_async(url, store, month, district, semaphore, rate_limiter, refresh, journal,
+                                                     retries))
+
+    print(f"Retrieving {len(tasks)} Club Performance web pages for Program Year {program_year} months {months}: ")
+    results = await asyncio.gather(*tasks)
+    print()
+    print(f"Finished with Program Year {program_year}: {results.count('saved')} pages saved, "
+          f"{results.count('unchanged')} unchanged, {results.count('invalid')} invalid, {results.count('failed')} failed, "
+          f"{results.count('given_up')} given up on")
+    print()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('program_year', nargs='?', default='',
+                        help="Toastmasters program year like '2019-2020'")
+    parser.add_argument('months', nargs='*',
+                        help="months to retrieve, e.g. '7 8 9' (default: the whole program year)")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="download the pages concurrently, with a rate limit (see --concurrency and --rate)")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="--async mode: maximum number of pages downloaded at the same time (default 4)")
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help="--async mode: maximum number of requests per second to each host (default 1.0)")
+    parser.add_argument('--refresh', action='store_true',
+                        help="re-check pages that have already been saved, and re-download the ones that have changed "
+                             "(uses the saved ETag / Last-Modified - meant for the current program year)")
+    parser.add_argument('--districts', nargs='+',
+                        help="only retrieve these districts, e.g. '--districts 01 55 F'")
+    parser.add_argument('--base-url', default=DASHBOARDS_URL,
+                        help=f"dashboards site to retrieve from (default {DASHBOARDS_URL})")
+    parser.add_argument('--html-dir', default='./HTML',
+                        help="directory the HTML files are saved in (default ./HTML)")
+    parser.add_argument('--archive', action='store_true',
+                        help="save the pages in one compressed archive per program year ({html-dir}/{program year}.htmlarc) "
+                             "instead of one file per page")
+    parser.add_argument('--journal', default=None, metavar='PATH',
+                        help="crawl journal the progress of the downloads is kept in, so an interrupted run can be resumed "
+                             f"where it stopped (default {{html-dir}}/{DEFAULT_JOURNAL_NAME})")
+    parser.add_argument('--no-journal', action='store_true',
+                        help="don't keep a crawl journal (saved pages are skipped without checking they're complete)")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help="times to retry a failed request (a timeout, connection error or 5xx response), with exponential "
+                             f"backoff (default {DEFAULT_RETRIES}). Invalid pages (the site's error page, or a page without "
+                             "the club table) aren't retried until the next run")
+    parser.add_argument('--max-invalid', type=int, default=DEFAULT_MAX_INVALID_ATTEMPTS, metavar='RUNS',
+                        help="stop trying a page once it has been invalid this many runs in a row (until --refresh) - "
+                             f"needs the crawl journal (default {DEFAULT_MAX_INVALID_ATTEMPTS})")
+    parser.add_argument('--roster-dir', default=DEFAULT_ROSTER_DIR,
+                        help="directory the district list of each month is cached in, so it is only fetched once "
+                             f"(kept for good for past program years, for a day for the current one - default {DEFAULT_ROSTER_DIR})")
+    parser.add_argument('--status', action='store_true',
+                        help="show the crawl journal's progress for the program year, and exit")
+    args = parser.parse_args()
+
+    program_year = args.program_year
+    months = tuple(args.months)
+    while program_year not in available_program_years:
+        print('Enter a valid Toastmasters program year like yyyy-yyyy, or "Q" to quit')
+        print('(Valid full years are currently 2008-2009 through 2021-2022)')
+        program_year = input('Toastmasters program year and (optional) months: ').split(' ')
+        if program_year[0].lower().startswith("q"):
+            print("Exiting program")
+            exit()
+        elif len(program_year) > 1:
+            months = tuple(program_year[1:])
+        program_year = program_year[0]
+
+    roster = DistrictRoster(args.roster_dir)
+    journal = None
+    if not args.no_journal:
+        journal = CrawlJournal(args.journal or os.path.join(args.html_dir, DEFAULT_JOURNAL_NAME), args.max_invalid)
+
+    if args.status:
+        if journal is None:
+            exit("--status needs the crawl journal")
+        month_statuses = journal.summary(program_year)
+        for month in TM_MONTHS:
+            if month in month_statuses:
+                district_list = roster.get(program_year, month, allow_stale=True) or []
+                counts = ', '.join(f"{count} {status}" for status, count in sorted(month_statuses[month].items()))
+                print(f"{program_year} month {month:>2}: {len(district_list)} districts listed - {counts}")
+        journal.close()
+        exit()
+
+    if not months:
+        if program_year == available_program_years[0]:
+            print("You have requested data for the current program year")
+            print("The Toastmasters year runs from July (7) to June (6)")
+            print("Enter the month or months that you want data for, e.g. '7 8 9' or '8 10 12 2 3' ")
+            months = tuple(input("Months:").split())
+        else:
+            months = ('7','8','9','10','11','12','1','2','3','4','5','6')
+
+    for m in months:
+        if m not in ('7','8','9','10','11','12','1','2','3','4','5','6'):
+            print("Invalid month value supplied: ", m)
+            print("Valid month values are 7-12 and 1-6 - exiting program")
+            exit()
+
+    print()
+    print(f"Program Year == {program_year}, retrieving months {months}")
+    print()
+
+    # create the HTML subdirectory if it doesn't already exist)
+    if not os.path.exists(args.html_dir):
+        print(f"Creating {args.html_dir} directory")
+        os.makedirs(args.html_dir)
+
+    if args.archive:
+        store = HTMLArchive(os.path.join(args.html_dir, program_year + ARCHIVE_EXTENSION), 'a')
+    else:
+        store = HTMLDirectoryStore(args.html_dir, program_year)
+
+    with store:
+        if args.use_async:
+            asyncio.run(download_months_async(program_year, months, store, args.districts, args.base_url,
+                                              args.concurrency, args.rate, args.refresh, journal, roster, args.retries))
+        else:
+            # we'll cycle through the months list and get the available districts each month
+            # I don't *think* Toastmasters adds or subtracts/merges districts in the middle of the TM year,
+            # but better to be safe than sorry
+            for month in months:
+                download_month(program_year, month, store, args.districts, args.base_url, args.refresh, journal, roster,
+                               args.retries)
+    if journal:
+        journal.close()
@@ -3,6 +3,10 @@ from selenium.webdriver.support.ui import Select
 from random import randint
 import time, os, json, re, sys
 
+# the district roster cache lives in the main scripts' directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tm_district_roster import DistrictRoster
+
 def get_district_selector(driver):
     ''' This helper function takes a Selenium driver that has been already been
     connected to http://dashboards.toastmasters.org, and returns a Selenium
@@ -35,17 +39,24 @@ def select_district(selector, dist):
     return
 
 
-def dump_district_list(selector, filename='TM_district_list.json'):
+def dump_district_list(selector, filename='TM_district_list.json', prog_year='', month=''):
     ''' This helper function writes the list of Toastmasters districts from the drop-down
     control on http://dashboards.toastmasters.org
 
     `selector` is a Selenium Select object created by the get_district_selector() function
 
     `filename` is a string that will be used as the name of the file that this function creates
-    The file will be overwritten if it exists '''
+    The file will be overwritten if it exists
+
+    If `prog_year` and `month` (like '2021-2022' and '6') are supplied, the district numbers are also saved
+    in the district roster cache (see tm_district_roster.py), where the downloaders will find them '''
     fh = open(filename, 'w')
     fh.write(json.dumps([d.text for d in selector.options]))
-    fh.close
+    fh.close()
+    if prog_year and month:
+        # the option values are the district numbers ('01', ... 'F') - the 'Select a District' option has none
+        districts = [d.get_attribute('value') for d in selector.options if d.get_attribute('value')]
+        DistrictRoster().put(prog_year, month, districts, source='selenium')
 
 
 def get_prog_year_selector(driver):
@@ -154,7 +165,14 @@ if __name__ == '__main__':
 
     # now get the list of Districts, using the helper functions defined above,
     # and get the CSV of Club Performance data for each district 
+    if prog_year:
+        # the June (end of year) data is what gets downloaded below, so select June before saving the district
+        # list in the roster cache as June's (the drop-down otherwise has the current month's districts)
+        select_month(driver, 'Jun')
+        time.sleep(randint(1,5))
     district_selector = get_district_selector(driver)
+    if prog_year:
+        dump_district_list(district_selector, prog_year=prog_year, month='6')
     district_list = [d.text for d in district_selector.options]
     if district_list[0] == 'Select a District': district_list = district_list[1:]
     district_list.reverse()
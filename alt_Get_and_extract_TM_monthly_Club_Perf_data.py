@@ -1,7 +1,7 @@
 import sys, os, re, time, argparse
 from bs4 import BeautifulSoup
-import urllib.request
 import sqlite3
+from tm_http_client import fetch_text
 
 def get_district_performance_html(program_year, district,  month=6):
     filename = f"./DEV/{program_year}/{month}/{district}.html"
@@ -12,7 +12,7 @@ def get_district_performance_html(program_year, district,  month=6):
     url = f"http://dashboards.toastmasters.org/{program_year}/district.aspx?id={district}&month={month}"
     if not os.path.exists(f"./DEV/{program_year}/{month}/"):
         os.makedirs(f"./DEV/{program_year}/{month}")
-    district_perf_html = urllib.request.urlopen(url).read().decode()
+    district_perf_html = fetch_text(url)
     with open(filename, 'w') as fh:
         fh.write(district_perf_html)
     return district_perf_html
@@ -37,7 +37,7 @@ def get_club_html(club_number, program_year, month):
     url = f"http://dashboards.toastmasters.org/{program_year}/ClubReport.aspx?id={club_number}&month={month}"
     # if not os.path.exists(f"./DEV/{program_year}/{month}/"):
     #     os.makedirs(f"./DEV/{program_year}/{month}")
-    club_html = urllib.request.urlopen(url).read().decode()
+    club_html = fetch_text(url)
     with open(filename, 'w') as fh:
         fh.write(club_html)
     return club_html
@@ -0,0 +1,177 @@
+import os, sys, json, time, platform, argparse, tempfile, subprocess, importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import partial
+from datetime import datetime as DT
+
+from Extract_Club_data_from_HTML import PARSER_ENGINES, DCPCSVWriter, iter_source_pages, read_and_extract, process_page_list
+from tm_metrics import StageClock, ExtractionMetrics
+
+# Benchmarks the extractor over a corpus of saved pages (./TEST by default - 2012-2013, 2016-2017 and 2022-2023,
+# so both the pre-Pathways and the Pathways page layouts are covered).
+# Each combination of parser engine and output format is run in a fresh worker process, through the extractor's own
+# read_and_extract() and process_page_list() (reading the pages as raw bytes, like --raw-bytes), and reports
+# pages/sec, rows/sec, the peak RSS of the process, and the time spent in each stage (from tm_metrics):
+#   read  - reading the page from disk (or an archive)
+#   parse - extract_Club_data() / extract_Club_data_lxml()
+#   write - the output writer (DCPCSVWriter, tm_sqlite_loader.SQLiteLoader or tm_parquet_writer.ParquetWriter)
+# The results are saved as JSON in ./BENCHMARKS/, named by date and git commit, so runs on different commits
+# can be compared with --compare, e.g.
+#   python ./benchmark_extractor.py
+#   python ./benchmark_extractor.py --engines lxml --formats csv sqlite --compare ./BENCHMARKS/20230601_120000_1a2b3c4.json
+
+OUTPUT_FORMATS = ('none', 'csv', 'sqlite', 'parquet')
+
+# the encoding of pages that don't say what they're in - the ./TEST pages were saved on Windows, as cp1252
+DEFAULT_SOURCE_ENCODING = 'cp1252'
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def get_peak_rss_mb():
+    ''' Peak resident set size of this process in MB, or None where the resource module isn't available (Windows) '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KB everywhere else
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def open_writer(output_format, output_dir):
+    if output_format == 'csv':
+        return DCPCSVWriter(os.path.join(output_dir, 'benchmark.csv'))
+    if output_format == 'sqlite':
+        from tm_sqlite_loader import SQLiteLoader
+        return SQLiteLoader(os.path.join(output_dir, 'benchmark.sqlite'))
+    if output_format == 'parquet':
+        from tm_parquet_writer import ParquetWriter
+        return ParquetWriter(os.path.join(output_dir, 'PARQUET'))
+    return None
+
+
+def run_benchmark(sources, engine, output_format, source_encoding=DEFAULT_SOURCE_ENCODING, table_only=False):
+    ''' Extracts every page of the `sources` with one engine and output format, and returns the measurements.
+        This runs in its own worker process (see main()), so the peak RSS belongs to this run only '''
+    reader = partial(read_and_extract, engine=engine, table_only=table_only, raw_bytes=True,
+                     source_encoding=source_encoding)
+    sources = [os.path.abspath(source) for source in sources]
+    start_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as output_dir:
+        # process_page_list() logs problem pages to ./LOGS/PROBLEM_HTMLs/
+        os.chdir(output_dir)
+        os.makedirs('./LOGS/PROBLEM_HTMLs')
+        try:
+            writer = open_writer(output_format, output_dir)
+            writers = [writer] if writer else []
+            metrics = ExtractionMetrics(os.path.join(output_dir, 'metrics.jsonl'))
+            start = time.perf_counter()
+            # the extractor's progress output isn't part of the benchmark
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                for source in sources:
+                    month_pages = {}
+                    for prog_year, month, district, location in iter_source_pages(source):
+                        month_pages.setdefault((prog_year, month), []).append((district, location))
+                    for (prog_year, month), pages in month_pages.items():
+                        process_page_list(pages, prog_year, month, None, reader, None, writers, metrics)
+                clock = StageClock()
+                for writer in writers:
+                    writer.close()
+                metrics.add_write_times(clock.lap())
+            total_seconds = time.perf_counter() - start
+            summary = metrics.close()
+        finally:
+            os.chdir(start_dir)
+    problems = sum(summary['errors'].values())
+    pages = summary['pages'] - problems
+    return {
+        'engine': engine,
+        'format': output_format,
+        'table_only': table_only,
+        'pages': pages,
+        'rows': summary['rows'],
+        'problem_pages': problems,
+        'seconds': {stage: summary['seconds'][f'{stage}_wall'] for stage in ('read', 'parse', 'write')}
+                   | {'total': round(total_seconds, 4)},
+        'pages_per_sec': round(pages / total_seconds, 2),
+        'rows_per_sec': round(summary['rows'] / total_seconds, 1),
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+
+
+def format_result(result, previous=None):
+    line = (f"{result['engine']:>5} {result['format']:>8} {result['pages']:>6} {result['rows']:>8} "
+            f"{result['pages_per_sec']:>10.1f} {result['rows_per_sec']:>11.0f} "
+            f"{result['seconds']['read']:>7.2f} {result['seconds']['parse']:>7.2f} {result['seconds']['write']:>7.2f} "
+            f"{result['seconds']['total']:>7.2f} {result['peak_rss_mb'] or 0:>8.1f}")
+    if previous:
+        change = result['seconds']['total'] / previous['seconds']['total'] - 1
+        line += f"  {change:+.1%} vs {previous['seconds']['total']:.2f}s"
+    return line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sources', nargs='*', default=['./TEST/2012-2013', './TEST/2016-2017', './TEST/2022-2023'],
+                        help="program year directories or archives to extract (default: the ./TEST corpus)")
+    parser.add_argument('--engines', nargs='+', choices=PARSER_ENGINES.keys(), default=list(PARSER_ENGINES.keys()))
+    parser.add_argument('--formats', nargs='+', choices=OUTPUT_FORMATS, default=['none', 'csv', 'sqlite', 'parquet'],
+                        help="output formats to benchmark - 'none' measures reading and parsing only "
+                             "(parquet is skipped if pyarrow isn't installed)")
+    parser.add_argument('--table-only', action='store_true',
+                        help="parse only the divisionArea_grid table of each page (like the extractor's --table-only)")
+    parser.add_argument('--repeat', type=int, default=1, help="run each benchmark this many times and keep the fastest")
+    parser.add_argument('--source-encoding', default=DEFAULT_SOURCE_ENCODING,
+                        help=f"encoding of pages that don't say what encoding they're in (default {DEFAULT_SOURCE_ENCODING}, "
+                             f"what the ./TEST pages were saved in - pages saved by the current downloader record theirs)")
+    parser.add_argument('--output', default=None,
+                        help="JSON results file (default ./BENCHMARKS/{date}_{time}_{git commit}.json)")
+    parser.add_argument('--compare', default=None, metavar='JSON_FILE',
+                        help="an earlier results file to compare the total times against")
+    args = parser.parse_args()
+
+    formats = args.formats
+    if 'parquet' in formats and importlib.util.find_spec('pyarrow') is None:
+        print("pyarrow is not installed - skipping the parquet format")
+        formats = [f for f in formats if f != 'parquet']
+
+    previous_results = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            previous_results = {(r['engine'], r['format'], r.get('table_only', False)): r
+                                for r in json.load(fh)['results']}
+
+    commit = get_git_commit()
+    print(f"Benchmarking {', '.join(args.sources)} at commit {commit}")
+    print("engine   format  pages     rows  pages/sec    rows/sec    read   parse   write   total  peak MB")
+    results = []
+    for engine in args.engines:
+        for output_format in formats:
+            runs = []
+            for _ in range(args.repeat):
+                # a fresh process for each run, so the peak RSS and any caches belong to that run only
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    runs.append(executor.submit(run_benchmark, args.sources, engine, output_format,
+                                                args.source_encoding, args.table_only).result())
+            result = min(runs, key=lambda run: run['seconds']['total'])
+            results.append(result)
+            print(format_result(result, previous_results.get((engine, output_format, args.table_only))))
+
+    output_filename = args.output
+    if output_filename is None:
+        os.makedirs('./BENCHMARKS', exist_ok=True)
+        output_filename = f"./BENCHMARKS/{DT.now().strftime('%Y%m%d_%H%M%S')}_{commit or 'unknown'}.json"
+    with open(output_filename, 'w') as fh:
+        json.dump({'commit': commit, 'timestamp': DT.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(), 'platform': platform.platform(),
+                   'cpu_count': os.cpu_count(), 'sources': args.sources, 'repeat': args.repeat,
+                   'table_only': args.table_only,
+                   'results': results}, fh, indent=2)
+    print(f"Results saved to {output_filename}")
@@ -1,35 +1,54 @@
-import csv, argparse, os
+import csv, argparse, os, shutil
+
+from tm_derived_columns import DERIVED_COLUMNS, derive_csv_columns
+
+# Adds the derived columns (Date, and Net Growth - see tm_derived_columns.py) to an extracted CSV file, e.g.
+#   python ./create_datestamp_in_CSV_data_file.py ./CSVs/2021-2022.csv
+# The extractor can add them as it goes instead (python ./Extract_Club_data_from_HTML.py ./HTML/2021-2022 --derived-columns).
+# If the file already has any of the columns, they are worked out again rather than added twice.
+# The new file is written alongside the original, and only renamed over it once it's complete, so the original
+# is untouched if anything goes wrong. A copy of the original is kept as {name}_orig.csv, unless --no-backup.
+
+# rows read and written at a time
+BATCH_ROWS = 10000
 
-# get the filename
 parser = argparse.ArgumentParser()
 parser.add_argument('csv_file')
-csv_file = parser.parse_args().csv_file
+parser.add_argument('--no-backup', action='store_true', help="don't keep a copy of the original file")
+args = parser.parse_args()
+csv_file = args.csv_file
 
-# rename the source file so we can use the original csv_file as the output file
 path, orig_name = os.path.split(csv_file)
 fn, ext = os.path.splitext(orig_name)
-sourcefile = os.path.join(path, fn + '_orig' + ext)
-os.rename(csv_file, sourcefile)
+backup_file = os.path.join(path, fn + '_orig' + ext)
+temp_file = csv_file + '.tmp'
 
-DAYS = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
-#try:
-infile = open(sourcefile, newline='')
-outfile = open(csv_file, 'w', newline='')
-reader = csv.DictReader(infile)
-writer = csv.DictWriter(outfile, fieldnames = reader.fieldnames + ['Date'])
-writer.writeheader()
-for row in reader:
-    years = tuple(map(int, row['Program Year'].split('-')))
-    month = int(row['Month'])
-    if month < 7:
-        year = years[1]
-    else:
-        year = years[0]
-    day = DAYS[month]
-    if (month == 2) and (year % 4 == 0): day = 29
-    row['Date'] = f"{year}-{month:02d}-{day:02d}"
-    writer.writerow(row)
+try:
+    with open(csv_file, newline='') as infile, open(temp_file, 'w', newline='') as outfile:
+        reader = csv.reader(infile)
+        writer = csv.writer(outfile)
+        header = next(reader)
+        # the columns the file already has are replaced
+        kept = [i for i, column in enumerate(header) if column not in DERIVED_COLUMNS]
+        header_out = [header[i] for i in kept] + list(DERIVED_COLUMNS)
+        writer.writerow(header_out)
+        while True:
+            rows = [row for _, row in zip(range(BATCH_ROWS), reader)]
+            if not rows:
+                break
+            derived = derive_csv_columns(rows, header)
+            writer.writerows([row[i] for i in kept] + values for row, values in zip(rows, derived))
+except BaseException:
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    raise
 
-# except Exception as e:
-#     print('Something went wrong - did you supply a valid input file on the command line?')
-#     print(e)
\ No newline at end of file
+if not args.no_backup:
+    # the original stays at csv_file until the new file replaces it, so link (or copy) it rather than renaming it
+    if os.path.exists(backup_file):
+        os.remove(backup_file)
+    try:
+        os.link(csv_file, backup_file)
+    except OSError:
+        shutil.copy2(csv_file, backup_file)
+os.replace(temp_file, csv_file)
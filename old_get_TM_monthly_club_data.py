@@ -1,6 +1,7 @@
 import sys, os, re, time
 from bs4 import BeautifulSoup
-import urllib.request
+from tm_http_client import fetch, fetch_text
+from tm_district_roster import DistrictRoster, parse_district_list
 
 # today is 2023-05-04 (May the 4th be with you!) -- current TM year 2022-2023 will not be complete until after 2023-06-30
 available_program_years = ('2022-2023',
@@ -52,22 +53,17 @@ for month in months:
         '"Mem. dues on time Oct & Apr","Off. List On Time",' +
         '"Club Distinguished Status","Program Year","Month"\n')
     
-    # get the list of districts from the drop-down control on the Club Performance page:
+    # get the list of districts from the drop-down control on the Club Performance page
+    # (or from the district roster cache, if it has been fetched before - see tm_district_roster.py):
     district = "F"   # I assume there will always be a Founder's District 
-    html = urllib.request.urlopen(url.format(program_year, month, district)).read()
-    soup = BeautifulSoup(html, 'lxml')
-    dist_list = soup.find_all(id='cpContent_TopControls1_ddlDistricts')[0].contents
-    districts = []
-    for dist in dist_list:
-        try:
-            districts.append(dist.attrs['value'])
-        except:
-            pass
+    districts = DistrictRoster().get_or_fetch(program_year, str(month),
+                                              lambda: parse_district_list(fetch_text(url.format(program_year, month, district))),
+                                              source=url.format(program_year, month, district))
 
     # now we can go through the list of districts:
     for district in districts:
         # first, get the page's HTML and parse it:
-        html = urllib.request.urlopen(url.format(program_year, month, district)).read()
+        html = fetch(url.format(program_year, month, district))
         soup = BeautifulSoup(html, 'lxml')
 
         # the divisionArea_grid table encloses all the important content
@@ -0,0 +1,107 @@
+import os, gzip, random, argparse, urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# This is a stand-in for dashboards.toastmasters.org, for trying out the downloaders without hitting the real site.
+# It serves the saved pages in a ./HTML-style directory tree (e.g. ./TEST) at the same URLs as the real site:
+#   http://localhost:8000/{program year}/Club.aspx?month={month}&id={district}  ->  {root}/{program year}/{month}/{district}.html
+# e.g.
+#   python ./stub_dashboards_server.py ./TEST
+#   python ./Get_TM_monthly_Club_Perf_HTML.py 2022-2023 1 2 --async --base-url http://localhost:8000 --html-dir ./STUB_HTML --districts 01 02 55 F U
+# With --flaky 0.3, it behaves like the real site on a bad evening: 30% of the requests get a 503 or the site's error page.
+
+ERROR_PAGE = b"<html><body><h2>An error has occured while processing your request.</h2></body></html>"
+
+
+class StubDashboardsHandler(BaseHTTPRequestHandler):
+    # the directory tree to serve and the encoding its files were saved with - set by serve()
+    root = './TEST'
+    source_encoding = 'cp1252'
+    # the fraction of requests that fail (see --flaky)
+    flaky = 0.0
+    # keep-alive, like the real site
+    protocol_version = 'HTTP/1.1'
+
+    def page_filename(self):
+        ''' Maps a Club.aspx URL to a saved HTML file, or returns None if there isn't one '''
+        url = urllib.parse.urlsplit(self.path)
+        path_parts = url.path.strip('/').split('/')
+        query = urllib.parse.parse_qs(url.query)
+        if len(path_parts) != 2 or path_parts[1].lower() != 'club.aspx' or 'month' not in query or 'id' not in query:
+            return None
+        filename = os.path.join(self.root, path_parts[0], query['month'][0], query['id'][0] + '.html')
+        if not os.path.isfile(filename):
+            return None
+        return filename
+
+    def not_modified(self, etag, mtime):
+        ''' True if the request's If-None-Match / If-Modified-Since headers match the current file '''
+        if self.headers.get('If-None-Match'):
+            return self.headers['If-None-Match'] == etag
+        if self.headers.get('If-Modified-Since'):
+            try:
+                return mtime <= parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def do_GET(self):
+        filename = self.page_filename()
+        if filename is None:
+            self.send_error(404)
+            return
+        if random.random() < self.flaky:
+            if random.random() < 0.5:
+                self.send_error(503)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(ERROR_PAGE)))
+            self.end_headers()
+            self.wfile.write(ERROR_PAGE)
+            return
+        # validators for conditional GETs, based on the saved file (the real site may not send these)
+        stat = os.stat(filename)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        last_modified = formatdate(int(stat.st_mtime), usegmt=True)
+        if self.not_modified(etag, int(stat.st_mtime)):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            return
+        # the saved files are in the encoding of the machine that saved them - serve them as UTF-8 like the real site
+        with open(filename, encoding=self.source_encoding) as fh:
+            body = fh.read().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(root, port=8000, source_encoding='cp1252', flaky=0.0):
+    StubDashboardsHandler.root = root
+    StubDashboardsHandler.source_encoding = source_encoding
+    StubDashboardsHandler.flaky = flaky
+    server = ThreadingHTTPServer(('localhost', port), StubDashboardsHandler)
+    print(f"Serving {root} at http://localhost:{server.server_port}/")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', nargs='?', default='./TEST',
+                        help="directory tree of saved pages, laid out like ./HTML (default ./TEST)")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--source-encoding', default='cp1252',
+                        help="encoding the saved pages were written with (default cp1252, like the ./TEST pages)")
+    parser.add_argument('--flaky', type=float, default=0.0, metavar='FRACTION',
+                        help="fail this fraction of the requests, with a 503 or the site's error page (default 0)")
+    args = parser.parse_args()
+    serve(args.root, args.port, args.source_encoding, args.flaky)
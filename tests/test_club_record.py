@@ -0,0 +1,32 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Extract_Club_data_from_HTML import pad_dcp_data_with_zeros
+from tm_club_record import RECORD_COLUMNS, TRADITIONAL_GOALS, PATHWAYS_GOALS
+
+# a 21 column row: the leading columns, 12 goal columns numbered 1-12, then Club Distinguished Status
+LEADING = ['01', 'A', 977, 'A Club', 'Active', 20, 22, 3]
+GOALS = list(range(1, 13))
+
+
+def test_pad_traditional_row():
+    row = LEADING + GOALS + ['D']
+    assert pad_dcp_data_with_zeros(row, '2015-2016') is row
+    assert len(row) == len(RECORD_COLUMNS)
+    first_pathways = RECORD_COLUMNS.index(PATHWAYS_GOALS[0])
+    assert row[first_pathways:first_pathways + 6] == [0] * 6
+    assert row[first_pathways - 6:first_pathways] == GOALS[:6]
+
+
+def test_pad_pathways_row():
+    row = LEADING + GOALS + ['D']
+    pad_dcp_data_with_zeros(row, '2022-2023')
+    first_traditional = RECORD_COLUMNS.index(TRADITIONAL_GOALS[0])
+    assert row[first_traditional:first_traditional + 6] == [0] * 6
+    assert row[first_traditional + 6:-1] == GOALS
+
+
+def test_transitional_row_is_unchanged():
+    row = LEADING + list(range(1, 19)) + ['D']
+    assert pad_dcp_data_with_zeros(list(row), '2018-2019') == row
@@ -0,0 +1,21 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tm_district_roster import DistrictRoster
+
+
+def test_get_or_fetch_caches_the_fetched_list(tmp_path):
+    roster = DistrictRoster(str(tmp_path))
+    assert roster.get_or_fetch('2021-2022', '6', lambda: ['01', '02', 'F']) == ['01', '02', 'F']
+    assert roster.get_or_fetch('2021-2022', '6', lambda: pytest.fail("fetched again")) == ['01', '02', 'F']
+
+
+def test_get_or_fetch_doesnt_cache_a_missing_list(tmp_path):
+    roster = DistrictRoster(str(tmp_path))
+    with pytest.raises(ValueError, match='no district drop-down'):
+        roster.get_or_fetch('2021-2022', '6', lambda: None, source='http://example/F')
+    assert roster.get('2021-2022', '6') is None
+    assert not os.path.exists(roster.roster_filename('2021-2022', '6'))
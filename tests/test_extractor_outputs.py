@@ -0,0 +1,100 @@
+import os, sys, shutil, subprocess
+
+import pytest
+
+# Regression tests for the extractor's output paths: each one runs Extract_Club_data_from_HTML.py on the ./TEST pages
+# (in a temporary directory, since it writes to ./CSVs) and compares the CSV file with a plain serial run
+# (the default bs4 engine, in one process, of the TEST/2022-2023 pages as they are).
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = os.path.join(REPO_DIR, 'TEST')
+
+# the ./TEST pages were saved on Windows, in cp1252
+TEST_ENCODING = 'cp1252'
+
+
+def run_script(script, args, cwd):
+    return subprocess.run([sys.executable, os.path.join(REPO_DIR, script)] + list(args),
+                          cwd=cwd, check=True, capture_output=True, text=True)
+
+
+def extract(cwd, html_src, *options, output='2022-2023.csv'):
+    ''' Runs the extractor and returns the bytes of the CSV file it wrote (./CSVs/{output}) '''
+    run_script('Extract_Club_data_from_HTML.py', [html_src] + list(options), cwd)
+    with open(os.path.join(cwd, 'CSVs', output), 'rb') as fh:
+        return fh.read()
+
+
+@pytest.fixture(scope='module')
+def serial_csv(tmp_path_factory):
+    ''' The CSV file of a plain serial run - the pages are only readable as bytes, since they aren't in UTF-8 '''
+    return extract(tmp_path_factory.mktemp('serial'), os.path.join(TEST_DIR, '2022-2023'),
+                   '--raw-bytes', '--source-encoding', TEST_ENCODING)
+
+
+@pytest.fixture(scope='module')
+def archive_dir(tmp_path_factory):
+    ''' A directory with TEST/2022-2023 packed into ./HTML/2022-2023.htmlarc '''
+    work_dir = tmp_path_factory.mktemp('archive')
+    shutil.copytree(os.path.join(TEST_DIR, '2022-2023'), work_dir / 'HTML' / '2022-2023')
+    run_script('tm_html_store.py', ['pack', 'HTML/2022-2023', '--source-encoding', TEST_ENCODING], work_dir)
+    shutil.rmtree(work_dir / 'HTML' / '2022-2023')
+    return work_dir
+
+
+@pytest.mark.parametrize('options', [
+    ['--workers', '4'],
+    ['--engine', 'lxml'],
+    ['--engine', 'lxml', '--workers', '4'],
+    ['--engine', 'lxml', '--table-only'],
+])
+def test_directory_matches_serial(tmp_path, serial_csv, options):
+    assert extract(tmp_path, os.path.join(TEST_DIR, '2022-2023'), '--raw-bytes', '--source-encoding', TEST_ENCODING,
+                   *options) == serial_csv
+
+
+@pytest.mark.parametrize('options', [
+    [],
+    ['--raw-bytes'],
+    ['--engine', 'lxml', '--workers', '4'],
+    ['--engine', 'lxml', '--raw-bytes', '--workers', '4'],
+])
+def test_archive_matches_serial(archive_dir, serial_csv, options):
+    # the archived pages are UTF-8, so they can be read as text as well as bytes
+    assert extract(archive_dir, 'HTML/2022-2023.htmlarc', *options) == serial_csv
+
+
+@pytest.mark.parametrize('options', [
+    ['--raw-bytes'],
+    ['--engine', 'lxml', '--workers', '4'],
+])
+def test_archive_incremental_matches_serial(archive_dir, serial_csv, options):
+    # a fresh manifest - every page is fingerprinted in the main process before any workers start
+    manifest = archive_dir / 'CSVs' / '2022-2023.manifest.json'
+    if manifest.exists():
+        manifest.unlink()
+    assert extract(archive_dir, 'HTML/2022-2023.htmlarc', '--incremental', *options) == serial_csv
+    # and again, with every page's rows coming from the manifest
+    assert extract(archive_dir, 'HTML/2022-2023.htmlarc', '--incremental', *options) == serial_csv
+
+
+def test_padding_cells_are_empty(tmp_path):
+    ''' The goal columns a row doesn't have are empty fields (not "") - and strings are quoted, numbers aren't '''
+    csv_data = extract(tmp_path, os.path.join(TEST_DIR, '2022-2023', '7'), '--engine', 'lxml',
+                       '--raw-bytes', '--source-encoding', TEST_ENCODING, output='2022-2023_7.csv')
+    lines = csv_data.decode().splitlines()
+    # Pathways rows: Goals Met, then the 6 traditional goal columns padded, then Level 1s
+    assert lines[1].startswith('"01","A","01",977,"Professional Women Toastmasters","Active",27,27,0,,,,,,,0,')
+    assert all(',,,,,,' in line for line in lines[1:])
+
+
+def test_single_page_incremental(tmp_path):
+    page = os.path.join(TEST_DIR, '2022-2023', '7', '01.html')
+    options = ['--raw-bytes', '--source-encoding', TEST_ENCODING]
+    serial = extract(tmp_path, page, *options, output='2022-2023_7_01.csv')
+    assert extract(tmp_path, page, *options, '--incremental', output='2022-2023_7_01.csv') == serial
+    assert (tmp_path / 'CSVs' / '2022-2023_7_01.manifest.json').exists()
+    # the second run's rows come from the manifest
+    assert extract(tmp_path, page, *options, '--incremental', '--metrics', 'metrics.jsonl',
+                   output='2022-2023_7_01.csv') == serial
+    assert '"cached_pages": 1' in (tmp_path / 'metrics.jsonl').read_text()
@@ -0,0 +1,70 @@
+import os, sys, shutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tm_html_store import HTMLArchive
+
+
+def make_archive(path, pages):
+    with HTMLArchive(path, 'a') as archive:
+        for (month, district), html in pages.items():
+            archive.write_page(month, district, html)
+
+
+def crash(archive):
+    ''' Closes an archive's files without saving the index, as if the writer had been killed '''
+    archive.fh.close()
+    if archive.log_fh:
+        archive.log_fh.close()
+
+
+def test_reader_during_compaction_uses_the_compacted_index(tmp_path):
+    path = str(tmp_path / '2022-2023.htmlarc')
+    make_archive(path, {('7', '01'): 'old 01', ('7', '02'): 'page 02'})
+    make_archive(path, {('7', '01'): 'new 01'})
+    # compact into a copy, then put the compacted archive in place as compact() does - but stop before
+    # finish_compaction(), with the old index still there
+    shutil.copy(path, path + '.copy')
+    shutil.copy(path + '.idx.json', path + '.copy.idx.json')
+    with HTMLArchive(path + '.copy', 'a') as archive:
+        archive.compact()
+    os.replace(path + '.copy.idx.json', path + '.idx.json.compacted')
+    with open(path + '.idx.json.compacted') as fh:
+        compacted = fh.read()
+    with HTMLArchive(path) as archive:
+        before = {page: archive.read_page(*page) for page in archive.pages()}
+    with open(path + '.idx.json.compacted', 'w') as fh:
+        fh.write(compacted.replace('"archive_size"', '"archive_size": 1, "old_size"'))
+    # a reader that opens the old archive ignores a compacted index that isn't for it, and leaves it alone
+    with HTMLArchive(path) as archive:
+        assert archive.read_page('7', '01') == 'new 01'
+    assert os.path.exists(path + '.idx.json.compacted')
+    with open(path + '.idx.json.compacted', 'w') as fh:
+        fh.write(compacted)
+    os.replace(path + '.copy', path)
+    with HTMLArchive(path) as archive:
+        assert {page: archive.read_page(*page) for page in archive.pages()} == before
+    assert os.path.exists(path + '.idx.json.compacted')
+    # the writer finishes the compaction
+    with HTMLArchive(path, 'a') as archive:
+        assert archive.wasted_bytes() == 0
+    assert not os.path.exists(path + '.idx.json.compacted')
+    with HTMLArchive(path) as archive:
+        assert {page: archive.read_page(*page) for page in archive.pages()} == before
+
+
+def test_torn_index_log_line_is_cut_off_before_appending(tmp_path):
+    path = str(tmp_path / '2022-2023.htmlarc')
+    archive = HTMLArchive(path, 'a')
+    archive.write_page('7', '01', 'page 01')
+    crash(archive)
+    with open(path + '.idx.log', 'a') as fh:
+        fh.write('{"key": "7/02", "en')
+    # two more runs that are killed before close()
+    for district in ('03', '04'):
+        archive = HTMLArchive(path, 'a')
+        archive.write_page('7', district, f"page {district}")
+        crash(archive)
+    with HTMLArchive(path) as archive:
+        assert archive.pages() == [('7', '01'), ('7', '03'), ('7', '04')]
+        assert archive.read_page('7', '04') == 'page 04'
@@ -0,0 +1,37 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tm_http_client
+from tm_http_client import CircuitBreaker, call_with_retry
+from Get_TM_monthly_Club_Perf_HTML import InvalidPageError, INVALID_PAGE_RETRIES
+
+
+def test_invalid_pages_are_retried_a_few_times_and_count_as_failures(monkeypatch):
+    monkeypatch.setattr(tm_http_client.time, 'sleep', lambda seconds: None)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise InvalidPageError("contains 'An error has occured'")
+
+    breaker = CircuitBreaker(threshold=100)
+    with pytest.raises(InvalidPageError):
+        call_with_retry(request, retries=10, breaker=breaker)
+    assert len(calls) == INVALID_PAGE_RETRIES + 1
+    assert breaker.failures == INVALID_PAGE_RETRIES + 1
+
+
+def test_error_page_during_a_bad_spell_is_retried(monkeypatch):
+    monkeypatch.setattr(tm_http_client.time, 'sleep', lambda seconds: None)
+    responses = [InvalidPageError("contains 'An error has occured'"), b'<html>the page</html>']
+
+    def request():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert call_with_retry(request, retries=3) == b'<html>the page</html>'
@@ -0,0 +1,27 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tm_metrics import ExtractionMetrics
+
+
+def page_stats(error=None, parse_cache=None):
+    return {'bytes': 1000, 'error': error, 'parse_cache': parse_cache,
+            'read_wall': 0.0, 'read_cpu': 0.0, 'parse_wall': 0.0, 'parse_cpu': 0.0}
+
+
+def test_pages_are_counted_as_parsed_cached_or_problem(tmp_path):
+    metrics = ExtractionMetrics(str(tmp_path / 'metrics.prom'))
+    metrics.record_page('2022-2023', '7', '01', '01.html', 10, page_stats())
+    metrics.record_page('2022-2023', '7', '02', '02.html', 10, page_stats(parse_cache='miss'))
+    metrics.record_page('2022-2023', '7', '03', '03.html', 10, page_stats(parse_cache='hit'))
+    metrics.record_page('2022-2023', '7', '04', '04.html', 10, None)
+    metrics.record_page('2022-2023', '7', 'U', 'U.html', 0, page_stats(error='error_page'))
+    summary = metrics.close()
+    assert (summary['parsed_pages'], summary['cached_pages'], summary['problem_pages']) == (2, 2, 1)
+    assert summary['cached_by'] == {'parse_cache': 1, 'manifest': 1}
+    with open(tmp_path / 'metrics.prom') as fh:
+        prom = fh.read()
+    for line in ('tm_extract_pages{source="parsed"} 2', 'tm_extract_pages{source="cached"} 2',
+                 'tm_extract_pages{source="problem"} 1', 'tm_extract_cached_pages{cache="parse_cache"} 1'):
+        assert line in prom
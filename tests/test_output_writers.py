@@ -0,0 +1,65 @@
+import os, sys, csv
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Extract_Club_data_from_HTML import DCP_COLUMNS, DCPCSVWriter, MonthWriter, create_output_CSV, replacing_file
+
+ROW = ['A', '1', 977, 'A Club', 'Active', 20, 22, 3] + list(range(1, 13)) + ['D']
+
+
+class RecordingWriter(MonthWriter):
+
+    def __init__(self):
+        super().__init__()
+        self.months = []
+
+    def write_month(self, rows, prog_year, month, districts):
+        self.months.append((rows, prog_year, month, districts))
+
+
+def test_month_writer_buffers_each_month():
+    writer = RecordingWriter()
+    writer.write_district([ROW], '01', '2022-2023', '7')
+    writer.write_district([ROW, ROW], '02', '2022-2023', '7')
+    # a district written again replaces its rows
+    writer.write_district([ROW], '02', '2022-2023', '7')
+    writer.end_month('2022-2023', '7')
+    writer.end_month('2022-2023', '8')
+    [(rows, prog_year, month, districts)] = writer.months
+    assert (prog_year, month, districts) == ('2022-2023', '7', ['01', '02'])
+    assert [len(row) for row in rows] == [len(DCP_COLUMNS)] * 2
+    assert rows[1][0] == '02' and rows[1][-2:] == ['2022-2023', 7]
+
+
+def test_replacing_file_leaves_the_file_alone_on_error(tmp_path):
+    filename = str(tmp_path / 'file.csv')
+    with replacing_file(filename) as temp_filename, open(temp_filename, 'w') as fh:
+        fh.write('first')
+    with pytest.raises(RuntimeError):
+        with replacing_file(filename) as temp_filename, open(temp_filename, 'w') as fh:
+            fh.write('second')
+            raise RuntimeError
+    assert open(filename).read() == 'first'
+    assert os.listdir(tmp_path) == ['file.csv']
+
+
+@pytest.mark.parametrize('club_name', ['Plain Club', 'Speakers, Inc.', 'The "Talking" Heads', 'Two\nLines', '"', ''])
+def test_csv_rows_read_back_with_csv_reader(tmp_path, monkeypatch, club_name):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('CSVs')
+    filename = create_output_CSV('2022-2023', '7')
+    writer = DCPCSVWriter(filename)
+    # a Pathways row - the traditional goal columns are padded with empty cells
+    writer.write_district([ROW[:3] + [club_name] + ROW[4:]], '01', '2022-2023', '7')
+    writer.close()
+    with open(filename, newline='') as fh:
+        header, row = list(csv.reader(fh))
+    assert header == list(DCP_COLUMNS)
+    assert row == (['01', 'A', '1', '977', club_name, 'Active', '20', '22', '3'] + [''] * 6
+                   + [str(n) for n in range(1, 13)] + ['D', '2022-2023', '7'])
+    with open(filename) as fh:
+        lines = fh.read().split('\n')
+    # strings are quoted and numbers aren't, like the files have always been written
+    assert lines[1].startswith('"01","A","1",977,"')
@@ -0,0 +1,64 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tm_work_queue import WorkQueue, merge_parts, get_part_filename
+
+
+def test_expired_lease_after_last_attempt_is_failed(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), max_attempts=2)
+    queue.add('extract', '2022-2023', '7', '01', {})
+    # leases that have run out as soon as they are taken - as if each worker died on the task
+    first = queue.claim('worker-1', lease_seconds=-1)
+    second = queue.claim('worker-2', lease_seconds=-1)
+    assert (first['attempts'], second['attempts']) == (1, 2)
+    assert queue.claim('worker-3') is None
+    assert queue.summary() == [('extract', '2022-2023', 'failed', 1)]
+
+
+def test_only_the_lease_holder_can_finish_a_task(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add('extract', '2022-2023', '7', '01', {})
+    stale = queue.claim('worker-1', lease_seconds=-1)
+    current = queue.claim('worker-2')
+    assert not queue.complete(stale)
+    assert not queue.fail(stale, 'error')
+    assert queue.complete(current)
+    assert not queue.complete(current)
+    assert queue.summary() == [('extract', '2022-2023', 'done', 1)]
+
+
+def test_failed_task_waits_before_it_is_retried(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), retry_delay=3600)
+    queue.add('download', '2016-2017', '1', 'U', {})
+    assert queue.fail(queue.claim('worker-1'), 'error page')
+    assert queue.claim('worker-2') is None
+    assert queue.has_unfinished()
+
+
+def write_part(parts_dir, month, district):
+    filename = get_part_filename(parts_dir, '2022-2023', month, district)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as fh:
+        fh.write(f"{month}/{district}\n")
+
+
+def test_merge_only_joins_finished_parts(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    parts_dir, output = str(tmp_path / 'parts'), str(tmp_path / 'merged.csv')
+    for district in ('01', '02'):
+        queue.add('extract', '2022-2023', '7', district, {})
+        write_part(parts_dir, '7', district)
+    # a part left over from an earlier run, with no task in this queue
+    write_part(parts_dir, '8', '01')
+    assert queue.complete(queue.claim('worker-1'))
+    with pytest.raises(ValueError, match='1 extract pending'):
+        merge_parts(queue, '2022-2023', parts_dir, output)
+    assert not os.path.exists(output)
+    merge_parts(queue, '2022-2023', parts_dir, output, force=True)
+    assert open(output).read().splitlines()[1:] == ['7/01']
+    assert queue.complete(queue.claim('worker-1'))
+    merge_parts(queue, '2022-2023', parts_dir, output)
+    assert open(output).read().splitlines()[1:] == ['7/01', '7/02']
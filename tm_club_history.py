@@ -0,0 +1,182 @@
+import os, re, csv, sys, locale, sqlite3, argparse
+
+# An index of where each club's rows are in the extracted program year CSV files (./CSVs/{program year}.csv),
+# so a club's whole history - every month of every program year - can be read without scanning all the files.
+# The index (./CACHE/club_history.sqlite by default) records, for every row, the club number, program year, month
+# and district, and the byte offset and length of the row in its CSV file. A lookup reads just those rows.
+# The index is brought up to date before each lookup: a CSV file whose size or modification time has changed since
+# it was indexed (e.g. a year that has been extracted again) is re-indexed, which takes a few seconds per year.
+#   python ./tm_club_history.py show 977
+#   python ./tm_club_history.py show 977 --csv > club_977.csv
+# Only the whole-year files are indexed, not the single month or district files like 2021-2022_7.csv.
+
+DEFAULT_CSV_DIR = './CSVs'
+DEFAULT_INDEX_PATH = './CACHE/club_history.sqlite'
+
+YEAR_CSV_FILENAME = re.compile(r'^\d{4}-\d{4}\.csv$')
+
+# the columns `show` prints, unless --columns or --csv is given
+SHOW_COLUMNS = ("Program Year", "Month", "District", "Division", "Area", "Club Name", "Club Status",
+                "Mem. Base", "Active Members", "Goals Met", "Club Distinguished Status")
+
+# the CSV files are written in the platform's default encoding (see create_output_CSV())
+CSV_ENCODING = locale.getpreferredencoding(False)
+
+# rows inserted per executemany() call while indexing
+BATCH_SIZE = 5000
+
+
+def month_order(month):
+    ''' Sort key for the months of a program year: 7, 8, ... 12, 1, ... 6 '''
+    return (int(month) < 7, int(month))
+
+
+def parse_csv_lines(lines):
+    ''' Parses CSV rows from raw lines of a CSV file (none of the fields have line breaks in them) '''
+    return csv.reader(line.decode(CSV_ENCODING) for line in lines)
+
+
+class ClubHistoryIndex:
+    ''' The club history index (see the top of this module) '''
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, csv_dir=DEFAULT_CSV_DIR):
+        self.path = path
+        self.csv_dir = csv_dir
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS csv_files (
+            filename TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, header TEXT)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS row_locations (
+            club_number INTEGER, program_year TEXT, month TEXT, district TEXT,
+            filename TEXT, offset INTEGER, length INTEGER)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS row_locations_club_number ON row_locations (club_number)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS row_locations_filename ON row_locations (filename)')
+        self.conn.commit()
+
+    def year_csv_files(self):
+        if not os.path.isdir(self.csv_dir):
+            return []
+        return sorted(f for f in os.listdir(self.csv_dir) if YEAR_CSV_FILENAME.match(f))
+
+    def update(self, verbose=False):
+        ''' Indexes the CSV files that are new or have changed since they were indexed, and forgets the ones
+            that have gone. Returns the names of the files that were (re-)indexed '''
+        indexed = {filename: (size, mtime_ns) for filename, size, mtime_ns
+                   in self.conn.execute('SELECT filename, size, mtime_ns FROM csv_files')}
+        current = self.year_csv_files()
+        updated = []
+        for filename in current:
+            stat = os.stat(os.path.join(self.csv_dir, filename))
+            if indexed.get(filename) != (stat.st_size, stat.st_mtime_ns):
+                if verbose:
+                    print(f"Indexing {os.path.join(self.csv_dir, filename)}", file=sys.stderr)
+                self.index_file(filename, stat)
+                updated.append(filename)
+        with self.conn:
+            for filename in set(indexed) - set(current):
+                self.conn.execute('DELETE FROM row_locations WHERE filename = ?', (filename,))
+                self.conn.execute('DELETE FROM csv_files WHERE filename = ?', (filename,))
+        return updated
+
+    def index_file(self, filename, stat):
+        ''' (Re-)indexes one CSV file, in one transaction '''
+        with open(os.path.join(self.csv_dir, filename), 'rb') as fh, self.conn:
+            self.conn.execute('DELETE FROM row_locations WHERE filename = ?', (filename,))
+            header_line = fh.readline()
+            header = next(parse_csv_lines([header_line]))
+            columns = [header.index(column) for column in ("Club Number", "Program Year", "Month", "District")]
+            offset = len(header_line)
+            while True:
+                lines = fh.readlines(4 * 1024 * 1024)
+                if not lines:
+                    break
+                locations = []
+                for line, row in zip(lines, parse_csv_lines(lines)):
+                    if row:
+                        club_number, program_year, month, district = (row[i] for i in columns)
+                        locations.append((int(club_number), program_year, month, district, filename, offset, len(line)))
+                    offset += len(line)
+                for start in range(0, len(locations), BATCH_SIZE):
+                    self.conn.executemany('INSERT INTO row_locations VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                          locations[start:start + BATCH_SIZE])
+            self.conn.execute('INSERT OR REPLACE INTO csv_files VALUES (?, ?, ?, ?)',
+                              (filename, stat.st_size, stat.st_mtime_ns, header_line.decode(CSV_ENCODING).rstrip('\r\n')))
+
+    def locations(self, club_number):
+        ''' Returns [(program year, month, district, filename, offset, length)] for the club's rows, in date order '''
+        rows = self.conn.execute('''SELECT program_year, month, district, filename, offset, length
+                                    FROM row_locations WHERE club_number = ?''', (int(club_number),)).fetchall()
+        return sorted(rows, key=lambda row: (row[0], month_order(row[1]), row[2]))
+
+    def history(self, club_number, update=True):
+        ''' Returns the club's rows from the CSV files, in date order, as dicts of {column: value}
+            (the values are the strings in the CSV files). `update` brings the index up to date first '''
+        if update:
+            self.update()
+        headers = {filename: next(parse_csv_lines([header.encode(CSV_ENCODING)]))
+                   for filename, header in self.conn.execute('SELECT filename, header FROM csv_files')}
+        history = []
+        open_files = {}
+        try:
+            for _program_year, _month, _district, filename, offset, length in self.locations(club_number):
+                if filename not in open_files:
+                    open_files[filename] = open(os.path.join(self.csv_dir, filename), 'rb')
+                fh = open_files[filename]
+                fh.seek(offset)
+                row = next(parse_csv_lines([fh.read(length)]))
+                history.append(dict(zip(headers[filename], row)))
+        finally:
+            for fh in open_files.values():
+                fh.close()
+        return history
+
+    def close(self):
+        self.conn.close()
+
+
+def club_history(club_number, csv_dir=DEFAULT_CSV_DIR, index_path=DEFAULT_INDEX_PATH):
+    ''' Returns a club's history from the extracted CSV files (see ClubHistoryIndex.history()) '''
+    index = ClubHistoryIndex(index_path, csv_dir)
+    try:
+        return index.history(club_number)
+    finally:
+        index.close()
+
+
+def print_table(rows, columns):
+    widths = [max([len(column)] + [len(row.get(column, '')) for row in rows]) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(row.get(column, '').ljust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv-dir', default=DEFAULT_CSV_DIR, help=f"default {DEFAULT_CSV_DIR}")
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help=f"default {DEFAULT_INDEX_PATH}")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="index the CSV files that are new or have changed")
+    show_parser = subparsers.add_parser('show', help="show a club's history")
+    show_parser.add_argument('club_number', type=int)
+    show_parser.add_argument('--columns', nargs='+', help=f"default: {', '.join(SHOW_COLUMNS)}")
+    show_parser.add_argument('--csv', action='store_true', help="write all the columns as CSV, to stdout")
+    args = parser.parse_args()
+
+    index = ClubHistoryIndex(args.index, args.csv_dir)
+    if args.command == 'build':
+        updated = index.update(verbose=True)
+        print(f"{len(updated)} of {len(index.year_csv_files())} CSV files indexed")
+    else:
+        index.update(verbose=True)
+        history = index.history(args.club_number, update=False)
+        if not history:
+            sys.exit(f"Club {args.club_number} isn't in {args.csv_dir}")
+        if args.csv:
+            writer = csv.DictWriter(sys.stdout, fieldnames=list(history[0]), lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(history)
+        else:
+            print_table(history, args.columns or SHOW_COLUMNS)
+    index.close()
@@ -0,0 +1,175 @@
+from array import array
+
+# The layout of a club's DCP data, ClubRecord - a typed version of one dcp_data row - and ClubRecordBatch,
+# a compact column-wise store for the clubs of a district page.
+# extract_Club_data() returns each club as a list of 21 or 27 values, depending on the program year:
+#   Division, Area, Club Number, Club Name, Club Status, Mem. Base, Active Members, Goals Met,
+#   then the goal columns of the program year (GOAL_LAYOUTS), then Club Distinguished Status
+# Before Pathways (up to 2017-2018) the goals were the traditional educational awards, since 2020-2021 they are
+# the Pathways levels, and in the two transitional years in between the pages had both, so had 27 columns.
+# The output files always use the 27 column "normalized" layout (RECORD_COLUMNS), with the 6 columns a row
+# doesn't have filled in - normalize_row() does that, working out where they go from the column names.
+
+TRADITIONAL_GOALS = ("CCs","Add. CCs","ACs","Add. ACs","CL/AL/DTMs","Add. CL/AL/DTMs")
+PATHWAYS_GOALS = ("Level 1s","Level 2s","Add. Level 2s","Level 3s","Level 4s","Level 5s")
+COMMON_GOALS = ("New Members","Add. New Members","Off. Trained Round 1","Off. Trained Round 2",
+                "Mem. dues on time Oct & Apr","Off. List On Time")
+ALL_GOALS = TRADITIONAL_GOALS + PATHWAYS_GOALS + COMMON_GOALS
+
+# the goal columns of each kind of row, in page order
+GOAL_LAYOUTS = {
+    'traditional': TRADITIONAL_GOALS + COMMON_GOALS,
+    'pathways': PATHWAYS_GOALS + COMMON_GOALS,
+    'transitional': ALL_GOALS,
+}
+
+LEADING_COLUMNS = ("Division","Area","Club Number","Club Name","Club Status","Mem. Base","Active Members","Goals Met")
+RECORD_COLUMNS = LEADING_COLUMNS + ALL_GOALS + ("Club Distinguished Status",)
+
+# where the missing goal columns go in a normalized row, for the layouts that don't have all of them
+# (they are always next to each other - the traditional or the Pathways goals)
+PAD_OFFSETS = {layout: len(LEADING_COLUMNS) + ALL_GOALS.index(next(g for g in ALL_GOALS if g not in goals))
+               for layout, goals in GOAL_LAYOUTS.items() if layout != 'transitional'}
+PAD_WIDTH = len(ALL_GOALS) - len(GOAL_LAYOUTS['traditional'])
+
+# the integer columns of a ClubRecord's counts array, in order
+COUNT_COLUMNS = ("Club Number","Mem. Base","Active Members","Goals Met") + ALL_GOALS
+COUNT_INDEX = {column: i for i, column in enumerate(COUNT_COLUMNS)}
+
+
+def get_goal_layout(row, prog_year):
+    ''' Returns the GOAL_LAYOUTS key of a dcp_data row from extract_Club_data() '''
+    if len(row) == len(RECORD_COLUMNS):
+        return 'transitional'
+    return 'pathways' if prog_year > '2019-2020' else 'traditional'
+
+
+def normalize_row(row, prog_year, pad_value=None):
+    ''' Returns a copy of a dcp_data row in the 27 column RECORD_COLUMNS layout,
+        with the goal columns the row doesn't have filled with `pad_value` '''
+    layout = get_goal_layout(row, prog_year)
+    if layout == 'transitional':
+        return list(row)
+    offset = PAD_OFFSETS[layout]
+    return row[:offset] + [pad_value] * PAD_WIDTH + row[offset:]
+
+
+class ClubRecord:
+    ''' One club's DCP data for a month, in the normalized RECORD_COLUMNS layout, with named, typed fields.
+        The 22 integer columns (COUNT_COLUMNS) are kept in a single array('i') rather than as separate Python ints,
+        and the goal columns the club's program year didn't have are recorded by `goal_layout` rather than padded,
+        so they read as None. (To hold a lot of clubs in memory, ClubRecordBatch is about half the size) '''
+
+    __slots__ = ('division', 'area', 'club_name', 'club_status', 'distinguished_status', 'goal_layout', 'counts')
+
+    def __init__(self, division, area, club_name, club_status, distinguished_status, goal_layout, counts):
+        self.division = division
+        self.area = area
+        self.club_name = club_name
+        self.club_status = club_status
+        self.distinguished_status = distinguished_status
+        self.goal_layout = goal_layout
+        self.counts = counts
+
+    @classmethod
+    def from_dcp_row(cls, row, prog_year):
+        ''' Makes a ClubRecord from a dcp_data row of extract_Club_data() (21 or 27 columns) '''
+        normalized = normalize_row(row, prog_year, 0)
+        counts = array('i', (normalized[2], normalized[5], normalized[6], normalized[7]))
+        counts.extend(normalized[8:-1])
+        return cls(row[0], row[1], row[3], row[4], row[-1], get_goal_layout(row, prog_year), counts)
+
+    @property
+    def club_number(self):
+        return self.counts[0]
+
+    @property
+    def membership_base(self):
+        return self.counts[1]
+
+    @property
+    def active_members(self):
+        return self.counts[2]
+
+    @property
+    def goals_met(self):
+        return self.counts[3]
+
+    def has_column(self, column):
+        ''' False for the goal columns that the record's program year didn't have '''
+        return column not in ALL_GOALS or column in GOAL_LAYOUTS[self.goal_layout]
+
+    def get(self, column, pad_value=None):
+        ''' Returns the value of one of the RECORD_COLUMNS (`pad_value` for a goal column the record doesn't have) '''
+        if column in COUNT_INDEX:
+            return self.counts[COUNT_INDEX[column]] if self.has_column(column) else pad_value
+        return self.to_row()[RECORD_COLUMNS.index(column)]
+
+    def to_row(self, pad_value=None):
+        ''' Returns the record as a 27 column list, like normalize_row() '''
+        counts = self.counts
+        goals = counts[4:].tolist()
+        if self.goal_layout != 'transitional':
+            offset = PAD_OFFSETS[self.goal_layout] - len(LEADING_COLUMNS)
+            goals[offset:offset + PAD_WIDTH] = [pad_value] * PAD_WIDTH
+        return ([self.division, self.area, counts[0], self.club_name, self.club_status, counts[1], counts[2], counts[3]]
+                + goals + [self.distinguished_status])
+
+    def __eq__(self, other):
+        if not isinstance(other, ClubRecord):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return f"ClubRecord({self.club_number}, {self.club_name!r}, {self.division}{self.area}, {self.goal_layout})"
+
+
+def to_club_records(dcp_data, prog_year):
+    ''' Converts the dcp_data rows of one district page to ClubRecords '''
+    return [ClubRecord.from_dcp_row(row, prog_year) for row in dcp_data]
+
+
+class ClubRecordBatch:
+    ''' The clubs of one district page, stored column-wise: the counts of all the clubs in a single array('i')
+        (len(COUNT_COLUMNS) values per club) and the text columns in lists, with the goal layout stored once.
+        This takes about half the memory of the same clubs as row lists, e.g. for holding several program years
+        in memory for cross-year analysis. Iterating over a batch gives ClubRecords '''
+
+    __slots__ = ('prog_year', 'month', 'district', 'goal_layout', 'counts', 'divisions', 'areas', 'club_names',
+                 'club_statuses', 'distinguished_statuses')
+
+    def __init__(self, prog_year, month, district, dcp_data):
+        self.prog_year = prog_year
+        self.month = month
+        self.district = district
+        self.goal_layout = get_goal_layout(dcp_data[0], prog_year) if dcp_data else 'transitional'
+        self.counts = array('i')
+        self.divisions, self.areas, self.club_names, self.club_statuses, self.distinguished_statuses = [], [], [], [], []
+        for row in dcp_data:
+            normalized = normalize_row(row, prog_year, 0)
+            self.counts.extend((normalized[2], normalized[5], normalized[6], normalized[7]))
+            self.counts.extend(normalized[8:-1])
+            self.divisions.append(row[0])
+            self.areas.append(row[1])
+            self.club_names.append(row[3])
+            self.club_statuses.append(row[4])
+            self.distinguished_statuses.append(row[-1])
+
+    def __len__(self):
+        return len(self.club_names)
+
+    def record(self, i):
+        width = len(COUNT_COLUMNS)
+        return ClubRecord(self.divisions[i], self.areas[i], self.club_names[i], self.club_statuses[i],
+                          self.distinguished_statuses[i], self.goal_layout, self.counts[i * width:(i + 1) * width])
+
+    def __iter__(self):
+        return (self.record(i) for i in range(len(self)))
+
+    def column(self, column):
+        ''' Returns one of the COUNT_COLUMNS for every club in the batch, as an array('i') '''
+        return self.counts[COUNT_INDEX[column]::len(COUNT_COLUMNS)]
+
+    def to_rows(self, pad_value=None):
+        ''' Returns the clubs as 27 column lists, like normalize_row() '''
+        return [record.to_row(pad_value) for record in self]
@@ -0,0 +1,119 @@
+import os, time, sqlite3, hashlib, threading
+from collections import Counter
+
+# The crawl journal keeps track of the downloader's work in a SQLite database ({html dir}/crawl_journal.sqlite by default),
+# so an interrupted backfill can carry on exactly where it stopped. For each (program year, month, district) page
+# it records its status ('in_progress', 'saved', 'unchanged', 'invalid' or 'failed'), the number of attempts since
+# it was last downloaded successfully, and the byte size and SHA-1 of the saved page. (Each month's district list is cached by tm_district_roster.py, so a resumed run
+# doesn't fetch it again.)
+# A page that is on disk but isn't recorded as complete in the journal (e.g. the run was killed while it was
+# being saved by an older version of the downloader, leaving a truncated file) is downloaded again.
+# A page the site has sent its error page for ('invalid') is tried again on the next run, but after
+# max_invalid_attempts runs in a row it is given up on (until the downloader is run with --refresh).
+
+DEFAULT_JOURNAL_NAME = 'crawl_journal.sqlite'
+COMPLETE_STATUSES = ('saved', 'unchanged')
+DEFAULT_MAX_INVALID_ATTEMPTS = 3
+
+
+def page_checksum(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def looks_complete(data):
+    ''' True if the saved page data ends with its closing </html> tag - a page that was cut short doesn't '''
+    return data.rstrip()[-7:].lower() == b'</html>'
+
+
+class CrawlJournal:
+    ''' The downloader's crawl journal (see the top of this module). It can be used from several threads at once '''
+
+    def __init__(self, path, max_invalid_attempts=DEFAULT_MAX_INVALID_ATTEMPTS):
+        self.path = path
+        self.max_invalid_attempts = max_invalid_attempts
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            program_year TEXT, month TEXT, district TEXT, status TEXT, attempts INTEGER DEFAULT 0,
+            bytes INTEGER, sha1 TEXT, error TEXT, updated REAL,
+            PRIMARY KEY (program_year, month, district))''')
+        self.conn.commit()
+
+    def get_task(self, program_year, month, district):
+        with self.lock:
+            cursor = self.conn.execute('SELECT * FROM tasks WHERE program_year = ? AND month = ? AND district = ?',
+                                       (program_year, month, district))
+            row = cursor.fetchone()
+            return None if row is None else dict(zip([column[0] for column in cursor.description], row))
+
+    def start_task(self, program_year, month, district):
+        ''' Records that a page is being downloaded (another attempt, if it hasn't been downloaded successfully since
+            it was last tried) '''
+        with self.lock, self.conn:
+            self.conn.execute('''INSERT INTO tasks (program_year, month, district, status, attempts, updated)
+                                 VALUES (?, ?, ?, 'in_progress', 1, ?)
+                                 ON CONFLICT (program_year, month, district)
+                                 DO UPDATE SET status = 'in_progress', error = NULL, updated = excluded.updated,
+                                               attempts = CASE WHEN status IN ('saved', 'unchanged') THEN 1
+                                                               ELSE attempts + 1 END''',
+                              (program_year, month, district, time.time()))
+
+    def finish_task(self, program_year, month, district, status, data=None, error=None):
+        ''' Records the outcome of a download - `data` is the saved page (for 'saved'), `error` describes a failure '''
+        size = checksum = None
+        if data is not None:
+            size, checksum = len(data), page_checksum(data)
+        with self.lock, self.conn:
+            if status == 'unchanged':
+                # the saved copy is still current - keep its size and checksum
+                self.conn.execute('''UPDATE tasks SET status = ?, updated = ?
+                                     WHERE program_year = ? AND month = ? AND district = ?''',
+                                  (status, time.time(), program_year, month, district))
+            else:
+                self.conn.execute('''UPDATE tasks SET status = ?, bytes = ?, sha1 = ?, error = ?, updated = ?
+                                     WHERE program_year = ? AND month = ? AND district = ?''',
+                                  (status, size, checksum, error, time.time(), program_year, month, district))
+
+    def has_given_up(self, program_year, month, district):
+        ''' True if the site has sent its error page for the page on the last max_invalid_attempts attempts '''
+        task = self.get_task(program_year, month, district)
+        return task is not None and task['status'] == 'invalid' and task['attempts'] >= self.max_invalid_attempts
+
+    def adopt_page(self, program_year, month, district, data):
+        ''' Records a page that was saved before there was a journal entry for it (as 'saved', with one attempt) '''
+        with self.lock, self.conn:
+            self.conn.execute('''INSERT OR REPLACE INTO tasks (program_year, month, district, status, attempts, bytes, sha1, updated)
+                                 VALUES (?, ?, ?, 'saved', 1, ?, ?, ?)''',
+                              (program_year, month, district, len(data), page_checksum(data), time.time()))
+
+    def is_complete(self, store, month, district):
+        ''' True if the page saved in `store` (a tm_html_store store) has been completely downloaded:
+            it is recorded as saved in the journal and is still the size it was saved at.
+            A page that isn't in the journal at all (saved before there was a journal) is checked for its closing
+            </html> tag, and recorded in the journal if it has one '''
+        if not store.has_page(month, district):
+            return False
+        task = self.get_task(store.program_year, month, district)
+        if task is None:
+            data = store.read_page_bytes(month, district)
+            if not looks_complete(data):
+                return False
+            self.adopt_page(store.program_year, month, district, data)
+            return True
+        return task['status'] in COMPLETE_STATUSES and store.page_size(month, district) == task['bytes']
+
+    def summary(self, program_year):
+        ''' Returns {month: Counter of task statuses} for the program year '''
+        with self.lock:
+            rows = self.conn.execute('''SELECT month, status, COUNT(*) FROM tasks WHERE program_year = ?
+                                        GROUP BY month, status''', (program_year,)).fetchall()
+        months = {}
+        for month, status, count in rows:
+            months.setdefault(month, Counter())[status] = count
+        return months
+
+    def close(self):
+        self.conn.close()
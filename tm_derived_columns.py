@@ -0,0 +1,38 @@
+import calendar
+from functools import lru_cache
+
+# Columns worked out from the extracted DCP data, which the extractor can add to the CSV files (--derived-columns)
+# and create_datestamp_in_CSV_data_file.py can add to an existing CSV file:
+#   Date        the last day of the program year month, like 2022-07-31 (months 7-12 are in the first year
+#               of the program year, months 1-6 in the second)
+#   Net Growth  Active Members - Mem. Base
+# Date is the same for every row of a month, so it is worked out once per (program year, month), not once per row.
+
+DERIVED_COLUMNS = ("Date", "Net Growth")
+
+
+@lru_cache(maxsize=None)
+def month_end_date(prog_year, month):
+    ''' The last day of a program year month, as 'YYYY-MM-DD', e.g. ('2019-2020', '2') -> '2020-02-29' '''
+    first_year, second_year = map(int, prog_year.split('-'))
+    month = int(month)
+    year = second_year if month < 7 else first_year
+    return f"{year}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}"
+
+
+def derive_columns(dcp_data, prog_year, month):
+    ''' Returns the DERIVED_COLUMNS values for each of the dcp_data rows of a page (from extract_Club_data()),
+        as a list of [date, net growth] lists '''
+    date = month_end_date(prog_year, month)
+    # Mem. Base and Active Members are columns 5 and 6 of every row layout (see tm_club_record.LEADING_COLUMNS)
+    return [[date, row[6] - row[5]] for row in dcp_data]
+
+
+def derive_csv_columns(rows, header):
+    ''' Returns the DERIVED_COLUMNS values for rows read from a CSV file with the extractor's columns (as strings),
+        as a list of [date, net growth] lists '''
+    program_year, month, base, active = (header.index(column) for column in
+                                         ("Program Year", "Month", "Mem. Base", "Active Members"))
+    return [[month_end_date(row[program_year], row[month]),
+             int(row[active]) - int(row[base]) if row[active] and row[base] else '']
+            for row in rows]
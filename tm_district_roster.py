@@ -0,0 +1,119 @@
+import os, re, sys, json, time, datetime, argparse
+
+# A cache of the district list ("roster") for each program year and month - the districts in the
+# cpContent_TopControls1_ddlDistricts drop-down of the Club Performance pages - kept as small JSON files:
+#   ./CACHE/districts/{program year}/{month}.json   {"districts": ["01", "02", ... "F", "U"], "fetched": ..., "source": ...}
+# The districts are in the order of the drop-down.
+# A program year that has ended never changes, so its rosters are kept for good. Rosters for the current program year
+# expire after ROSTER_TTL_HOURS, since districts can be added part way through a year.
+# Used by the downloaders (so each month's district list is only fetched once), the extractor's --check-districts,
+# and the Selenium scripts (Scraping_TM_using_Selenium/scrapeTM.py).
+# The rosters can be listed without going near the network, e.g. to plan a crawl:
+#   python ./tm_district_roster.py show 2019-2020
+
+DEFAULT_ROSTER_DIR = './CACHE/districts'
+ROSTER_TTL_HOURS = 24
+
+DISTRICT_DROPDOWN = re.compile(r"""<select\b[^>]*\bid=["']cpContent_TopControls[12]_ddlDistricts["'][^>]*>(.*?)</select>""",
+                               re.IGNORECASE | re.DOTALL)
+DROPDOWN_OPTION = re.compile(r"""<option\b[^>]*\bvalue=["']([^"']*)["']""", re.IGNORECASE)
+
+
+def parse_district_list(html):
+    ''' Returns the districts in the drop-down of a Club Performance page, in drop-down order,
+        or None if the page doesn't have the drop-down. Only the drop-down is parsed, not the whole page '''
+    dropdown = DISTRICT_DROPDOWN.search(html)
+    if dropdown is None:
+        return None
+    return [district for district in DROPDOWN_OPTION.findall(dropdown.group(1)) if district]
+
+
+def is_closed_program_year(program_year, today=None):
+    ''' True if the program year (like '2021-2022') ended before `today` - it ends on June 30 of its second year '''
+    today = today or datetime.date.today()
+    return today > datetime.date(int(program_year[-4:]), 6, 30)
+
+
+class DistrictRoster:
+    ''' The district list cache (see the top of this module) '''
+
+    def __init__(self, roster_dir=DEFAULT_ROSTER_DIR, ttl_hours=ROSTER_TTL_HOURS):
+        self.roster_dir = roster_dir
+        self.ttl_seconds = ttl_hours * 3600
+
+    def roster_filename(self, program_year, month):
+        return os.path.join(self.roster_dir, program_year, f"{month}.json")
+
+    def get(self, program_year, month, allow_stale=False):
+        ''' Returns the cached district list for the month, or None if there isn't one, or if it belongs to
+            the current program year and is older than the TTL (unless `allow_stale`) '''
+        filename = self.roster_filename(program_year, month)
+        try:
+            with open(filename) as fh:
+                roster = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if not (allow_stale or is_closed_program_year(program_year)):
+            if time.time() - os.path.getmtime(filename) > self.ttl_seconds:
+                return None
+        return roster['districts']
+
+    def put(self, program_year, month, districts, source=''):
+        filename = self.roster_filename(program_year, month)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # write to a temporary file and rename it, so a roster is never read half written
+        with open(filename + '.tmp', 'w') as fh:
+            json.dump({'districts': list(districts), 'fetched': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'source': source}, fh)
+        os.replace(filename + '.tmp', filename)
+
+    def get_or_fetch(self, program_year, month, fetch, refresh=False, source=''):
+        ''' Returns the cached district list for the month, or calls fetch() to get it (and caches it).
+            `refresh` always calls fetch(). Raises ValueError if fetch() returns None (e.g. parse_district_list()
+            of a page without the drop-down) - nothing is cached then '''
+        districts = None if refresh else self.get(program_year, month)
+        if districts is None:
+            districts = fetch()
+            if districts is None:
+                raise ValueError(f"No district list for {program_year} month {month}"
+                                 + (f" - the page has no district drop-down ({source})" if source else ''))
+            self.put(program_year, month, districts, source)
+        return districts
+
+    def months(self, program_year):
+        ''' The months of the program year that have a cached roster '''
+        year_dir = os.path.join(self.roster_dir, program_year)
+        if not os.path.isdir(year_dir):
+            return []
+        return [f[:-len('.json')] for f in os.listdir(year_dir) if f.endswith('.json')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--roster-dir', default=DEFAULT_ROSTER_DIR, help=f"default {DEFAULT_ROSTER_DIR}")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show_parser = subparsers.add_parser('show', help="show the cached district lists of a program year")
+    show_parser.add_argument('program_year')
+    show_parser.add_argument('months', nargs='*', help="default: every month with a cached list")
+    save_parser = subparsers.add_parser('save', help="cache the district list from a saved Club Performance page")
+    save_parser.add_argument('program_year')
+    save_parser.add_argument('month')
+    save_parser.add_argument('html_file', help="e.g. ./HTML/2019-2020/7/F.html")
+    args = parser.parse_args()
+
+    roster = DistrictRoster(args.roster_dir)
+    if args.command == 'show':
+        months = args.months or sorted(roster.months(args.program_year), key=lambda m: (int(m) < 7, int(m)))
+        for month in months:
+            districts = roster.get(args.program_year, month, allow_stale=True)
+            if districts is None:
+                print(f"{args.program_year} month {month:>2}: not cached")
+            else:
+                print(f"{args.program_year} month {month:>2}: {len(districts)} districts - {' '.join(districts)}")
+    else:
+        with open(args.html_file, 'rb') as fh:
+            districts = parse_district_list(fh.read().decode('utf-8', errors='replace'))
+        if districts is None:
+            sys.exit(f"{args.html_file} doesn't have the district drop-down")
+        roster.put(args.program_year, args.month, districts, args.html_file)
+        print(f"Cached {len(districts)} districts for {args.program_year} month {args.month}")
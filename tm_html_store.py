@@ -0,0 +1,421 @@
+import os, sys, gzip, json, threading, argparse
+
+# The downloaded Club Performance pages can be stored in two ways:
+#  - HTMLDirectoryStore: the original layout, one file per page - ./HTML/{program year}/{month}/{district}.html
+#    (with any HTTP cache metadata in {district}.meta.json next to it)
+#  - HTMLArchive: one archive file per program year - ./HTML/{program year}.htmlarc
+#    Each page is compressed separately (as a gzip member) and appended to the archive, and an index file
+#    ./HTML/{program year}.htmlarc.idx.json maps each (month, district) to its offset and length, so any single
+#    page can be read without decompressing the rest. The pages are very repetitive ASP.NET markup,
+#    so they compress about 14x.
+#    While pages are being added, each new index entry is appended to ./HTML/{program year}.htmlarc.idx.log,
+#    and the whole index is only rewritten when the archive is closed. A page that is replaced (e.g. by the
+#    downloader's --refresh) leaves its old copy in the archive until it is compacted (python ./tm_html_store.py compact).
+# Both classes have the same methods, so the downloader can write to either one.
+
+ARCHIVE_EXTENSION = '.htmlarc'
+INDEX_EXTENSION = '.idx.json'
+INDEX_LOG_EXTENSION = '.idx.log'
+
+# the months of a Toastmasters program year, in program year order (July through June)
+TM_MONTHS = ('7','8','9','10','11','12','1','2','3','4','5','6')
+
+
+def page_key(month, district):
+    return f"{month}/{district}"
+
+
+def sort_pages(pages):
+    ''' Sorts (month, district) pairs in program year month order, then district order (01, 02, ... 126, F, U) '''
+    def key(page):
+        month, district = page
+        month_index = TM_MONTHS.index(month) if month in TM_MONTHS else len(TM_MONTHS)
+        if district.isdigit():
+            return (month_index, 0, int(district), district)
+        return (month_index, 1, 0, district)
+    return sorted(pages, key=key)
+
+
+class HTMLDirectoryStore:
+    ''' The pages for one program year, stored as loose files under {html_dir}/{program_year}/ '''
+
+    def __init__(self, html_dir, program_year):
+        self.path = os.path.join(html_dir, program_year)
+        self.program_year = program_year
+
+    def page_filename(self, month, district):
+        return os.path.join(self.path, month, f"{district}.html")
+
+    def meta_filename(self, month, district):
+        return os.path.join(self.path, month, f"{district}.meta.json")
+
+    def has_page(self, month, district):
+        return os.path.exists(self.page_filename(month, district))
+
+    def read_page_bytes(self, month, district):
+        with open(self.page_filename(month, district), 'rb') as fh:
+            return fh.read()
+
+    def page_size(self, month, district):
+        return os.path.getsize(self.page_filename(month, district))
+
+    def read_page(self, month, district):
+        # pages saved as downloaded have their encoding in their metadata, older ones are in the platform's default encoding
+        with open(self.page_filename(month, district), encoding=self.get_meta(month, district).get('encoding')) as fh:
+            return fh.read()
+
+    def get_meta(self, month, district):
+        ''' Returns the saved HTTP cache metadata (ETag / Last-Modified) for the page, or {} if there isn't any '''
+        try:
+            with open(self.meta_filename(month, district)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def write_page(self, month, district, html, meta=None):
+        ''' Saves a page - `html` is either a str (written in the platform's default encoding, like the older scripts did)
+            or the raw bytes of the page as downloaded (in which case meta['encoding'] should say what they're in).
+            The page is written to a temporary file and renamed, so a crash can't leave a partly written page behind '''
+        os.makedirs(os.path.join(self.path, month), exist_ok=True)
+        filename = self.page_filename(month, district)
+        with open(filename + '.tmp', 'wb' if isinstance(html, bytes) else 'w') as fh:
+            fh.write(html)
+        os.replace(filename + '.tmp', filename)
+        if meta:
+            self.write_meta(month, district, meta)
+
+    def write_meta(self, month, district, meta):
+        filename = self.meta_filename(month, district)
+        with open(filename + '.tmp', 'w') as fh:
+            json.dump(meta, fh)
+        os.replace(filename + '.tmp', filename)
+
+    def pages(self):
+        ''' Returns all the saved (month, district) pages, in sort_pages() order '''
+        pages = []
+        for month in TM_MONTHS:
+            month_dir = os.path.join(self.path, month)
+            if os.path.isdir(month_dir):
+                pages.extend((month, os.path.splitext(f)[0]) for f in os.listdir(month_dir) if f.endswith('.html'))
+        return sort_pages(pages)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HTMLArchive:
+    ''' The pages for one program year, stored in a single compressed archive file (see the top of this module).
+        mode 'r' opens an existing archive read-only, mode 'a' opens it for adding pages (creating it if necessary).
+        Pages are stored as UTF-8 and read_page() returns str, like reading the loose files.
+        Adding a page that is already in the archive appends the new copy and points the index at it
+        (compact() drops the old copies). Only one process should have an archive open in mode 'a' at a time '''
+
+    def __init__(self, path, mode='r'):
+        if mode not in ('r', 'a'):
+            raise ValueError(f"HTMLArchive mode must be 'r' or 'a', not {mode!r}")
+        self.path = path
+        self.index_path = path + INDEX_EXTENSION
+        self.log_path = path + INDEX_LOG_EXTENSION
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.log_fh = None
+        # the size of the complete lines in the index log (see replay_index_log())
+        self.log_size = 0
+        if mode == 'a':
+            with self.lock:
+                self.finish_compaction()
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+        self.fh = open(path, 'rb' if mode == 'r' else 'r+b')
+        self.index = {}
+        # a reader can open the archive while it is being compacted - if the compacted archive is already in place
+        # (the file just opened), its index has to be used, and the index log is from before the compaction
+        compacted_index = self.read_compacted_index(os.fstat(self.fh.fileno()).st_size) if mode == 'r' else None
+        if compacted_index is not None:
+            self.index = compacted_index
+        else:
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as fh:
+                    self.index = json.load(fh)['pages']
+            self.replay_index_log()
+
+    def replay_index_log(self):
+        ''' Applies the index entries added since the index was last saved (see the top of this module).
+            The last line can be incomplete if the writer was killed part way through it - it is ignored
+            (and cut off before any more entries are logged - see log_index_entry()) '''
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'rb') as fh:
+            for line in fh:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.index[record['key']] = record['entry']
+                self.log_size += len(line)
+
+    @property
+    def program_year(self):
+        return os.path.basename(self.path)[:-len(ARCHIVE_EXTENSION)]
+
+    def has_page(self, month, district):
+        return page_key(month, district) in self.index
+
+    def read_page_bytes(self, month, district):
+        entry = self.index[page_key(month, district)]
+        if hasattr(os, 'pread'):
+            # pread() doesn't use (or move) the shared file offset, so reads can't get mixed up with each other -
+            # even in forked worker processes that inherited the same open file
+            compressed = os.pread(self.fh.fileno(), entry['length'], entry['offset'])
+        else:
+            with self.lock:
+                self.fh.seek(entry['offset'])
+                compressed = self.fh.read(entry['length'])
+        return gzip.decompress(compressed)
+
+    def read_page(self, month, district):
+        return self.read_page_bytes(month, district).decode('utf-8')
+
+    def page_size(self, month, district):
+        return self.index[page_key(month, district)]['size']
+
+    def get_meta(self, month, district):
+        return self.index.get(page_key(month, district), {}).get('meta', {})
+
+    def write_page(self, month, district, html, meta=None):
+        if self.mode != 'a':
+            raise OSError(f"{self.path} was opened read-only")
+        if isinstance(html, bytes) and meta and (meta.get('encoding') or 'utf-8').lower() not in ('utf-8', 'utf8'):
+            # the archive always stores UTF-8
+            html = html.decode(meta['encoding'])
+            meta = dict(meta, encoding='utf-8')
+        data = html.encode('utf-8') if isinstance(html, str) else html
+        compressed = gzip.compress(data, compresslevel=6, mtime=0)
+        with self.lock:
+            # append the page first, then update the index, so a crash can't leave the index pointing at a partial page
+            self.fh.seek(0, os.SEEK_END)
+            offset = self.fh.tell()
+            self.fh.write(compressed)
+            self.fh.flush()
+            entry = {'offset': offset, 'length': len(compressed), 'size': len(data)}
+            if meta:
+                entry['meta'] = meta
+            self.log_index_entry(page_key(month, district), entry)
+
+    def write_meta(self, month, district, meta):
+        with self.lock:
+            key = page_key(month, district)
+            self.log_index_entry(key, dict(self.index[key], meta=meta))
+
+    def log_index_entry(self, key, entry):
+        ''' Adds an entry to the index, appending it to the index log (the index itself is saved by close()) '''
+        if self.log_fh is None:
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.log_size:
+                # an incomplete last line, from a writer that was killed - new entries mustn't be appended to it
+                os.truncate(self.log_path, self.log_size)
+            self.log_fh = open(self.log_path, 'a', newline='\n')
+        self.log_fh.write(json.dumps({'key': key, 'entry': entry}) + '\n')
+        self.log_fh.flush()
+        self.index[key] = entry
+
+    def save_index(self, index_path=None, extra=None):
+        ''' Writes the index to a temporary file and renames it over the old one, so the index is always complete '''
+        index_path = index_path or self.index_path
+        temp_path = index_path + '.tmp'
+        with open(temp_path, 'w') as fh:
+            json.dump(dict({'version': 1, 'pages': self.index}, **(extra or {})), fh)
+        os.replace(temp_path, index_path)
+
+    def wasted_bytes(self):
+        ''' The bytes taken up by old copies of replaced pages (or pages whose index entry was never saved) '''
+        return os.path.getsize(self.path) - sum(entry['length'] for entry in self.index.values())
+
+    def compact(self):
+        ''' Rewrites the archive with just the current copy of each page, dropping the old copies of replaced pages.
+            Returns the number of bytes saved.
+            The new archive and its index are written alongside the old ones first. The new index is put in place
+            (as {index}.compacted) before the new archive is renamed over the old one, and if it is interrupted between
+            the two renames, finish_compaction() completes it the next time the archive is opened '''
+        if self.mode != 'a':
+            raise OSError(f"{self.path} was opened read-only")
+        with self.lock:
+            old_size = os.path.getsize(self.path)
+            new_index = {}
+            with open(self.path + '.compact', 'wb') as out_fh:
+                for month, district in sort_pages(tuple(key.split('/')) for key in self.index):
+                    key = page_key(month, district)
+                    entry = self.index[key]
+                    self.fh.seek(entry['offset'])
+                    compressed = self.fh.read(entry['length'])
+                    new_index[key] = dict(entry, offset=out_fh.tell())
+                    out_fh.write(compressed)
+                new_size = out_fh.tell()
+            self.index = new_index
+            self.save_index(self.index_path + '.compacted', {'archive_size': new_size})
+            self.fh.close()
+            if self.log_fh:
+                self.log_fh.close()
+                self.log_fh = None
+            os.replace(self.path + '.compact', self.path)
+            self.finish_compaction()
+            self.log_size = 0
+            self.fh = open(self.path, 'r+b')
+        return old_size - new_size
+
+    def read_compacted_index(self, archive_size):
+        ''' Returns the pages of the compacted index (see compact()) if there is one and it is for an archive
+            of `archive_size` bytes, otherwise None '''
+        try:
+            with open(self.index_path + '.compacted') as fh:
+                compacted = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        return compacted['pages'] if compacted.get('archive_size') == archive_size else None
+
+    def finish_compaction(self):
+        ''' Puts the index of a compacted archive in place (see compact()) - if the compacted archive is in place too.
+            If it isn't, the compaction didn't get that far, and the old archive and index are still good.
+            Only the writer (mode 'a', holding self.lock) does this - readers just use the compacted index if it
+            applies (see __init__()) '''
+        compacted_index_path = self.index_path + '.compacted'
+        if not os.path.exists(compacted_index_path):
+            return
+        archive_size = os.path.getsize(self.path) if os.path.exists(self.path) else None
+        if self.read_compacted_index(archive_size) is not None:
+            os.replace(compacted_index_path, self.index_path)
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+        else:
+            os.remove(compacted_index_path)
+
+    def pages(self):
+        ''' Returns all the (month, district) pages in the archive, in sort_pages() order '''
+        return sort_pages(tuple(key.split('/')) for key in self.index)
+
+    def close(self):
+        if self.log_fh:
+            self.log_fh.close()
+            self.log_fh = None
+        if self.mode == 'a' and os.path.exists(self.log_path):
+            # save the whole index, then the log isn't needed any more
+            self.save_index()
+            os.remove(self.log_path)
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# read-only archives opened by read_archived_page(), kept open for the life of the process.
+# They are keyed by process id as well as path, so a worker process forked from a process that already had
+# an archive open opens its own copy rather than sharing the parent's file
+_open_archives = {}
+
+
+def get_open_archive(archive_path):
+    key = (os.getpid(), archive_path)
+    if key not in _open_archives:
+        _open_archives[key] = HTMLArchive(archive_path)
+    return _open_archives[key]
+
+
+def read_archived_page(archive_path, month, district):
+    ''' Reads one page from an archive, keeping the archive open for the next call
+        (this is how the extractor's worker processes read archived pages) '''
+    return get_open_archive(archive_path).read_page(month, district)
+
+
+def get_archived_page_bytes(archive_path, month, district):
+    ''' Like read_archived_page(), but returns the page's UTF-8 bytes without decoding them '''
+    return get_open_archive(archive_path).read_page_bytes(month, district)
+
+
+def get_archived_page_info(archive_path, month, district):
+    ''' Returns the index entry (offset, length, size, meta) of an archived page, using the same open archives
+        as read_archived_page(). A page that has been rewritten gets a new offset '''
+    return get_open_archive(archive_path).index[page_key(month, district)]
+
+
+def is_archive(path):
+    return path.endswith(ARCHIVE_EXTENSION) and os.path.isfile(path)
+
+
+def pack_directory(year_dir, archive_path=None, source_encoding=None):
+    ''' Copies the loose pages in ./HTML/{program year}/ into ./HTML/{program year}.htmlarc
+        (pages already in the archive are skipped). `source_encoding` is the encoding the loose files
+        were saved with, for pages without an 'encoding' in their metadata - the default is the platform's default encoding,
+        which older versions of the downloader saved them in. Returns the archive path '''
+    year_dir = os.path.normpath(year_dir)
+    html_dir, program_year = os.path.split(year_dir)
+    if archive_path is None:
+        archive_path = year_dir + ARCHIVE_EXTENSION
+    source = HTMLDirectoryStore(html_dir, program_year)
+    with HTMLArchive(archive_path, 'a') as archive:
+        for month, district in source.pages():
+            if archive.has_page(month, district):
+                continue
+            meta = source.get_meta(month, district)
+            with open(source.page_filename(month, district), encoding=meta.get('encoding') or source_encoding) as fh:
+                html = fh.read()
+            if meta.get('encoding'):
+                # the archive always stores UTF-8
+                meta['encoding'] = 'utf-8'
+            archive.write_page(month, district, html, meta)
+            sys.stdout.write(f"{month}/{district} ")
+            sys.stdout.flush()
+    print()
+    return archive_path
+
+
+def unpack_archive(archive_path, html_dir):
+    ''' Writes every page of an archive out as loose files under {html_dir}/{program year}/ '''
+    with HTMLArchive(archive_path) as archive:
+        target = HTMLDirectoryStore(html_dir, archive.program_year)
+        for month, district in archive.pages():
+            # write the pages out as UTF-8 bytes, and record that in their metadata
+            meta = dict(archive.get_meta(month, district), encoding='utf-8')
+            target.write_page(month, district, archive.read_page_bytes(month, district), meta)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    pack_parser = subparsers.add_parser('pack', help="pack ./HTML/{program year}/ into ./HTML/{program year}.htmlarc")
+    pack_parser.add_argument('year_dir', help="e.g. ./HTML/2021-2022")
+    pack_parser.add_argument('--source-encoding', help="encoding of the loose files (default: platform default)")
+    unpack_parser = subparsers.add_parser('unpack', help="unpack an archive into loose files")
+    unpack_parser.add_argument('archive', help="e.g. ./HTML/2021-2022.htmlarc")
+    unpack_parser.add_argument('html_dir', help="directory to unpack into - pages go in {html_dir}/{program year}/")
+    list_parser = subparsers.add_parser('list', help="list the pages in an archive")
+    list_parser.add_argument('archive')
+    compact_parser = subparsers.add_parser('compact', help="drop the old copies of replaced pages from an archive")
+    compact_parser.add_argument('archive')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        archive_path = pack_directory(args.year_dir, source_encoding=args.source_encoding)
+        print(f"Packed {args.year_dir} into {archive_path}")
+    elif args.command == 'unpack':
+        unpack_archive(args.archive, args.html_dir)
+    elif args.command == 'compact':
+        with HTMLArchive(args.archive, 'a') as archive:
+            saved = archive.compact()
+        print(f"Compacted {args.archive} - {saved} bytes saved")
+    else:
+        with HTMLArchive(args.archive) as archive:
+            for month, district in archive.pages():
+                entry = archive.index[page_key(month, district)]
+                print(f"{month:>2} {district:>4} {entry['size']:>8} bytes, {entry['length']:>7} compressed")
+            if archive.wasted_bytes():
+                print(f"{archive.wasted_bytes()} bytes of replaced pages - python ./tm_html_store.py compact {args.archive}")
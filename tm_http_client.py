@@ -0,0 +1,196 @@
+import time, random, threading, email.message, urllib.parse
+import urllib3
+
+# This is the shared HTTP client used by all the dashboards.toastmasters.org downloaders.
+# Instead of opening a new connection for every page (like urllib.request.urlopen does), it keeps a pool of
+# keep-alive connections to each host and reuses them, and it asks for gzip/deflate compressed pages.
+# One PoolManager is shared by the whole process - it is safe to use from several threads at once.
+# call_with_retry() retries failed requests with jittered exponential backoff, and each host has a CircuitBreaker
+# that pauses all requests to it when the site is failing, rather than working through every district regardless.
+
+# number of hosts to keep connection pools for, and the number of idle connections kept per host
+POOL_HOSTS = 4
+POOL_CONNECTIONS_PER_HOST = 10
+
+REQUEST_HEADERS = urllib3.make_headers(keep_alive=True, accept_encoding='gzip,deflate')
+
+# HTTP statuses worth retrying - the site is overloaded or briefly unavailable
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_RETRIES = 3
+
+# urllib3 would otherwise retry failed requests itself (3 times by default), on top of call_with_retry() -
+# so it only follows redirects
+NO_RETRIES = urllib3.Retry(total=None, connect=0, read=0, status=0, other=0, redirect=5)
+
+_pool_manager = None
+
+
+class FetchError(Exception):
+    ''' Raised when the server answers with an HTTP error status (4xx or 5xx) '''
+    def __init__(self, url, status):
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+
+
+class RetryableError(Exception):
+    ''' Base class for problems that are worth retrying the request for (see call_with_retry()).
+        A subclass can set `max_retries` to retry that kind of problem fewer times than the other errors '''
+    max_retries = None
+
+
+class CircuitOpenError(Exception):
+    ''' Raised when a host's CircuitBreaker has tripped too many times in a row - the site is down '''
+
+
+def get_pool_manager():
+    ''' Returns the process-wide urllib3 PoolManager, creating it on first use '''
+    global _pool_manager
+    if _pool_manager is None:
+        _pool_manager = urllib3.PoolManager(num_pools=POOL_HOSTS, maxsize=POOL_CONNECTIONS_PER_HOST,
+                                            headers=REQUEST_HEADERS,
+                                            timeout=urllib3.Timeout(connect=15, read=60),
+                                            retries=NO_RETRIES)
+    return _pool_manager
+
+
+def fetch(url):
+    ''' Returns the body of the web page at `url` as bytes (already decompressed if the server sent it
+        gzip or deflate encoded). Raises FetchError if the server returns an HTTP error status '''
+    response = get_pool_manager().request('GET', url, decode_content=True)
+    if response.status >= 400:
+        raise FetchError(url, response.status)
+    return response.data
+
+
+def get_response_charset(response):
+    ''' Returns the charset from the response's Content-Type header (e.g. 'utf-8'), or None if there isn't one '''
+    message = email.message.Message()
+    message['Content-Type'] = response.headers.get('Content-Type', '')
+    return message.get_content_charset()
+
+
+def fetch_conditional(url, etag=None, last_modified=None):
+    ''' Conditional GET: sends If-None-Match / If-Modified-Since for a page we already have a copy of.
+        Returns a (body, validators) tuple - `body` is None if the server answered 304 Not Modified,
+        and `validators` is a dict with the 'etag' and 'last_modified' values to send next time
+        (None for any the server didn't supply), and the 'encoding' of the body (the charset from its Content-Type,
+        or None). Raises FetchError on HTTP error statuses '''
+    headers = dict(REQUEST_HEADERS)
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    response = get_pool_manager().request('GET', url, headers=headers, decode_content=True)
+    if response.status >= 400:
+        raise FetchError(url, response.status)
+    validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+    if response.status == 304:
+        # a 304 may leave out the validators - keep the ones we sent
+        validators = {'etag': validators['etag'] or etag, 'last_modified': validators['last_modified'] or last_modified}
+        return None, validators
+    validators['encoding'] = get_response_charset(response)
+    return response.data, validators
+
+
+def fetch_text(url):
+    ''' Returns the web page at `url` as a str - the dashboards pages are UTF-8 '''
+    return fetch(url).decode()
+
+
+def is_retryable(error):
+    ''' True for errors worth retrying: timeouts and connection errors, the RETRY_STATUSES, and RetryableErrors '''
+    if isinstance(error, FetchError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, (urllib3.exceptions.HTTPError, RetryableError))
+
+
+def backoff_delay(attempt, base_delay=2.0, max_delay=60.0):
+    ''' "Full jitter" exponential backoff: a random delay between 0 and base_delay * 2**attempt (capped at max_delay),
+        so workers that failed together don't all retry at the same moment '''
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    ''' Counts consecutive failed requests to a host. After `threshold` of them the breaker trips, and every request
+        waits until the `cooldown` is over (doubling each time it trips again without a success in between) instead of
+        adding to the load on a struggling site. The first request after the cooldown is a trial - if it fails the
+        breaker trips again straight away. After `max_trips` trips in a row it gives up and raises CircuitOpenError.
+        It can be shared by several threads '''
+
+    def __init__(self, threshold=5, cooldown=60.0, max_trips=5):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        with self.lock:
+            if self.trips >= self.max_trips:
+                raise CircuitOpenError(f"gave up after {self.trips} failed cooldowns in a row")
+            wait = self.open_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = self.trips = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold and time.monotonic() >= self.open_until:
+                cooldown = self.cooldown * 2 ** self.trips
+                self.trips += 1
+                self.open_until = time.monotonic() + cooldown
+                # one more failure after the cooldown trips it again
+                self.failures = self.threshold - 1
+                print(f"\nToo many failed requests - pausing for {cooldown:.0f} seconds")
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url):
+    ''' Returns the process-wide CircuitBreaker for the host of `url` '''
+    host = urllib.parse.urlsplit(url).netloc
+    with _circuit_breakers_lock:
+        if host not in _circuit_breakers:
+            _circuit_breakers[host] = CircuitBreaker()
+        return _circuit_breakers[host]
+
+
+def call_with_retry(request, retries=DEFAULT_RETRIES, breaker=None, base_delay=2.0, max_delay=60.0):
+    ''' Returns request(), calling it again (up to `retries` more times, after a backoff_delay()) if it raises
+        an is_retryable() error - the last error is raised if it still fails. A RetryableError with a `max_retries`
+        is retried at most that many times. Each attempt goes through the `breaker` (a CircuitBreaker) if one is
+        supplied, and every retryable error counts as a failure. Other errors (e.g. 404 Not Found) are raised
+        straight away '''
+    limited_retries = {}
+    for attempt in range(retries + 1):
+        if breaker:
+            breaker.before_request()
+        try:
+            result = request()
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            if breaker:
+                breaker.record_failure()
+            if attempt == retries:
+                raise
+            max_retries = getattr(e, 'max_retries', None)
+            if max_retries is not None:
+                # counted by kind of error, so a timeout or two doesn't use them up
+                limited_retries[type(e)] = limited_retries.get(type(e), 0) + 1
+                if limited_retries[type(e)] > max_retries:
+                    raise
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        if breaker:
+            breaker.record_success()
+        return result
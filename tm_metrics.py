@@ -0,0 +1,146 @@
+import os, json, time, socket
+from collections import Counter
+
+# Structured instrumentation for the extraction pipeline (Extract_Club_data_from_HTML.py --metrics PATH).
+# For every district page it records the wall clock and CPU time spent reading, parsing and writing it,
+# the bytes read, the rows extracted, and the kind of problem if the page couldn't be used.
+# PATH picks the output format:
+#   *.prom - a Prometheus textfile (for node_exporter's textfile collector), with the totals for the run.
+#            It is rewritten at the end of each run, through a temporary file, so it is never read half written.
+#   anything else - JSON lines, appended to PATH: one {"event": "page", ...} line per page as it is written,
+#            then one {"event": "run", ...} line with the totals, so a slow night can be traced to one
+#            district file, to disk (read), parsing, or the output writers (write).
+# Each page is counted as parsed, cached (its rows were reused by --incremental, or came from the --cache parse cache)
+# or a problem (it couldn't be used - see read_and_extract()).
+# Reading and parsing happen in the worker processes (with --workers), so those CPU times are the workers',
+# and the write times are the main process's.
+
+STAGES = ('read', 'parse', 'write')
+
+
+class StageClock:
+    ''' Measures the wall clock and CPU time since it was created (or since the last lap) '''
+
+    def __init__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def lap(self):
+        ''' Returns (wall seconds, CPU seconds) since the last lap, and starts the next one '''
+        wall, cpu = time.perf_counter(), time.process_time()
+        times = (wall - self.wall, cpu - self.cpu)
+        self.wall, self.cpu = wall, cpu
+        return times
+
+
+class ExtractionMetrics:
+    ''' Collects the per-page measurements (see read_and_extract() and process_page_list()) for one run '''
+
+    def __init__(self, path):
+        self.path = path
+        self.prometheus = path.endswith('.prom')
+        self.run_id = f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+        self.clock = StageClock()
+        self.pages = self.rows = self.bytes_read = 0
+        # cached pages, by where their rows came from - the --incremental manifest or the parse cache
+        self.cached_pages = Counter()
+        self.problem_pages = 0
+        self.seconds = {(stage, clock): 0.0 for stage in STAGES for clock in ('wall', 'cpu')}
+        self.errors = Counter()
+        self.slowest_page = None
+        self.jsonl_fh = None
+        if not self.prometheus:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.jsonl_fh = open(path, 'a')
+
+    def record_page(self, prog_year, month, district, source, rows, page_stats, write_times=(0.0, 0.0)):
+        ''' `page_stats` is the stats dict returned by read_and_extract(), or None for a page whose rows were reused
+            by --incremental. `rows` is the number of rows written (0 for a problem page) '''
+        self.pages += 1
+        self.rows += rows
+        record = {'event': 'page', 'run': self.run_id, 'program_year': prog_year, 'month': month,
+                  'district': district, 'source': source, 'rows': rows}
+        if page_stats is None:
+            self.cached_pages['manifest'] += 1
+            record['cached'] = True
+        else:
+            record.update(page_stats)
+            if page_stats['error']:
+                self.problem_pages += 1
+            elif page_stats.get('parse_cache') == 'hit':
+                self.cached_pages['parse_cache'] += 1
+                record['cached'] = True
+            self.bytes_read += page_stats['bytes']
+            for stage in ('read', 'parse'):
+                self.seconds[(stage, 'wall')] += page_stats[f'{stage}_wall']
+                self.seconds[(stage, 'cpu')] += page_stats[f'{stage}_cpu']
+            if page_stats['error']:
+                self.errors[page_stats['error']] += 1
+            page_seconds = page_stats['read_wall'] + page_stats['parse_wall']
+            if self.slowest_page is None or page_seconds > self.slowest_page[0]:
+                self.slowest_page = (page_seconds, prog_year, month, district)
+        record['write_wall'], record['write_cpu'] = write_times
+        self.add_write_times(write_times)
+        if self.jsonl_fh:
+            self.jsonl_fh.write(json.dumps(record) + '\n')
+
+    def add_write_times(self, write_times):
+        ''' Adds time spent in the output writers outside of any one page (e.g. a month's end_month()) '''
+        self.seconds[('write', 'wall')] += write_times[0]
+        self.seconds[('write', 'cpu')] += write_times[1]
+
+    def parsed_pages(self):
+        ''' The pages that were parsed and used - not cached, and not problem pages '''
+        return self.pages - sum(self.cached_pages.values()) - self.problem_pages
+
+    def summary(self):
+        run_wall, run_cpu = self.clock.lap()
+        return {'event': 'run', 'run': self.run_id, 'pages': self.pages, 'parsed_pages': self.parsed_pages(),
+                'cached_pages': sum(self.cached_pages.values()), 'cached_by': dict(self.cached_pages),
+                'problem_pages': self.problem_pages, 'rows': self.rows, 'bytes_read': self.bytes_read,
+                'seconds': {f"{stage}_{clock}": round(seconds, 4) for (stage, clock), seconds in self.seconds.items()},
+                'run_wall': round(run_wall, 4), 'run_cpu': round(run_cpu, 4), 'errors': dict(self.errors),
+                'slowest_page': None if self.slowest_page is None else
+                    dict(zip(('seconds', 'program_year', 'month', 'district'), self.slowest_page))}
+
+    def format_prometheus(self, summary):
+        lines = []
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        metric('tm_extract_pages', 'gauge', "District pages processed in the last run - parsed, cached or a problem",
+               [({'source': 'parsed'}, self.parsed_pages()), ({'source': 'cached'}, sum(self.cached_pages.values())),
+                ({'source': 'problem'}, self.problem_pages)])
+        metric('tm_extract_cached_pages', 'gauge', "Cached pages in the last run, by where their rows came from",
+               [({'cache': cache}, self.cached_pages[cache]) for cache in ('manifest', 'parse_cache')])
+        metric('tm_extract_rows', 'gauge', "Club rows written in the last run", [({}, self.rows)])
+        metric('tm_extract_bytes_read', 'gauge', "Page bytes read in the last run", [({}, self.bytes_read)])
+        metric('tm_extract_stage_seconds', 'gauge', "Time spent in each stage in the last run",
+               [({'stage': stage, 'clock': clock}, round(seconds, 4)) for (stage, clock), seconds in self.seconds.items()])
+        metric('tm_extract_errors', 'gauge', "Problem pages in the last run, by kind of problem",
+               [({'type': error}, count) for error, count in sorted(self.errors.items())])
+        metric('tm_extract_run_seconds', 'gauge', "Wall clock time of the last run", [({}, summary['run_wall'])])
+        if self.slowest_page:
+            seconds, prog_year, month, district = self.slowest_page
+            metric('tm_extract_slowest_page_seconds', 'gauge', "Read and parse time of the slowest page in the last run",
+                   [({'program_year': prog_year, 'month': month, 'district': district}, round(seconds, 4))])
+        metric('tm_extract_last_run_timestamp_seconds', 'gauge', "When the last run finished", [({}, int(time.time()))])
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        summary = self.summary()
+        if self.prometheus:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as fh:
+                fh.write(self.format_prometheus(summary))
+            os.replace(temp_path, self.path)
+        else:
+            self.jsonl_fh.write(json.dumps(summary) + '\n')
+            self.jsonl_fh.close()
+        return summary
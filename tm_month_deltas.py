@@ -0,0 +1,161 @@
+import os, sys, csv, argparse
+
+from Extract_Club_data_from_HTML import DCP_COLUMNS, TM_MONTHS, MonthWriter, write_csv_file
+from tm_club_record import ALL_GOALS
+
+# Month-over-month changes in the clubs' DCP data: which clubs gained or lost members or goals, or changed status,
+# between one month and the one before. The two months are joined on Club Number (a hash join - the earlier month
+# is loaded into a dict) and only what changed is written, one row per changed value, to a small CSV file per month:
+#   ./DELTAS/{program year}_{month}.csv
+#   "Program Year","Month","District","Division","Area","Club Number","Club Name","Column","Previous","Current","Change"
+# where Change is Current - Previous for the counts. A club that is new in the month has a row with Column "Club"
+# and Current "new", and a club that has gone has one with Current "dropped" (only for the districts the month has
+# data for, so a single district's file can be compared with a whole month).
+# The month before July is June of the previous program year.
+# The deltas can be worked out from the extracted CSV files:
+#   python ./tm_month_deltas.py 2022-2023 8 9
+# or as the pages are extracted (python ./Extract_Club_data_from_HTML.py ./HTML/2022-2023 --deltas).
+
+DEFAULT_DELTA_DIR = './DELTAS'
+DEFAULT_CSV_DIR = './CSVs'
+
+DELTA_COLUMNS = ("Program Year", "Month", "District", "Division", "Area", "Club Number", "Club Name",
+                 "Column", "Previous", "Current", "Change")
+
+# the columns compared between the months
+COMPARED_COLUMNS = ("Club Status", "Mem. Base", "Active Members", "Goals Met") + ALL_GOALS + ("Club Distinguished Status",)
+COMPARED_INDEXES = [DCP_COLUMNS.index(column) for column in COMPARED_COLUMNS]
+DISTRICT, DIVISION, AREA, CLUB_NUMBER, CLUB_NAME = (DCP_COLUMNS.index(column) for column in
+                                                    ("District", "Division", "Area", "Club Number", "Club Name"))
+
+
+def previous_month(prog_year, month):
+    ''' Returns the (program year, month) before a program year month - ('2022-2023', '7') -> ('2021-2022', '6') '''
+    month = int(month)
+    if month == 7:
+        first_year, second_year = map(int, prog_year.split('-'))
+        return f"{first_year - 1}-{second_year - 1}", '6'
+    return prog_year, str(12 if month == 1 else month - 1)
+
+
+def get_delta_filename(prog_year, month, delta_dir=DEFAULT_DELTA_DIR):
+    return os.path.join(delta_dir, f"{prog_year}_{month}.csv")
+
+
+def to_csv_values(row):
+    ''' A row in DCP_COLUMNS order, with its values as they are in the CSV files (strings, empty for None) '''
+    return ['' if value is None else str(value) for value in row]
+
+
+def load_month(prog_year, month, csv_dir=DEFAULT_CSV_DIR):
+    ''' Returns a month's rows (in DCP_COLUMNS order, as strings) from the extracted CSV files - the month's own file
+        ({program year}_{month}.csv) if there is one, otherwise the program year's file - or None if there are none '''
+    month = str(month)
+    for filename in (f"{prog_year}_{month}.csv", f"{prog_year}.csv"):
+        path = os.path.join(csv_dir, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='') as fh:
+            reader = csv.reader(fh)
+            header = next(reader)
+            indexes = [header.index(column) for column in DCP_COLUMNS]
+            year_index, month_index = header.index("Program Year"), header.index("Month")
+            rows = [[row[i] for i in indexes] for row in reader
+                    if row and row[month_index] == month and row[year_index] == prog_year]
+        if rows:
+            return rows
+    return None
+
+
+def numeric_change(previous, current):
+    if previous.lstrip('-').isdigit() and current.lstrip('-').isdigit():
+        return int(current) - int(previous)
+    return ''
+
+
+def compute_deltas(previous_rows, current_rows, prog_year, month):
+    ''' Returns the DELTA_COLUMNS rows for the changes between two months' rows (in DCP_COLUMNS order, as strings) '''
+    month = str(month)
+    previous_clubs = {row[CLUB_NUMBER]: row for row in previous_rows}
+    deltas = []
+
+    def delta(row, column, previous, current, change=''):
+        deltas.append([prog_year, month, row[DISTRICT], row[DIVISION], row[AREA], row[CLUB_NUMBER], row[CLUB_NAME],
+                       column, previous, current, change])
+
+    for row in current_rows:
+        previous_row = previous_clubs.pop(row[CLUB_NUMBER], None)
+        if previous_row is None:
+            delta(row, "Club", '', 'new')
+            continue
+        for column, i in zip(COMPARED_COLUMNS, COMPARED_INDEXES):
+            if row[i] != previous_row[i]:
+                delta(row, column, previous_row[i], row[i], numeric_change(previous_row[i], row[i]))
+    # the clubs left over have gone - if their district is in the current month's data
+    districts = {row[DISTRICT] for row in current_rows}
+    for previous_row in previous_clubs.values():
+        if previous_row[DISTRICT] in districts:
+            delta(previous_row, "Club", '', 'dropped')
+    return deltas
+
+
+def write_deltas(deltas, prog_year, month, delta_dir=DEFAULT_DELTA_DIR):
+    os.makedirs(delta_dir, exist_ok=True)
+    return write_csv_file(get_delta_filename(prog_year, month, delta_dir), DELTA_COLUMNS, deltas)
+
+
+def describe_deltas(deltas, prog_year, month):
+    clubs = {row[5] for row in deltas}
+    new = sum(1 for row in deltas if row[7] == "Club" and row[9] == 'new')
+    dropped = sum(1 for row in deltas if row[7] == "Club" and row[9] == 'dropped')
+    return f"{prog_year} month {month:>2}: {len(deltas)} changes in {len(clubs)} clubs ({new} new, {dropped} dropped)"
+
+
+class MonthDeltaWriter(MonthWriter):
+    ''' Works out and writes each month's deltas as the pages are extracted (see MonthWriter).
+        The month before is the one extracted just before it in the same run, or is read from the CSV files '''
+
+    def __init__(self, delta_dir=DEFAULT_DELTA_DIR, csv_dir=DEFAULT_CSV_DIR):
+        super().__init__()
+        self.delta_dir = delta_dir
+        self.csv_dir = csv_dir
+        self.previous = (None, None, None)
+
+    def write_month(self, rows, prog_year, month, districts):
+        current_rows = [to_csv_values(row) for row in rows]
+        before = previous_month(prog_year, month)
+        if self.previous[:2] == before:
+            previous_rows = self.previous[2]
+        else:
+            previous_rows = load_month(*before, self.csv_dir)
+        self.previous = (prog_year, str(month), current_rows)
+        if previous_rows is None:
+            print(f"\nNo data for {before[0]} month {before[1]} - no deltas for month {month}", end='')
+            return
+        write_deltas(compute_deltas(previous_rows, current_rows, prog_year, month), prog_year, month, self.delta_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('program_year', help="e.g. 2022-2023")
+    parser.add_argument('months', nargs='*', help="default: every month of the program year with data")
+    parser.add_argument('--csv-dir', default=DEFAULT_CSV_DIR, help=f"default {DEFAULT_CSV_DIR}")
+    parser.add_argument('--delta-dir', default=DEFAULT_DELTA_DIR, help=f"default {DEFAULT_DELTA_DIR}")
+    args = parser.parse_args()
+
+    previous = (None, None, None)
+    for month in args.months or TM_MONTHS:
+        current_rows = load_month(args.program_year, month, args.csv_dir)
+        if current_rows is None:
+            if args.months:
+                print(f"{args.program_year} month {month:>2}: no data in {args.csv_dir}", file=sys.stderr)
+            continue
+        before = previous_month(args.program_year, month)
+        previous_rows = previous[2] if previous[:2] == before else load_month(*before, args.csv_dir)
+        previous = (args.program_year, month, current_rows)
+        if previous_rows is None:
+            print(f"{args.program_year} month {month:>2}: no data for {before[0]} month {before[1]} to compare with")
+            continue
+        deltas = compute_deltas(previous_rows, current_rows, args.program_year, month)
+        write_deltas(deltas, args.program_year, month, args.delta_dir)
+        print(describe_deltas(deltas, args.program_year, month))
@@ -0,0 +1,60 @@
+import os
+
+from Extract_Club_data_from_HTML import DCP_COLUMNS, INTEGER_COLUMNS, MonthWriter, replacing_file
+
+# Writes the rows produced by extract_Club_data() as Parquet files, one per program year and month:
+#   ./PARQUET/program_year=2022-2023/month=7/part-0.parquet
+# Each file has the same 30 columns as the CSV files, but typed - the counts are integers, and the
+# District, Division, Area, Club Status, Club Distinguished Status and Program Year columns are dictionary encoded.
+# The directory names follow the "hive" partitioning convention, so a reader only has to open the
+# years and months it asks for, and only reads the columns it needs, e.g.
+#   import pyarrow.dataset as ds
+#   dataset = ds.dataset('./PARQUET', format='parquet', partitioning='hive')
+#   table = dataset.to_table(columns=["Club Number", "Active Members"], filter=ds.field('program_year') >= '2018-2019')
+#
+# This needs pyarrow (pip install pyarrow), which is only imported when a ParquetWriter is created,
+# so the extractor still runs without it.
+
+DEFAULT_PARQUET_DIR = './PARQUET'
+
+DICTIONARY_COLUMNS = {"District", "Division", "Area", "Club Status", "Club Distinguished Status", "Program Year"}
+
+
+def get_parquet_schema():
+    import pyarrow as pa
+    fields = []
+    for column in DCP_COLUMNS:
+        if column in INTEGER_COLUMNS:
+            fields.append(pa.field(column, pa.int32()))
+        elif column in DICTIONARY_COLUMNS:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    return pa.schema(fields)
+
+
+def get_partition_dir(parquet_dir, prog_year, month):
+    return os.path.join(parquet_dir, f"program_year={prog_year}", f"month={month}")
+
+
+class ParquetWriter(MonthWriter):
+    ''' Writes a Parquet file for each month of DCP data (see MonthWriter). Writing a month again replaces its file,
+        so re-running an extraction doesn't duplicate data '''
+
+    def __init__(self, parquet_dir=DEFAULT_PARQUET_DIR):
+        super().__init__()
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.parquet_dir = parquet_dir
+        self.schema = get_parquet_schema()
+
+    def write_month(self, rows, prog_year, month, districts):
+        # build the table column by column
+        arrays = [self.pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(self.schema)]
+        table = self.pa.Table.from_arrays(arrays, schema=self.schema)
+        partition_dir = get_partition_dir(self.parquet_dir, prog_year, month)
+        os.makedirs(partition_dir, exist_ok=True)
+        with replacing_file(os.path.join(partition_dir, 'part-0.parquet')) as temp_filename:
+            self.pq.write_table(table, temp_filename, compression='zstd')
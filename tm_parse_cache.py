@@ -0,0 +1,102 @@
+import os, time, pickle, zlib, sqlite3, hashlib
+
+# A persistent cache of extract_Club_data() results, keyed by the SHA-1 of the page HTML.
+# Reading a few KB of already-parsed rows is much cheaper than parsing a ~300 KB page again, so any script
+# that parses the saved pages (the extractor, ad-hoc analysis, ...) can share the cache:
+#
+#   from tm_parse_cache import ParseCache, cached_extract
+#   cache = ParseCache()
+#   dcp_data = cached_extract(html, cache)
+#
+# The rows are stored pickled and zlib-compressed in one SQLite table. When the cache grows past its size cap,
+# the least recently used entries are evicted.
+
+DEFAULT_CACHE_PATH = './CACHE/parsed_pages.sqlite'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# bump this when a change to the parser engines changes their output, so older cached results are not used
+PARSE_CACHE_VERSION = 1
+
+
+def get_html_digest(html):
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    return hashlib.sha1(html).hexdigest()
+
+
+class ParseCache:
+    ''' An LRU-evicted SQLite cache of parsed DCP data rows. Several processes can use the same cache file '''
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS parsed_pages (
+            digest TEXT PRIMARY KEY, version INTEGER, rows BLOB, size INTEGER, last_used REAL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS parsed_pages_last_used ON parsed_pages (last_used)')
+        self.conn.commit()
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM parsed_pages').fetchone()[0]
+
+    def get(self, digest):
+        ''' Returns the cached rows for the page with this digest, or None '''
+        row = self.conn.execute('SELECT rows FROM parsed_pages WHERE digest = ? AND version = ?',
+                                (digest, PARSE_CACHE_VERSION)).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute('UPDATE parsed_pages SET last_used = ? WHERE digest = ?', (time.time(), digest))
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, digest, dcp_data):
+        blob = zlib.compress(pickle.dumps(dcp_data, protocol=pickle.HIGHEST_PROTOCOL))
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO parsed_pages (digest, version, rows, size, last_used) '
+                              'VALUES (?, ?, ?, ?, ?)',
+                              (digest, PARSE_CACHE_VERSION, blob, len(blob), time.time()))
+        self.total_bytes += len(blob)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        ''' Deletes the least recently used entries until the cache is back under 90% of its size cap '''
+        with self.conn:
+            self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM parsed_pages').fetchone()[0]
+            target = self.max_bytes * 0.9
+            for digest, size in self.conn.execute('SELECT digest, size FROM parsed_pages ORDER BY last_used').fetchall():
+                if self.total_bytes <= target:
+                    break
+                self.conn.execute('DELETE FROM parsed_pages WHERE digest = ?', (digest,))
+                self.total_bytes -= size
+
+    def close(self):
+        self.conn.close()
+
+
+def cached_extract(html, cache, extract=None, stats=None):
+    ''' Returns the DCP data for the page, from the cache if this exact page has been parsed before,
+        otherwise by parsing it with `extract` (default: the lxml engine) and caching the result.
+        If `stats` (a dict) is supplied, stats['parse_cache'] is set to 'hit' or 'miss' '''
+    digest = get_html_digest(html)
+    dcp_data = cache.get(digest)
+    if stats is not None:
+        stats['parse_cache'] = 'miss' if dcp_data is None else 'hit'
+    if dcp_data is None:
+        if extract is None:
+            from Extract_Club_data_from_HTML import extract_Club_data_lxml as extract
+        dcp_data = extract(html)
+        if dcp_data:
+            cache.put(digest, dcp_data)
+    return dcp_data
+
+
+# caches opened by get_parse_cache(), kept open for the life of the process (one per worker process)
+_open_caches = {}
+
+
+def get_parse_cache(path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+    if path not in _open_caches:
+        _open_caches[path] = ParseCache(path, max_bytes)
+    return _open_caches[path]
@@ -0,0 +1,113 @@
+import os, sys, argparse
+
+from Extract_Club_data_from_HTML import DCP_COLUMNS, TM_MONTHS, MonthWriter, district_sort_key, write_csv_file
+from tm_month_deltas import load_month
+
+# District, division and area totals ("rollups") of the clubs' DCP data, worked out once per program year and month
+# and saved as a small table per month:
+#   ./ROLLUPS/{program year}_{month}.csv
+# with a row for each district (Level "district", empty Division and Area), each division in a district
+# (Level "division") and each area in a division (Level "area"), and the columns in ROLLUP_COLUMNS:
+# the number of clubs, by club status and distinguished status, and the total membership base, active members,
+# net growth and goals met.
+# The rollups can be worked out as the pages are extracted:
+#   python ./Extract_Club_data_from_HTML.py ./HTML/2022-2023 --rollups
+# or from the extracted CSV files:
+#   python ./tm_rollups.py 2022-2023
+
+DEFAULT_ROLLUP_DIR = './ROLLUPS'
+DEFAULT_CSV_DIR = './CSVs'
+
+# the grouping columns of each level
+ROLLUP_LEVELS = {
+    'district': ("District",),
+    'division': ("District", "Division"),
+    'area': ("District", "Division", "Area"),
+}
+
+ROLLUP_COLUMNS = ("Clubs", "Active Clubs", "Low Clubs", "Ineligible Clubs", "Suspended Clubs",
+                  "Distinguished Clubs", "Select Distinguished Clubs", "President's Distinguished Clubs",
+                  "Mem. Base", "Active Members", "Net Growth", "Goals Met")
+ROLLUP_FILE_COLUMNS = ("Program Year", "Month", "Level", "District", "Division", "Area") + ROLLUP_COLUMNS
+
+# the Club Status column counted in each of the club status columns ('Suspended' is followed by the date)
+CLUB_STATUS_COUNTS = (("Active", 1), ("Low", 2), ("Ineligible", 3), ("Suspended", 4))
+# the Club Distinguished Status codes counted in each of the distinguished columns
+DISTINGUISHED_COUNTS = {"D": 5, "S": 6, "P": 7}
+
+DISTRICT, DIVISION, AREA, CLUB_STATUS, MEM_BASE, ACTIVE_MEMBERS, GOALS_MET, DISTINGUISHED_STATUS = (
+    DCP_COLUMNS.index(column) for column in ("District", "Division", "Area", "Club Status", "Mem. Base",
+                                             "Active Members", "Goals Met", "Club Distinguished Status"))
+
+
+def club_totals(row):
+    ''' The ROLLUP_COLUMNS values of a single club (a row in DCP_COLUMNS order - the counts can be ints or strings) '''
+    totals = [1] + [0] * (len(ROLLUP_COLUMNS) - 1)
+    for status, i in CLUB_STATUS_COUNTS:
+        if row[CLUB_STATUS].startswith(status):
+            totals[i] = 1
+    if row[DISTINGUISHED_STATUS] in DISTINGUISHED_COUNTS:
+        totals[DISTINGUISHED_COUNTS[row[DISTINGUISHED_STATUS]]] = 1
+    base, active = int(row[MEM_BASE]), int(row[ACTIVE_MEMBERS])
+    totals[8:] = [base, active, active - base, int(row[GOALS_MET])]
+    return totals
+
+
+def compute_rollups(rows, prog_year, month):
+    ''' Returns the ROLLUP_FILE_COLUMNS rows for a month's rows (in DCP_COLUMNS order), districts in district order,
+        each followed by its divisions and their areas '''
+    groups = {}
+    for row in rows:
+        totals = club_totals(row)
+        for key in ((row[DISTRICT],), (row[DISTRICT], row[DIVISION]), (row[DISTRICT], row[DIVISION], row[AREA])):
+            group = groups.get(key)
+            if group is None:
+                groups[key] = list(totals)
+            else:
+                for i, value in enumerate(totals):
+                    group[i] += value
+    levels = {len(columns): level for level, columns in ROLLUP_LEVELS.items()}
+    rollups = []
+    for key in sorted(groups, key=lambda key: (district_sort_key(key[0]),) + key[1:]):
+        padded_key = list(key) + [''] * (3 - len(key))
+        rollups.append([prog_year, str(month), levels[len(key)]] + padded_key + groups[key])
+    return rollups
+
+
+def get_rollup_filename(prog_year, month, rollup_dir=DEFAULT_ROLLUP_DIR):
+    return os.path.join(rollup_dir, f"{prog_year}_{month}.csv")
+
+
+def write_rollups(rollups, prog_year, month, rollup_dir=DEFAULT_ROLLUP_DIR):
+    os.makedirs(rollup_dir, exist_ok=True)
+    return write_csv_file(get_rollup_filename(prog_year, month, rollup_dir), ROLLUP_FILE_COLUMNS, rollups)
+
+
+class RollupWriter(MonthWriter):
+    ''' Works out and writes each month's rollups as the pages are extracted (see MonthWriter) '''
+
+    def __init__(self, rollup_dir=DEFAULT_ROLLUP_DIR):
+        super().__init__()
+        self.rollup_dir = rollup_dir
+
+    def write_month(self, rows, prog_year, month, districts):
+        write_rollups(compute_rollups(rows, prog_year, month), prog_year, month, self.rollup_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('program_year', help="e.g. 2022-2023")
+    parser.add_argument('months', nargs='*', help="default: every month of the program year with data")
+    parser.add_argument('--csv-dir', default=DEFAULT_CSV_DIR, help=f"default {DEFAULT_CSV_DIR}")
+    parser.add_argument('--rollup-dir', default=DEFAULT_ROLLUP_DIR, help=f"default {DEFAULT_ROLLUP_DIR}")
+    args = parser.parse_args()
+
+    for month in args.months or TM_MONTHS:
+        rows = load_month(args.program_year, month, args.csv_dir)
+        if rows is None:
+            if args.months:
+                print(f"{args.program_year} month {month:>2}: no data in {args.csv_dir}", file=sys.stderr)
+            continue
+        rollups = compute_rollups(rows, args.program_year, month)
+        filename = write_rollups(rollups, args.program_year, month, args.rollup_dir)
+        print(f"{args.program_year} month {month:>2}: {len(rows)} clubs, {len(rollups)} rollup rows - {filename}")
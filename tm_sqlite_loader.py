@@ -0,0 +1,67 @@
+import os, sqlite3
+
+from Extract_Club_data_from_HTML import DCP_COLUMNS, INTEGER_COLUMNS, MonthWriter
+
+# Loads the rows produced by extract_Club_data() into a single SQLite database for all program years
+# (./DB/club_performance.sqlite by default), instead of one database per (year, district) like
+# alt_Get_and_extract_TM_monthly_Club_Perf_data.py. The table has the same columns as the CSV files.
+#
+# The database is in WAL mode, each month is loaded with batched executemany() calls inside one transaction,
+# and there are indexes on (Program Year, Month, District) and on Club Number, so a club's history across
+# all the years can be looked up directly, e.g.
+#   SELECT * FROM club_performance WHERE "Club Number" = 977 ORDER BY "Program Year", "Month"
+
+DEFAULT_DB_PATH = './DB/club_performance.sqlite'
+
+# executemany() batch size
+BATCH_SIZE = 5000
+
+
+def quote_column(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def create_schema(conn):
+    columns = ',\n        '.join(f"{quote_column(column)} {'INTEGER' if column in INTEGER_COLUMNS else 'TEXT'}"
+                                  for column in DCP_COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS club_performance (\n        {columns}\n    )")
+    conn.execute('CREATE INDEX IF NOT EXISTS club_performance_year_month_district '
+                 'ON club_performance ("Program Year", "Month", "District")')
+    conn.execute('CREATE INDEX IF NOT EXISTS club_performance_club_number ON club_performance ("Club Number")')
+    conn.commit()
+
+
+def open_database(path=DEFAULT_DB_PATH):
+    ''' Opens (creating if necessary) the club performance database, in WAL mode '''
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # with WAL, NORMAL is still crash-safe for the database - a power loss can only lose the last transactions
+    conn.execute('PRAGMA synchronous=NORMAL')
+    create_schema(conn)
+    return conn
+
+
+class SQLiteLoader(MonthWriter):
+    ''' Loads each month of DCP data in one transaction (see MonthWriter). Loading a (program year, month, district)
+        replaces any rows that were loaded for it before, so re-running an extraction doesn't duplicate data '''
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        super().__init__()
+        self.path = path
+        self.conn = open_database(path)
+        placeholders = ', '.join('?' * len(DCP_COLUMNS))
+        self.insert_stmt = (f"INSERT INTO club_performance ({', '.join(quote_column(c) for c in DCP_COLUMNS)}) "
+                            f"VALUES ({placeholders})")
+
+    def write_month(self, rows, prog_year, month, districts):
+        with self.conn:
+            self.conn.executemany('DELETE FROM club_performance WHERE "Program Year" = ? AND "Month" = ? AND "District" = ?',
+                                  [(prog_year, int(month), district) for district in districts])
+            for start in range(0, len(rows), BATCH_SIZE):
+                self.conn.executemany(self.insert_stmt, rows[start:start + BATCH_SIZE])
+
+    def close(self):
+        self.conn.close()
+
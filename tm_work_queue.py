@@ -0,0 +1,363 @@
+import os, sys, time, json, random, shutil, socket, sqlite3, argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from Get_TM_monthly_Club_Perf_HTML import (DASHBOARDS_URL, get_club_perf_url, get_month_district_list, download_page,
+                                           InvalidPageError, INVALID_PAGE_RETRIES)
+from Extract_Club_data_from_HTML import (PARSER_ENGINES, TM_MONTHS, DCPCSVWriter, read_and_extract, iter_source_pages,
+                                         DCP_COLUMNS, get_output_CSV_filename, log_problem_html, district_sort_key)
+from tm_html_store import HTMLDirectoryStore
+from tm_district_roster import DistrictRoster
+from tm_http_client import backoff_delay
+
+# A work queue for rebuilding the dataset in parallel - by (program year, month, district) - with any number of
+# worker processes, on one machine or on several machines that share a filesystem.
+# The queue is a SQLite database (./QUEUE/work_queue.sqlite by default). It holds two kinds of task:
+#   download - download one district page into {html dir}/{program year}/{month}/{district}.html (like the downloader)
+#   extract  - extract one district page into its own CSV part file, ./QUEUE/parts/{program year}/{month}/{district}.csv
+# A worker claims one task at a time, inside a locked transaction, so no two workers get the same task.
+# A claim is a lease: if the worker dies, the task is handed out again once the lease has run out.
+# A task that raises an error is put back in the queue, but isn't handed out again until after a backoff delay
+# (it's held back with its lease_until), so a struggling site isn't asked for the same page straight away.
+# Once the extract tasks are done, `merge` joins a program year's parts into ./CSVs/{program year}.csv, in the same order
+# as the extractor writes it, e.g.
+#   python ./tm_work_queue.py enqueue-downloads 2015-2016 --extract   (the district lists are fetched here, once)
+#   python ./tm_work_queue.py work --processes 4                      (on each machine)
+#   python ./tm_work_queue.py merge 2015-2016
+# The queue database uses SQLite's default rollback journal (not WAL, which doesn't work over a network filesystem),
+# so the shared filesystem's file locking has to work (NFS with lockd, SMB).
+# Downloads are still made politely - each worker waits up to 3 seconds between the pages it downloads.
+
+DEFAULT_QUEUE_PATH = './QUEUE/work_queue.sqlite'
+DEFAULT_PARTS_DIR = './QUEUE/parts'
+TASK_KINDS = ('download', 'extract')
+
+
+def get_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    ''' The task queue (see the top of this module). Each process should open its own WorkQueue '''
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, max_attempts=3, retry_delay=30.0, max_retry_delay=600.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        # the backoff before a task that raised an error is handed out again (see fail())
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # autocommit mode, so the transactions (and their locks) are taken explicitly - see claim()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY, kind TEXT, program_year TEXT, month TEXT, district TEXT, payload TEXT,
+            status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, worker TEXT, lease_until REAL, note TEXT,
+            UNIQUE (kind, program_year, month, district))''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, kind)')
+
+    def add(self, kind, program_year, month, district, payload, requeue=False):
+        ''' Adds a task. A task that is already queued is left alone, except that a failed one is queued again
+            (and, with `requeue`, so is a finished one) '''
+        statuses = ('failed', 'done') if requeue else ('failed',)
+        self.conn.execute(f'''INSERT INTO tasks (kind, program_year, month, district, payload) VALUES (?, ?, ?, ?, ?)
+                              ON CONFLICT (kind, program_year, month, district)
+                              DO UPDATE SET payload = excluded.payload, status = 'pending', attempts = 0, lease_until = NULL,
+                                            note = NULL
+                              WHERE status IN ({','.join('?' * len(statuses))})''',
+                          (kind, program_year, month, district, json.dumps(payload), *statuses))
+
+    def claim(self, worker, kinds=TASK_KINDS, lease_seconds=600):
+        ''' Claims the next pending task of one of the `kinds` (or one whose lease has run out) for `worker`.
+            A pending task that is waiting out its retry delay (see fail()) is left for later.
+            Returns the task as a dict (with its payload decoded), or None if there is nothing to do right now '''
+        now = time.time()
+        # BEGIN IMMEDIATE takes the database's write lock before looking, so two workers can't claim the same task
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # a task whose lease has run out after its last attempt isn't handed out again (its worker probably died
+            # on it - e.g. a page that crashes the parser)
+            self.conn.execute(f'''UPDATE tasks SET status = 'failed', lease_until = NULL,
+                                   note = 'lease ran out after ' || attempts || ' attempts (last worker ' || worker || ')'
+                                   WHERE kind IN ({','.join('?' * len(kinds))}) AND status = 'claimed'
+                                   AND lease_until < ? AND attempts >= ?''', (*kinds, now, self.max_attempts))
+            cursor = self.conn.execute(f'''SELECT * FROM tasks WHERE kind IN ({','.join('?' * len(kinds))})
+                                           AND ((status = 'pending' AND (lease_until IS NULL OR lease_until < ?))
+                                                OR (status = 'claimed' AND lease_until < ?))
+                                           ORDER BY id LIMIT 1''', (*kinds, now, now))
+            row = cursor.fetchone()
+            if row is None:
+                self.conn.execute('COMMIT')
+                return None
+            task = dict(zip([column[0] for column in cursor.description], row))
+            self.conn.execute('''UPDATE tasks SET status = 'claimed', worker = ?, lease_until = ?, attempts = attempts + 1
+                                 WHERE id = ?''', (worker, now + lease_seconds, task['id']))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        # the task as it now is in the queue - complete() and fail() check it is still this worker's
+        task.update(status='claimed', worker=worker, lease_until=now + lease_seconds, attempts=task['attempts'] + 1)
+        task['payload'] = json.loads(task['payload'])
+        return task
+
+    def complete(self, task, note=None):
+        ''' Marks a claimed task done. Returns False (and changes nothing) if the task is no longer claimed by
+            task['worker'] - its lease ran out and it has been handed to another worker, or marked failed '''
+        cursor = self.conn.execute('''UPDATE tasks SET status = 'done', lease_until = NULL, note = ?
+                                      WHERE status = 'claimed' AND id = ? AND worker = ?''',
+                                   (note, task['id'], task['worker']))
+        return cursor.rowcount > 0
+
+    def fail(self, task, error):
+        ''' Puts a task back in the queue after an error, or marks it failed once it has had max_attempts.
+            A task put back isn't handed out again until after a backoff_delay() (longer after each attempt).
+            Returns False (and changes nothing) if the task is no longer claimed by task['worker'], like complete() '''
+        if task['attempts'] >= self.max_attempts:
+            status, retry_at = 'failed', None
+        else:
+            status = 'pending'
+            retry_at = time.time() + backoff_delay(task['attempts'] - 1, self.retry_delay, self.max_retry_delay)
+        cursor = self.conn.execute('''UPDATE tasks SET status = ?, lease_until = ?, note = ?
+                                      WHERE status = 'claimed' AND id = ? AND worker = ?''',
+                                   (status, retry_at, error, task['id'], task['worker']))
+        return cursor.rowcount > 0
+
+    def has_unfinished(self, kinds=TASK_KINDS):
+        ''' True if any task of the `kinds` is still pending or claimed (a download task can add an extract task) '''
+        return self.conn.execute(f'''SELECT 1 FROM tasks WHERE kind IN ({','.join('?' * len(kinds))})
+                                     AND status IN ('pending', 'claimed') LIMIT 1''', kinds).fetchone() is not None
+
+    def done_tasks(self, kind, program_year):
+        ''' Returns the (month, district) of each of a program year's tasks of `kind` that are done '''
+        return self.conn.execute('''SELECT month, district FROM tasks WHERE kind = ? AND program_year = ?
+                                    AND status = 'done' ''', (kind, program_year)).fetchall()
+
+    def unfinished_counts(self, program_year):
+        ''' Returns {(kind, status): count} for a program year's tasks that aren't done '''
+        return {(kind, status): count for kind, year, status, count in self.summary()
+                if year == program_year and status != 'done'}
+
+    def summary(self):
+        ''' Returns [(kind, program_year, status, count)] '''
+        return self.conn.execute('''SELECT kind, program_year, status, COUNT(*) FROM tasks
+                                    GROUP BY kind, program_year, status ORDER BY kind, program_year, status''').fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def get_part_filename(parts_dir, program_year, month, district):
+    return os.path.join(parts_dir, program_year, month, f"{district}.csv")
+
+
+def enqueue_downloads(queue, program_year, months, districts=None, base_url=DASHBOARDS_URL, html_dir='./HTML',
+                      extract=False, requeue=False):
+    ''' Queues a download task for each district page of the months. The district lists are fetched here
+        (or taken from the district roster cache, if they have been fetched before - see tm_district_roster.py).
+        With `extract`, each downloaded page gets an extract task too. Returns the number of tasks queued '''
+    roster = DistrictRoster()
+    count = 0
+    for month in months:
+        url = get_club_perf_url(program_year, month, base_url)
+        district_list = get_month_district_list(url, program_year, month, roster, store=HTMLDirectoryStore(html_dir, program_year))
+        if districts:
+            district_list = [d for d in district_list if d in districts]
+        for district in district_list:
+            queue.add('download', program_year, month, district,
+                      {'url': url.format(program_year, month, district), 'html_dir': html_dir, 'extract': extract},
+                      requeue)
+            count += 1
+    return count
+
+
+def enqueue_extracts(queue, html_src, requeue=False):
+    ''' Queues an extract task for each district page in an HTML source (see iter_source_pages()).
+        Returns the number of tasks queued '''
+    count = 0
+    for program_year, month, district, location in iter_source_pages(html_src):
+        queue.add('extract', program_year, month, district, {'location': location}, requeue)
+        count += 1
+    return count
+
+
+def run_download_task(queue, task):
+    store = HTMLDirectoryStore(task['payload']['html_dir'], task['program_year'])
+    result = download_page(task['payload']['url'], store, task['month'], task['district'])
+    if result == 'invalid':
+        # the site kept sending its error page - put the task back in the queue for later (see WorkQueue.fail())
+        raise InvalidPageError(f"the page was still invalid after {INVALID_PAGE_RETRIES} retries")
+    if task['payload'].get('extract'):
+        # a page that has just been (re)downloaded is extracted again
+        queue.add('extract', task['program_year'], task['month'], task['district'],
+                  {'location': store.page_filename(task['month'], task['district'])}, requeue=result == 'saved')
+    if result != 'skipped':
+        time.sleep(3 * random.random())
+    return result
+
+
+def run_extract_task(task, parts_dir=DEFAULT_PARTS_DIR, engine='bs4', table_only=False, raw_bytes=False,
+                     source_encoding='utf-8'):
+    ''' Extracts one page into its CSV part file. Returns the problem with the page ('' if there wasn't one) -
+        a problem page is logged like the extractor does, and gets no part file '''
+    location = task['payload']['location']
+    if isinstance(location, list):
+        # an archived page - (archive path, month, district)
+        location = tuple(location)
+    program_year, month, district = task['program_year'], task['month'], task['district']
+    dcp_data, problem, _stats = read_and_extract(location, engine, table_only=table_only, raw_bytes=raw_bytes,
+                                                 source_encoding=source_encoding)
+    part_filename = get_part_filename(parts_dir, program_year, month, district)
+    if problem:
+        log_problem_html(program_year, month, district)
+        if os.path.exists(part_filename):
+            os.remove(part_filename)
+        return problem
+    os.makedirs(os.path.dirname(part_filename), exist_ok=True)
+    # write to a temporary file and rename it, so merge_parts() never sees a partly written part
+    temp_filename = f"{part_filename}.{get_worker_id()}.tmp"
+    csv_writer = DCPCSVWriter(temp_filename)
+    csv_writer.write_district(dcp_data, district, program_year, month)
+    csv_writer.close()
+    os.replace(temp_filename, part_filename)
+    return ''
+
+
+def run_worker(queue_path=DEFAULT_QUEUE_PATH, kinds=TASK_KINDS, parts_dir=DEFAULT_PARTS_DIR, engine='bs4',
+               table_only=False, raw_bytes=False, source_encoding='utf-8', lease_seconds=600, poll_seconds=5):
+    ''' Claims and runs tasks until there are none left (waiting while other workers still have tasks claimed,
+        since their downloads can queue more extract tasks). Returns the number of tasks done.
+        This is a module-level function so that it can be run in a worker process '''
+    worker = get_worker_id()
+    queue = WorkQueue(queue_path)
+    done = 0
+    while True:
+        task = queue.claim(worker, kinds, lease_seconds)
+        if task is None:
+            if not queue.has_unfinished(kinds):
+                break
+            time.sleep(poll_seconds)
+            continue
+        try:
+            if task['kind'] == 'download':
+                note = run_download_task(queue, task)
+            else:
+                note = run_extract_task(task, parts_dir, engine, table_only, raw_bytes, source_encoding)
+        except Exception as e:
+            print(f"\n{worker}: {task['kind']} {task['program_year']} {task['month']} {task['district']} raised '{e=}'")
+            if not queue.fail(task, repr(e)):
+                print(f"\n{worker}: lost the lease on {task['kind']} {task['program_year']} {task['month']} {task['district']}")
+            continue
+        if not queue.complete(task, note or None):
+            # another worker has it now (or it was marked failed) - its result stands, not this one
+            print(f"\n{worker}: lost the lease on {task['kind']} {task['program_year']} {task['month']} {task['district']}")
+            continue
+        done += 1
+        sys.stdout.write(f"{task['kind'][0]}:{task['month']}/{task['district']} ")
+        sys.stdout.flush()
+    queue.close()
+    return done
+
+
+def merge_parts(queue, program_year, parts_dir=DEFAULT_PARTS_DIR, output_filename=None, force=False):
+    ''' Joins a program year's CSV part files into one CSV file (by default ./CSVs/{program year}.csv,
+        replacing it), in program year month order and then district order, like the extractor writes them.
+        Only the parts of the `queue`'s finished extract tasks are joined (not parts left over from earlier runs),
+        and it raises ValueError if any of the program year's tasks are still pending, claimed or failed -
+        unless `force`, which joins the parts that are finished. Returns the output filename '''
+    unfinished = queue.unfinished_counts(program_year)
+    if unfinished and not force:
+        raise ValueError(f"{program_year} has unfinished tasks: "
+                         + ', '.join(f"{count} {kind} {status}" for (kind, status), count in sorted(unfinished.items())))
+    done = set(queue.done_tasks('extract', program_year))
+    if output_filename is None:
+        output_filename = get_output_CSV_filename(program_year)
+    with open(output_filename, 'w') as output_fh:
+        # the same header line as create_output_CSV()
+        output_fh.write(','.join(f'"{column}"' for column in DCP_COLUMNS) + '\n')
+    with open(output_filename, 'ab') as output_fh:
+        for month in TM_MONTHS:
+            month_dir = os.path.join(parts_dir, program_year, month)
+            if not os.path.isdir(month_dir):
+                continue
+            # (a finished extract task of a problem page has no part)
+            districts = [os.path.splitext(f)[0] for f in os.listdir(month_dir)
+                         if f.endswith('.csv') and (month, os.path.splitext(f)[0]) in done]
+            for district in sorted(districts, key=district_sort_key):
+                with open(os.path.join(month_dir, f"{district}.csv"), 'rb') as part_fh:
+                    shutil.copyfileobj(part_fh, output_fh)
+    return output_filename
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help=f"queue database (default {DEFAULT_QUEUE_PATH})")
+    parser.add_argument('--parts-dir', default=DEFAULT_PARTS_DIR,
+                        help=f"directory for the extract tasks' CSV part files (default {DEFAULT_PARTS_DIR})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    download_parser = subparsers.add_parser('enqueue-downloads', help="queue the district pages of a program year for downloading")
+    download_parser.add_argument('program_year', help="e.g. 2015-2016")
+    download_parser.add_argument('months', nargs='*', help="months to download (default: the whole program year)")
+    download_parser.add_argument('--districts', nargs='+', help="only these districts, e.g. '--districts 01 55 F'")
+    download_parser.add_argument('--base-url', default=DASHBOARDS_URL)
+    download_parser.add_argument('--html-dir', default='./HTML', help="directory the HTML files are saved in (default ./HTML)")
+    download_parser.add_argument('--extract', action='store_true', help="queue an extract task for each downloaded page")
+    download_parser.add_argument('--again', action='store_true', help="queue tasks that have already been done again")
+
+    extract_parser = subparsers.add_parser('enqueue-extracts', help="queue the pages of an HTML source for extraction")
+    extract_parser.add_argument('html_src', help="e.g. ./HTML/2021-2022, ./HTML/2020-2021/6 or ./HTML/2021-2022.htmlarc")
+    extract_parser.add_argument('--again', action='store_true', help="queue tasks that have already been done again")
+
+    work_parser = subparsers.add_parser('work', help="run queued tasks until there are none left")
+    work_parser.add_argument('--processes', type=int, default=1, help="number of worker processes (default 1)")
+    work_parser.add_argument('--kinds', nargs='+', choices=TASK_KINDS, default=list(TASK_KINDS),
+                             help="only run these kinds of task (e.g. downloads on one machine, extracts on others)")
+    work_parser.add_argument('--engine', choices=PARSER_ENGINES.keys(), default='bs4')
+    work_parser.add_argument('--table-only', action='store_true')
+    work_parser.add_argument('--raw-bytes', action='store_true')
+    work_parser.add_argument('--source-encoding', default='utf-8')
+    work_parser.add_argument('--lease', type=int, default=600,
+                             help="seconds before a claimed task is handed to another worker (default 600)")
+
+    merge_parser = subparsers.add_parser('merge', help="join a program year's CSV parts into ./CSVs/{program year}.csv")
+    merge_parser.add_argument('program_year')
+    merge_parser.add_argument('--output', default=None, help="output CSV file (default ./CSVs/{program year}.csv)")
+    merge_parser.add_argument('--force', action='store_true',
+                              help="join the finished parts even if some of the year's tasks are unfinished or failed")
+
+    subparsers.add_parser('status', help="show the number of tasks of each kind and status")
+    args = parser.parse_args()
+
+    for directory in ('./CSVs', './LOGS/PROBLEM_HTMLs'):
+        os.makedirs(directory, exist_ok=True)
+
+    if args.command == 'work':
+        worker_args = (args.queue, args.kinds, args.parts_dir, args.engine, args.table_only, args.raw_bytes,
+                       args.source_encoding, args.lease)
+        if args.processes > 1:
+            with ProcessPoolExecutor(max_workers=args.processes) as executor:
+                futures = [executor.submit(run_worker, *worker_args) for _ in range(args.processes)]
+                done = sum(future.result() for future in futures)
+        else:
+            done = run_worker(*worker_args)
+        print(f"\n{done} tasks done")
+    else:
+        queue = WorkQueue(args.queue)
+        if args.command == 'merge':
+            try:
+                print(f"Merged the parts into {merge_parts(queue, args.program_year, args.parts_dir, args.output, args.force)}")
+            except ValueError as e:
+                print(f"Not merged - {e} (see status, or use --force)", file=sys.stderr)
+                queue.close()
+                sys.exit(1)
+        elif args.command == 'enqueue-downloads':
+            months = tuple(args.months) or TM_MONTHS
+            count = enqueue_downloads(queue, args.program_year, months, args.districts, args.base_url, args.html_dir,
+                                      args.extract, args.again)
+            print(f"Queued {count} download tasks")
+        elif args.command == 'enqueue-extracts':
+            print(f"Queued {enqueue_extracts(queue, args.html_src, args.again)} extract tasks")
+        else:
+            for kind, program_year, status, count in queue.summary():
+                print(f"{kind:>8} {program_year} {status:>8}: {count}")
+        queue.close()